@@ -1,127 +1,431 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, send_from_directory
 from flask_socketio import SocketIO, emit, join_room, leave_room
-import requests
 import json
 import os
 import random
+import threading
 import time
 from datetime import datetime
 import uuid
-import numpy as np
 import base64
-from PIL import Image
-from io import BytesIO
+import functools
+from werkzeug.exceptions import RequestEntityTooLarge
 from openai import OpenAI
 from dotenv import load_dotenv
+from generation import GenerationEngine
+from fallback_pool import FallbackPool
+from ingest import download_image, sniff_image_type
+from image_cache import ImageCache
+from assets import AssetManifest
+from description_cache import DescriptionCache
+from storage import StorageManager
+from state import create_state_store
+from room_registry import RoomRegistry
+from turn_timers import TurnTimers
+from game_sweeper import GameArchive, GameSweeper
+from game_model import Game
+from lifecycle import Lifecycle
+from providers import Provider, close_stream
+from ratelimit import ACTIVE_TURN, BACKGROUND, VISION, RateLimitScheduler, TokenBucket
+from uploads import UploadError, UploadTooLarge, read_data_url, save_upload
+import derivatives
+import metrics
+import strokes
+import tracing
+import vision_prep
 
 # Set your API key
 load_dotenv(".env")
 
-app = Flask(__name__)
+# Static files are served by static_file() below, with caching headers
+app = Flask(__name__, static_folder=None)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Let a proxy in front (nginx X-Accel / Apache mod_xsendfile) send static files itself
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', '0') == '1'
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_MB', 5)) * 1024 * 1024  # largest drawing we accept
+# Requests and Socket.IO messages may be a bit bigger: legacy clients send base64 data URLs
+MAX_REQUEST_BYTES = MAX_UPLOAD_BYTES * 4 // 3 + 64 * 1024
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
 
-# Game state storage (in production, use Redis or database)
-games = {}
-rooms = {}
-room_creators = {}  # Track who created each room
-room_settings = {}  # Store settings per room
+# Game state storage: in-memory by default, or shared through Redis so several
+# server processes (behind a sticky load balancer) can host the same rooms
+REDIS_URL = os.getenv('TELEPROMPT_REDIS_URL')
+state = create_state_store(REDIS_URL)
+games = state.games
+rooms = state.rooms
+room_creators = state.room_creators  # Track who created each room
+room_settings = state.room_settings  # Store settings per room
+# Players per room keyed by name, plus a socket id -> room index for disconnects
+room_registry = RoomRegistry(state, rooms)
+
+class TracedSocketIO(SocketIO):
+    """SocketIO whose emits are spans of the turn being traced (emit() from handlers lands here too)"""
+    
+    def emit(self, event, *args, **kwargs):
+        with tracing.span(f'emit {event}') as span:
+            if span.recording:
+                span.size = tracing.payload_size(args)
+            return super().emit(event, *args, **kwargs)
+
+# eventlet or gevent when started with run.py --production (which monkey-patches first)
+ASYNC_MODE = os.getenv('TELEPROMPT_ASYNC_MODE') or None
+socketio = TracedSocketIO(app, cors_allowed_origins="*", message_queue=state.message_queue,
+                          max_http_buffer_size=MAX_REQUEST_BYTES, async_mode=ASYNC_MODE)
+
+# Content digests of static/img and friends, for versioned URLs and ETags
+asset_manifest = AssetManifest('static', spawn=socketio.start_background_task, sleep=socketio.sleep)
+
+def image_set(image_path):
+    """WebP/JPEG sizes of a generated image for srcset, or None (see derivatives.image_set)"""
+    return derivatives.image_set(image_path, url=asset_manifest.url)
+
+# Templates link static files with asset_url(path) and pick image sizes with image_set(path)
+app.jinja_env.globals['asset_url'] = asset_manifest.url
+app.jinja_env.globals['image_set'] = image_set
 
 # Configuration
 MIN_PLAYERS = 4
 PROMPT_TIMEOUT = 20  # seconds, 'your-token-here'
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
+GENERATION_WORKERS = int(os.getenv('GENERATION_WORKERS', 4))  # max concurrent OpenAI image calls
+GENERATION_QUEUE_LIMIT = int(os.getenv('GENERATION_QUEUE_LIMIT', 200))
+IMAGE_MODEL = "dall-e-2"
+IMAGE_SIZE = "1024x1024"
+IMAGE_CACHE_ENABLED = os.getenv('IMAGE_CACHE_ENABLED', '1') == '1'
+IMAGE_CACHE_DIR = 'static/image_cache'
+STARTING_IMAGE = 'static/img/starting-img.png'  # first image of classic and simultaneous games
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_MB', 500)) * 1024 * 1024
+DESCRIPTION_CACHE_ENABLED = os.getenv('DESCRIPTION_CACHE_ENABLED', '1') == '1'
+DESCRIPTION_CACHE_MAX_ENTRIES = int(os.getenv('DESCRIPTION_CACHE_MAX_ENTRIES', 5000))
+DESCRIPTION_MATCH_DISTANCE = int(os.getenv('DESCRIPTION_MATCH_DISTANCE', 6))  # hash bits a near-duplicate may differ by
+RESULTS_TTL = 3600  # seconds a finished game's results page (and its images) stay around
+MAX_RESIDENT_GAMES = int(os.getenv('MAX_RESIDENT_GAMES', 500))  # more than this and finished games are archived
+GAME_ABANDONED_TTL = int(os.getenv('GAME_ABANDONED_TTL', 600))  # seconds a running game may sit with nobody in it
+GAME_SWEEP_INTERVAL = 30  # seconds between sweeps of the games mapping
+STORAGE_MAX_BYTES = int(os.getenv('STORAGE_MAX_MB', 1024)) * 1024 * 1024  # budget for generated images and drawings
+FALLBACK_POOL_DIR = 'static/fallback_pool'
+FALLBACK_POOL_SIZE = int(os.getenv('FALLBACK_POOL_SIZE', 8))  # ready fallback images to keep on disk
+FALLBACK_POOL_LOW_WATER = int(os.getenv('FALLBACK_POOL_LOW_WATER', 3))  # refill when this few are left
+TURN_GRACE_SECONDS = 1  # slack after the time limit for a submit already in flight
+TURN_RESCUE_RETRY_DELAYS = (2, 5, 15)  # seconds between retries when a failed turn cannot be finished
+TURN_TIMER_RESOLUTION = 0.25  # seconds between checks for expired turns
+PROVIDER_MIN_SECONDS = float(os.getenv('PROVIDER_MIN_SECONDS', 15))  # OpenAI budget even when the turn is nearly over
+PROVIDER_MAX_SECONDS = float(os.getenv('PROVIDER_MAX_SECONDS', 60))  # and never more than this
+PROVIDER_HEDGE_QUANTILE = float(os.getenv('PROVIDER_HEDGE_QUANTILE', 0.9))  # send a duplicate call once slower than this
+# The OpenAI account's rate limits, shared by every room (0 turns one off)
+OPENAI_IMAGES_PER_MINUTE = float(os.getenv('OPENAI_IMAGES_PER_MINUTE', 50))
+OPENAI_VISION_REQUESTS_PER_MINUTE = float(os.getenv('OPENAI_VISION_REQUESTS_PER_MINUTE', 500))
+OPENAI_VISION_TOKENS_PER_MINUTE = float(os.getenv('OPENAI_VISION_TOKENS_PER_MINUTE', 30000))
+DOWNLOAD_MIN_SECONDS = 5  # time to fetch an image that was already paid for
+VISION_IMAGE_TOKENS = {'low': 85, 'high': 765}  # what a drawing costs the vision model (high: up to four 512 px tiles)
+VISION_PROMPT_TOKENS = 120  # the describe_image instructions
+VISION_MAX_TOKENS = 500  # longest description asked for
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 1.0))  # share of turns traced
+TRACE_BUFFER_SPANS = int(os.getenv('TRACE_BUFFER_SPANS', 5000))  # most recent spans kept for /traces
+# Seconds turn work gets to finish on shutdown before its turn falls back; by default the longest OpenAI call
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', PROVIDER_MAX_SECONDS + DOWNLOAD_MIN_SECONDS))
+DRAIN_FLUSH_SECONDS = 1  # after draining, before exiting
+LAG_PROBE_INTERVAL = 0.1  # seconds between event loop lag samples
+
+DEFAULT_ROOM_SETTINGS = {'time_limit': 20, 'gamemode': 'classic', 'allow_cached': True}
 
-# Initialize OpenAI client
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Prompts used to pre-generate fallback images
+FALLBACK_PROMPTS = [
+    "A beautiful abstract painting with vibrant colors",
+    "A serene landscape with mountains and a lake",
+    "A futuristic city skyline at sunset",
+    "A magical forest with glowing trees",
+    "A cosmic galaxy with swirling stars"
+]
+
+# Turn work in flight, and whether new joins are taken, for graceful shutdown
+lifecycle = Lifecycle(sleep=socketio.sleep)
+
+# Spans of each turn's stages, kept in a ring buffer for /traces
+tracer = tracing.Tracer(capacity=TRACE_BUFFER_SPANS, sample_rate=TRACE_SAMPLE_RATE)
+
+# Initialize OpenAI client (retries are left to the provider layer, which knows the deadline)
+client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0)
+
+# Every OpenAI request waits its turn for the account's rate limits: active turns, then descriptions, then background
+openai_limits = RateLimitScheduler(
+    [TokenBucket(name, per_minute) for name, per_minute in (
+        ('images', OPENAI_IMAGES_PER_MINUTE),
+        ('vision_requests', OPENAI_VISION_REQUESTS_PER_MINUTE),
+        ('vision_tokens', OPENAI_VISION_TOKENS_PER_MINUTE)
+    ) if per_minute > 0],
+    observe=lambda priority, seconds: OPENAI_QUEUE_WAIT_SECONDS.observe(seconds, priority=priority)
+)
+
+# Deadline-bound, hedged OpenAI calls with a circuit breaker per endpoint (no hedges while rate limited)
+image_provider = Provider('openai_images', hedge_quantile=PROVIDER_HEDGE_QUANTILE,
+                          spawn=socketio.start_background_task, busy=openai_limits.busy)
+vision_provider = Provider('openai_vision', hedge_quantile=PROVIDER_HEDGE_QUANTILE,
+                           spawn=socketio.start_background_task, discard=close_stream, busy=openai_limits.busy)
+
+# Shared worker pool for image generation (workers start on first submit)
+generation_engine = GenerationEngine(
+    max_workers=GENERATION_WORKERS,
+    max_queue=GENERATION_QUEUE_LIMIT,
+    spawn=socketio.start_background_task
+)
 
 # Ensure static directories exist
 os.makedirs('static/generated', exist_ok=True)
 os.makedirs('static/img', exist_ok=True)
 
-def generate_image(prompt, room_code):
-    """Generate image using OpenAI DALL-E model"""
+# Reference-counts generated images and drawings per game and sweeps old ones in the background
+storage = StorageManager(
+    ['static/generated', 'static/canvas_drawings'],
+    max_bytes=STORAGE_MAX_BYTES,
+    orphan_ttl=RESULTS_TTL,
+    spawn=socketio.start_background_task,
+    sleep=socketio.sleep,
+    on_delete=derivatives.forget  # image sets stop offering sizes that are gone
+)
+
+# Prompt -> image cache shared by all rooms (rooms can opt out in settings)
+image_cache = ImageCache(IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_BYTES) if IMAGE_CACHE_ENABLED else None
+# Perceptual-hash index of drawing descriptions, kept out of static/ in the instance folder
+description_cache = DescriptionCache(
+    os.path.join(app.instance_path, 'description_index.json'),
+    max_entries=DESCRIPTION_CACHE_MAX_ENTRIES,
+    max_distance=DESCRIPTION_MATCH_DISTANCE
+) if DESCRIPTION_CACHE_ENABLED else None
+
+def generate_image(prompt, room_code, save_dir='static/generated', use_cache=True, deadline=None):
+    """Generate image using OpenAI DALL-E model, giving up at deadline"""
+    deadline = deadline or time.time() + PROVIDER_MAX_SECONDS
     try:
-        # Generate image using OpenAI DALL-E (older API version)
-        response = client.images.generate(
-            model="dall-e-2",
-            prompt=prompt,
-            n=1,
-            size="1024x1024"
-        )
-        
-        # Get the image URL and download it
-        image_url = response.data[0].url
-        image_response = requests.get(image_url)
-        image_bytes = image_response.content
+        # Reuse an earlier image for the same prompt if the room allows it
+        if use_cache and image_cache is not None:
+            with tracing.span('image_cache') as span:
+                cached_path = image_cache.lookup(prompt, IMAGE_MODEL, IMAGE_SIZE, save_dir)
+                span.outcome = 'hit' if cached_path else 'miss'
+            if cached_path:
+                print(f"Cache hit for prompt: '{prompt}' -> {cached_path}")
+                return cached_path
         
-        # Convert the bytes to a PIL Image
-        image = Image.open(BytesIO(image_bytes))
+        started = time.time()
+        # Generate image using OpenAI DALL-E (older API version); rooms' turns go before background work
+        priority = ACTIVE_TURN if room_code is not None else BACKGROUND
+        with OPENAI_GENERATION_SECONDS.time(), tracing.span('openai_generate'):
+            response = image_provider.call(
+                client.images.generate,
+                deadline,
+                admit=functools.partial(openai_limits.admit, {'images': 1}, priority, room_code),
+                model=IMAGE_MODEL,
+                prompt=prompt,
+                n=1,
+                size=IMAGE_SIZE
+            )
         
-        # Convert PIL Image to numpy array
-        numpy_array = np.array(image)
-        
-        # Save generated image
-        image_id = str(uuid.uuid4())
-        image_path = f"static/generated/{image_id}.png"
-        
-        # Save the PIL image directly
-        image.save(image_path, "PNG")
+        # Stream the PNG straight to disk; it is already encoded, so no decode/re-encode
+        image_url = response.data[0].url
+        with IMAGE_DOWNLOAD_SECONDS.time(), tracing.span('download_image') as span:
+            image_path = download_image(image_url, save_dir,
+                                        deadline=max(deadline, time.time() + DOWNLOAD_MIN_SECONDS))
+            span.size = os.path.getsize(image_path)
         
         print(f"Generated image for prompt: '{prompt}' -> {image_path}")
+        
+        if image_cache is not None:
+            try:
+                image_cache.store(prompt, IMAGE_MODEL, IMAGE_SIZE, image_path, time.time() - started)
+            except OSError as e:
+                print(f"Error caching image: {e}")
         return image_path
         
     except Exception as e:
         print(f"Error generating image: {e}")
+        ERRORS.inc(stage='generate_image')
         return None
 
-def get_random_stock_image():
-    """Generate a random DALL-E image as fallback"""
+def run_in_thread(fn, *args):
+    """
+    fn(*args) on a real OS thread. Under eventlet or gevent the generation
+    workers are green threads, and Pillow work there would stall the hub and
+    every socket with it; with threading they already are real threads.
+    """
+    if socketio.async_mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(fn, *args)
+    if socketio.async_mode == 'gevent':
+        import gevent
+        return gevent.get_hub().threadpool.apply(fn, args)
+    return fn(*args)
+
+def generate_fallback_image(prompt, save_dir):
+    """Generate one image for the fallback pool, with all its derivatives"""
+    # Skip the cache lookup so the pool does not fill up with duplicates
+    image_path = generate_image(prompt, None, save_dir=save_dir, use_cache=False)
+    if image_path:
+        try:
+            run_in_thread(derivatives.make_derivatives, image_path)
+        except (OSError, ValueError) as e:
+            print(f"Error making derivatives of {image_path}: {e}")
+    return image_path
+
+def prepare_derivatives(image_path):
+    """
+    Write the small WebP/JPEG copies players see during the turn, and queue
+    the large ones (for the results page) as low-priority background work
+    """
     try:
-        # Generate a random creative prompt for fallback
-        fallback_prompts = [
-            "A beautiful abstract painting with vibrant colors",
-            "A serene landscape with mountains and a lake",
-            "A futuristic city skyline at sunset",
-            "A magical forest with glowing trees",
-            "A cosmic galaxy with swirling stars"
-        ]
-        
-        random_prompt = random.choice(fallback_prompts)
-        print(f"Generating fallback image with prompt: '{random_prompt}'")
-        
-        # Generate image using OpenAI DALL-E (older API version)
-        response = client.images.generate(
-            model="dall-e-2",
-            prompt=random_prompt,
-            n=1,
-            size="1024x1024"
-        )
-        
-        # Get the image URL and download it
-        image_url = response.data[0].url
-        image_response = requests.get(image_url)
-        image_bytes = image_response.content
-        
-        # Convert the bytes to a PIL Image
-        image = Image.open(BytesIO(image_bytes))
-        
-        # Convert PIL Image to numpy array
-        numpy_array = np.array(image)
-        
-        # Save generated image
-        image_id = str(uuid.uuid4())
-        image_path = f"static/generated/{image_id}.png"
-        
-        # Save the PIL image directly
-        image.save(image_path, "PNG")
-        
-        print(f"Generated fallback image: {image_path}")
-        return image_path
-        
-    except Exception as e:
-        print(f"Error generating fallback image: {e}")
-        return None
+        with tracing.span('derivatives'):
+            run_in_thread(derivatives.make_derivatives, image_path, derivatives.TURN_WIDTHS)
+    except (OSError, ValueError) as e:
+        print(f"Error making derivatives of {image_path}: {e}")
+        return
+    
+    def finish_derivatives(job):
+        for path in run_in_thread(derivatives.make_derivatives, image_path):
+            storage.note_file(path)
+        if image_cache is not None:
+            # Later cache hits for this image link these instead of encoding them again
+            image_cache.store_variants(image_path)
+    
+    generation_engine.submit_background(finish_derivatives)
+
+# Warm pool of fallback images, refilled on the generation workers at low priority
+fallback_pool = FallbackPool(
+    FALLBACK_POOL_DIR,
+    FALLBACK_PROMPTS,
+    generate=generate_fallback_image,
+    submit=generation_engine.submit_background,
+    move=derivatives.move_with_variants,
+    target_size=FALLBACK_POOL_SIZE,
+    low_water=FALLBACK_POOL_LOW_WATER
+)
+
+def get_random_stock_image():
+    """
+    Hand out a pre-generated fallback image (instant, never calls OpenAI).
+    Pass it to settle_fallbacks once the turn has or has not used it.
+    """
+    image_path = fallback_pool.take('static/generated')
+    if image_path:
+        print(f"Using fallback image: {image_path}")
+    else:
+        print("Fallback pool is empty, refill queued")
+    return image_path
+
+def settle_fallbacks(taken, used):
+    """
+    Count the fallbacks a turn used and put the pool images it did not use
+    back; taken maps player -> pool image (None for the placeholder), used
+    holds the players whose fallback was recorded
+    """
+    for name, image_path in taken.items():
+        if name in used:
+            FALLBACKS.inc(kind='pool' if image_path else 'placeholder')
+        elif image_path:
+            fallback_pool.put_back(image_path)
+
+background_services_lock = threading.Lock()
+background_services_started = False
+
+def start_background_services():
+    """Start long-running background tasks once the server is handling requests (first call only)"""
+    global background_services_started
+    with background_services_lock:
+        if background_services_started:
+            return
+        background_services_started = True
+    storage.start()
+    turn_timers.start()
+    game_sweeper.start()
+    asset_manifest.start()
+    lag_probe.start()
+    # The starting image is shown in every game; its smaller copies survive restarts
+    if len(derivatives.existing_variants(STARTING_IMAGE)) < len(derivatives.variant_paths(STARTING_IMAGE)):
+        generation_engine.submit_background(lambda job: run_in_thread(derivatives.make_derivatives, STARTING_IMAGE))
+
+def cleanup_room(room_code):
+    """Tear down a room's lobby state, its turn timer and its queued image generation"""
+    room_registry.remove_room(room_code)
+    room_creators.pop(room_code, None)
+    room_settings.pop(room_code, None)
+    generation_engine.cancel_room(room_code)
+    turn_timers.cancel(room_code)
+    tracer.room_ended(room_code)
+    lifecycle.forget_room(room_code)
+
+def evict_game(room_code, game, reason):
+    """Called by the game sweeper after it has taken a game out of the games mapping"""
+    print(f"Evicted game {game.id} in room {room_code} ({reason})")
+    if reason == 'archived':
+        # Results are still served from the archive; the images expire with them
+        return
+    if reason == 'abandoned':
+        cleanup_room(room_code)
+    else:
+        generation_engine.cancel_room(room_code)
+    storage.release(game.id)
+
+# Expires finished and abandoned games and caps how many stay in memory
+game_archive = GameArchive(os.path.join(app.instance_path, 'game_archive'))
+game_sweeper = GameSweeper(
+    state,
+    games,
+    game_archive,
+    has_players=lambda room_code: bool(room_registry.players(room_code)),
+    on_evict=evict_game,
+    results_ttl=RESULTS_TTL,
+    abandoned_ttl=GAME_ABANDONED_TTL,
+    max_games=MAX_RESIDENT_GAMES,
+    sweep_interval=GAME_SWEEP_INTERVAL,
+    spawn=socketio.start_background_task,
+    sleep=socketio.sleep
+)
+
+# Prometheus metrics, scraped from /metrics
+OPENAI_GENERATION_SECONDS = metrics.histogram('openai_generation_seconds', 'OpenAI image generation call latency')
+IMAGE_DOWNLOAD_SECONDS = metrics.histogram('image_download_seconds', 'Generated image download time')
+DRAWING_SAVE_SECONDS = metrics.histogram('drawing_save_seconds', 'Time to save an uploaded drawing', ['format'])
+DESCRIBE_SECONDS = metrics.histogram('describe_image_seconds', 'describe_image latency, streaming included')
+SOCKET_HANDLER_SECONDS = metrics.histogram('socket_handler_seconds', 'Socket.IO handler execution time', ['event'])
+FALLBACKS = metrics.counter('fallbacks_total', 'Fallback images and descriptions used', ['kind'])
+TURN_TIMEOUTS = metrics.counter('turn_timeouts_total', 'Turns that ran out of time', ['mode'])
+ERRORS = metrics.counter('errors_total', 'Errors caught while playing a turn', ['stage'])
+OPENAI_QUEUE_WAIT_SECONDS = metrics.histogram('openai_queue_wait_seconds', 'Wait for the OpenAI rate limits',
+                                              ['priority'])
+EVENT_LOOP_LAG_SECONDS = metrics.histogram('event_loop_lag_seconds', 'How late a short sleep wakes up',
+                                           buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+metrics.gauge('active_rooms', 'Rooms with a lobby or a game', function=lambda: len(rooms))
+metrics.gauge('players', 'Players connected to a room',
+              function=lambda: sum(len(players) for players in rooms.values()))
+metrics.gauge('running_games', 'Games started and not yet completed',
+              function=lambda: sum(1 for game in games.values() if not game.completed))
+metrics.gauge('background_tasks', 'Generation engine work by state', ['state'], function=lambda: {
+    (name,): value for name, value in generation_engine.stats().items()
+    if name in ('in_flight', 'queue_depth', 'background_queued', 'background_running')
+})
+
+# Samples how late the server wakes from a short sleep, into EVENT_LOOP_LAG_SECONDS
+lag_probe = metrics.LagProbe(EVENT_LOOP_LAG_SECONDS, LAG_PROBE_INTERVAL, spawn=socketio.start_background_task,
+                             sleep=socketio.sleep)
+
+def socket_handler(event):
+    """
+    socketio.on(event), timing the handler and counting the errors it raises.
+    Events for a room in a game are traced as a span of its current turn.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def timed(*args):
+            data = args[0] if args and isinstance(args[0], dict) else {}
+            trace = tracer.room_trace(data['room_code']) if 'room_code' in data else tracing.NO_TRACE
+            try:
+                with SOCKET_HANDLER_SECONDS.time(event=event), trace.span(event) as span:
+                    if span.recording:
+                        span.size = tracing.payload_size(data)
+                    return handler(*args)
+            except Exception:
+                ERRORS.inc(stage=event)
+                raise
+        return socketio.on(event)(timed)
+    return decorator
 
 @app.route('/')
 def index():
@@ -137,14 +441,67 @@ def inverted_game(room_code):
 
 @app.route('/results/<room_code>')
 def results(room_code):
-    if room_code in games:
-        game = games[room_code]
-        # Clean up old completed games (older than 1 hour)
-        if game.get('status') == 'completed' and time.time() - game.get('completion_time', game.get('start_time', 0)) > 3600:
-            del games[room_code]
-            return "Game not found", 404
-        return render_template('results.html', game=game)
-    return "Game not found", 404
+    # Games still in memory first, then finished games the sweeper has archived
+    game = games.get(room_code) or game_archive.get(room_code)
+    if game is None:
+        return "Game not found", 404
+    if game.completed and time.time() - (game.completion_time or game.start_time) > RESULTS_TTL:
+        # Expired; the game sweeper drops it and releases its images
+        return "Game not found", 404
+    game_sweeper.viewed(room_code)
+    return render_template('results.html', game=game.to_dict())
+
+@app.route('/stats')
+def stats():
+    """Counters for generation, fallbacks, caching, storage, rooms, games, timers, tracing, shutdown and providers"""
+    return jsonify({
+        'generation': generation_engine.stats(),
+        'fallback_pool': fallback_pool.stats(),
+        'image_cache': image_cache.stats() if image_cache is not None else None,
+        'description_cache': description_cache.stats() if description_cache is not None else None,
+        'storage': storage.stats(),
+        'assets': asset_manifest.stats(),
+        'rooms': room_registry.stats(),
+        'games': game_sweeper.stats(),
+        'turn_timers': turn_timers.stats(),
+        'tracing': tracer.stats(),
+        'lifecycle': lifecycle.stats(),
+        'rate_limits': openai_limits.stats(),
+        'providers': {
+            'images': image_provider.stats(),
+            'vision': vision_provider.stats()
+        }
+    })
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Turn-stage latencies, room and game gauges and error counters in the Prometheus text format"""
+    return metrics.REGISTRY.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
+@app.route('/health')
+def health():
+    """200 while the server takes new players, 503 once it is draining for shutdown"""
+    if not lifecycle.accepting:
+        return jsonify({'status': 'draining', 'in_flight': lifecycle.in_flight()}), 503
+    return jsonify({'status': 'ok'})
+
+@app.route('/traces')
+def traces():
+    """Recent turn traces, newest first; ?room=<code> for one room, ?limit=<n> traces"""
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({'traces': tracer.export(request.args.get('room'), limit=limit)})
+
+@app.route('/static/<path:filename>', endpoint='static')
+def static_file(filename):
+    """
+    Static files with conditional and range support. Generated files and
+    URLs carrying the current ?v= digest may be cached for a year; other
+    static files revalidate against their content digest.
+    """
+    response = send_from_directory('static', filename, etag=asset_manifest.digest(filename) or True)
+    response.headers['Cache-Control'] = asset_manifest.cache_control(filename, request.args.get('v'))
+    asset_manifest.note_response(response.status_code, response.content_length)
+    return response
 
 @app.route('/canvas')
 def canvas():
@@ -152,36 +509,31 @@ def canvas():
 
 @app.route('/save_canvas', methods=['POST'])
 def save_canvas():
+    """
+    Save a drawing from the canvas page. The body is the raw image
+    (Content-Type image/png or image/jpeg), a multipart form with an
+    "image" file, or the legacy JSON {"image_data": <data URL>}.
+    """
     try:
-        data = request.get_json()
-        image_data = data.get('image_data')
-        format_type = data.get('format', 'png')
+        if request.mimetype == 'multipart/form-data':
+            upload = request.files.get('image')
+            source = upload.stream if upload else None
+        elif request.mimetype == 'application/json':
+            image_data = (request.get_json(silent=True) or {}).get('image_data')
+            source = read_data_url(image_data, MAX_UPLOAD_BYTES) if image_data else None
+        else:
+            source = request.stream
         
-        if not image_data:
+        if source is None:
             return jsonify({'error': 'No image data provided'}), 400
         
-        # Remove data URL prefix (e.g., "data:image/png;base64,")
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
-        
-        # Decode base64 image data
-        import base64
-        image_bytes = base64.b64decode(image_data)
-        
-        # Create filename with timestamp
-        import time
-        timestamp = int(time.time())
-        filename = f'canvas_drawing_{timestamp}.{format_type}'
-        
-        # Ensure the directory exists
-        import os
-        save_dir = 'static/canvas_drawings'
-        os.makedirs(save_dir, exist_ok=True)
-        
-        # Save the file
-        file_path = os.path.join(save_dir, filename)
-        with open(file_path, 'wb') as f:
-            f.write(image_bytes)
+        # Stream to disk; the extension comes from the image itself. A fresh name every
+        # time, since browsers keep canvas_drawings files forever
+        with DRAWING_SAVE_SECONDS.time(format='upload'):
+            file_path, _ = save_upload(source, 'static/canvas_drawings', f'canvas_drawing_{uuid.uuid4()}',
+                                       MAX_UPLOAD_BYTES)
+        storage.note_file(file_path)
+        filename = os.path.basename(file_path)
         
         return jsonify({
             'success': True, 
@@ -190,39 +542,41 @@ def save_canvas():
             'message': f'Drawing saved as {filename}'
         })
         
+    except (UploadTooLarge, RequestEntityTooLarge):
+        return jsonify({'error': f'Drawing is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB'}), 413
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
+        ERRORS.inc(stage='save_canvas')
         return jsonify({'error': f'Failed to save image: {str(e)}'}), 500
 
-@socketio.on('join_room')
+@socket_handler('join_room')
 def handle_join_room(data):
     room_code = data['room_code']
     player_name = data['player_name']
     is_creator = data.get('is_creator', False)
+    if not lifecycle.accepting:
+        emit('error', {'message': 'Server is restarting, please join again in a moment'})
+        return
+    start_background_services()
     
     if room_code not in rooms:
         if not is_creator:
             emit('error', {'message': 'Room does not exist. Please create a new room or check the room code.'})
             return
-        rooms[room_code] = []
+        room_registry.create_room(room_code)
         room_creators[room_code] = player_name
-        room_settings[room_code] = {'time_limit': 20, 'gamemode': 'classic'}
+        room_settings[room_code] = dict(DEFAULT_ROOM_SETTINGS)
     
-    if len(rooms[room_code]) >= MIN_PLAYERS and not any(p['name'] == player_name for p in rooms[room_code]):
+    # Add the player, or update an existing player's socket ID on rejoin
+    player_names = room_registry.join(room_code, player_name, request.sid, MIN_PLAYERS)
+    if player_names is None:
+        emit('error', {'message': 'Room does not exist. Please create a new room or check the room code.'})
+        return
+    if player_names == 'full':
         emit('room_full', {'message': 'Room is full'})
         return
-    
-    # Add or update player
-    player_exists = False
-    for i, player in enumerate(rooms[room_code]):
-        if player['name'] == player_name:
-            # Update existing player's socket ID
-            rooms[room_code][i]['id'] = request.sid
-            player_exists = True
-            break
-    
-    if not player_exists:
-        # Only add new player if they don't already exist
-        rooms[room_code].append({'name': player_name, 'id': request.sid})
+    settings = room_settings.get(room_code, DEFAULT_ROOM_SETTINGS)
     
     join_room(room_code)
     join_room(request.sid)  # Also join the player to their individual socket room
@@ -233,44 +587,52 @@ def handle_join_room(data):
     # Send personal confirmation to the joining player
     emit('player_joined', {
         'player_name': player_name,
-        'players': [p['name'] for p in rooms[room_code]],
-        'ready_to_start': len(rooms[room_code]) >= MIN_PLAYERS,
+        'players': player_names,
+        'ready_to_start': len(player_names) >= MIN_PLAYERS,
         'is_creator': is_room_creator,
-        'settings': room_settings[room_code]
+        'settings': settings
     })
     
     # Notify other players in the room about the new player
     emit('player_list_updated', {
-        'players': [p['name'] for p in rooms[room_code]],
-        'ready_to_start': len(rooms[room_code]) >= MIN_PLAYERS,
+        'players': player_names,
+        'ready_to_start': len(player_names) >= MIN_PLAYERS,
         'creator': room_creators.get(room_code),
-        'settings': room_settings[room_code]
+        'settings': settings
     }, room=room_code)
     
     # If game is already running, send current game state to the joining player
-    if room_code in games:
-        game = games[room_code]
-        current_player = game['players'][game['current_player']]['name']
+    game = games.get(room_code)
+    if game is not None:
+        current_player = game.current_player_name
         
         # Send current image if available
-        current_image = None
-        if game['images']:
-            current_image = game['images'][-1]['path']
+        current_image, is_my_turn = player_view(game, player_name)
         
         # Send game state update only to the joining player
         emit('game_state_update', {
+            'gamemode': game.gamemode,
             'current_player': current_player,
-            'round': game['current_round'],
+            'round': game.current_round,
             'image': current_image,
-            'timeout': room_settings.get(room_code, {}).get('time_limit', 20),
-            'players': [p['name'] for p in game['players']],
-            'is_my_turn': current_player == player_name
+            'image_set': image_set(current_image),
+            'timeout': settings.get('time_limit', 20),
+            'players': game.player_names,
+            'is_my_turn': is_my_turn
         })
     
     # Game no longer auto-starts at MIN_PLAYERS
     # Room creator must manually start the game
 
-@socketio.on('start_game_manual')
+def player_view(game, player_name):
+    """(image to show, whether it is their turn) for one player of a prompt game"""
+    if game.simultaneous:
+        image = game.assignments().get(player_name)
+        waiting = player_name in game.player_names and not game.has_prompt_from(player_name, game.current_round)
+        return image, waiting
+    return game.latest_image(), game.current_player_name == player_name
+
+@socket_handler('start_game_manual')
 def handle_start_game_manual(data):
     room_code = data['room_code']
     player_name = data['player_name']
@@ -281,7 +643,7 @@ def handle_start_game_manual(data):
         return
     
     # Check if there are at least 2 players
-    if len(rooms[room_code]) < 2:
+    if len(rooms.get(room_code, [])) < 2:
         emit('error', {'message': 'Need at least 2 players to start the game'})
         return
     
@@ -290,41 +652,50 @@ def handle_start_game_manual(data):
         emit('error', {'message': 'Game is already running'})
         return
     
+    if not lifecycle.accepting:
+        emit('error', {'message': 'Server is restarting, please start the game again in a moment'})
+        return
+    
     # Start the game
     start_game(room_code)
 
 def get_random_static_image():
-    """Get a random image from the static/img folder"""
-    import random
-    import os
-    
-    static_img_dir = 'static/img'
-    if not os.path.exists(static_img_dir):
-        return '/static/img/placeholder.svg'
-    
-    # Get all image files from static/img
-    image_files = []
-    for file in os.listdir(static_img_dir):
-        if file.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.svg')):
-            image_files.append(f'/static/img/{file}')
-    
+    """Get a random image from the static/img folder (listed from the asset manifest, not the disk)"""
+    image_files = [asset_manifest.url(path)
+                   for path in asset_manifest.files('img', ('.png', '.jpg', '.jpeg', '.gif', '.svg'))
+                   if not derivatives.is_variant(path)]
     if not image_files:
         return '/static/img/placeholder.svg'
     
     return random.choice(image_files)
 
-def describe_image(image_path):
+def describe_image(image_path, deadline=None, image_bytes=None, detail="high", on_delta=None, room_code=None):
     """
     Generate a text description of an image using GPT-4 Vision
     Based on test2.py implementation
+    Pass image_bytes when the caller already has the file in memory,
+    and detail="low" when the image fits one 512 px tile.
+    With on_delta the completion is streamed and on_delta(text) is called
+    with each piece as it arrives; the full text is still returned.
+    room_code is whose turn the rate limits count it against.
     """
+    deadline = deadline or time.time() + PROVIDER_MAX_SECONDS
     try:
         # Encode the image
-        with open(image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+        if image_bytes is None:
+            with open(image_path, "rb") as image_file:
+                image_bytes = image_file.read()
+        base64_image = base64.b64encode(image_bytes).decode('ascii')
+        image_type = sniff_image_type(bytes(image_bytes[:16])) or 'png'
+        mime_type = 'jpeg' if image_type == 'jpg' else image_type
         
-        # Call the OpenAI API
-        response = client.chat.completions.create(
+        # Call the OpenAI API; the rate limit counts the image, the prompt and max_tokens
+        image_tokens = VISION_IMAGE_TOKENS.get(detail, VISION_IMAGE_TOKENS['high'])
+        cost = {'vision_requests': 1, 'vision_tokens': image_tokens + VISION_PROMPT_TOKENS + VISION_MAX_TOKENS}
+        response = vision_provider.call(
+            client.chat.completions.create,
+            deadline,
+            admit=functools.partial(openai_limits.admit, cost, VISION, room_code),
             model="gpt-4o",
             messages=[
                 {
@@ -337,55 +708,74 @@ def describe_image(image_path):
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
-                                "detail": "high"
+                                "url": f"data:image/{mime_type};base64,{base64_image}",
+                                "detail": detail
                             }
                         }
                     ]
                 }
             ],
-            max_tokens=500
+            max_tokens=VISION_MAX_TOKENS,
+            stream=on_delta is not None
         )
         
-        description = response.choices[0].message.content
-        return description
+        if on_delta is None:
+            description = response.choices[0].message.content
+            return description
+        return read_description_stream(response, deadline, on_delta)
         
     except Exception as e:
         print(f"Error describing image: {e}")
+        ERRORS.inc(stage='describe_image')
         return None
 
+def read_description_stream(stream, deadline, on_delta):
+    """Forward a streamed completion piece by piece; returns what arrived (None if nothing)"""
+    parts = []
+    try:
+        for chunk in stream:
+            text = chunk.choices[0].delta.content if chunk.choices else None
+            if text:
+                parts.append(text)
+                on_delta(text)
+            if time.time() > deadline:
+                print("Description stream ran past its deadline, keeping what arrived")
+                break
+    except Exception as e:
+        # Players have already seen the partial text, so it becomes the description
+        print(f"Description stream broke off: {e}")
+    finally:
+        stream.response.close()
+    return ''.join(parts) or None
+
 def start_game(room_code):
     """Initialize and start a new game"""
-    players = rooms[room_code]
+    players = room_registry.players(room_code)
     game_id = str(uuid.uuid4())
-    settings = room_settings.get(room_code, {'time_limit': 20, 'gamemode': 'classic'})
+    settings = room_settings.get(room_code, DEFAULT_ROOM_SETTINGS)
     gamemode = settings.get('gamemode', 'classic')
+    player_names = [name for name, _ in players]
+    
+    # Make sure fallback images are ready before anyone can time out (inverted games never use them)
+    if gamemode != 'inverted':
+        fallback_pool.maybe_refill()
+    # A new game replaces any archived results of an earlier one in this room
+    game_archive.remove(room_code)
     
     if gamemode == 'inverted':
         # For inverted mode, provide a starting prompt for the first player to draw
         starting_prompt = "Draw whatever you want for the AI to analyze!"
         
-        games[room_code] = {
-            'id': game_id,
-            'players': [{'name': p['name'], 'id': p['id']} for p in players],
-            'current_round': 0,
-            'current_player': 0,
-            'prompts': [],
-            'images': [],
-            'descriptions': [],  # Store text descriptions
-            'status': 'waiting_for_drawing',
-            'start_time': time.time(),
-            'round_start_time': time.time(),
-            'gamemode': 'inverted'
-        }
+        game = Game(game_id, 'inverted', players, time.time())
+        games[room_code] = game
         
         # Send game_started event to all players in the room
-        print(f"Starting inverted game for room {room_code} with players: {[p['name'] for p in players]}")
+        print(f"Starting inverted game for room {room_code} with players: {player_names}")
         
         game_started_data = {
             'game_id': game_id,
-            'players': [p['name'] for p in players],
-            'current_player': players[0]['name'],
+            'players': player_names,
+            'current_player': player_names[0],
             'starting_prompt': starting_prompt,  # Starting prompt for first player to draw
             'settings': settings
         }
@@ -394,184 +784,310 @@ def start_game(room_code):
         print(f"game_started event emitted to room {room_code}")
     else:
         # Classic mode - use stock1.svg for player 1
-        starting_image = f'static/img/starting-img.png'
+        # Simultaneous mode - every player starts a chain from it and all prompt at once
+        starting_image = STARTING_IMAGE
+        gamemode = 'simultaneous' if gamemode == 'simultaneous' else 'classic'
         
-        games[room_code] = {
-            'id': game_id,
-            'players': [{'name': p['name'], 'id': p['id']} for p in players],
-            'current_round': 0,
-            'current_player': 0,
-            'prompts': [],
-            'images': [{'path': starting_image, 'prompt': 'Starting image'}],
-            'status': 'waiting_for_prompt',
-            'start_time': time.time(),
-            'round_start_time': time.time(),
-            'gamemode': 'classic'
-        }
+        game = Game(game_id, gamemode, players, time.time(), starting_image=starting_image)
+        games[room_code] = game
         
         # Send game_started event to all players in the room
-        print(f"Starting classic game for room {room_code} with players: {[p['name'] for p in players]}")
+        print(f"Starting {gamemode} game for room {room_code} with players: {player_names}")
         print(f"Starting image: {starting_image}")
         
         game_started_data = {
             'game_id': game_id,
-            'players': [p['name'] for p in players],
-            'current_player': players[0]['name'],
+            'gamemode': gamemode,
+            'players': player_names,
+            'current_player': player_names[0],
             'starting_image': starting_image,
+            'starting_image_set': image_set(starting_image),
             'settings': settings
         }
         print(f"Emitting game_started event: {game_started_data}")
         emit('game_started', game_started_data, room=room_code)
         print(f"game_started event emitted to room {room_code}")
+    
+    tracer.turn_started(room_code, game_id, 0)
+    schedule_turn_timeout(room_code, game)
 
-@socketio.on('submit_prompt')
+def finish_turn(room_code, turn_round, record):
+    """
+    The one turn transition: record(game) adds the turn's result, then play
+    moves to the next player (in simultaneous games, to the next round once
+    every chain has its image) and the room is told. Runs under the room's
+    lock and only once per round; record can return False to skip.
+    Returns a snapshot of the game, or None if the turn had already moved on.
+    """
+    def record_and_advance(game):
+        if game is None or game.completed or game.current_round != turn_round:
+            # Game is gone or this turn was already advanced
+            return None
+        if record(game) is False:
+            return None
+        if game.round_complete(turn_round):
+            game.advance(time.time())
+        return game.copy()
+    
+    game = state.update(games, room_code, record_and_advance)
+    if game is None:
+        return None
+    for image_path in game.images_for(turn_round):
+        storage.track(game.id, image_path)
+        # Including derivatives still being written in the background
+        for variant in derivatives.variant_paths(image_path):
+            storage.track(game.id, variant)
+    inverted = game.gamemode == 'inverted'
+    
+    if game.current_round == turn_round:
+        # Simultaneous round still waiting on other chains
+        socketio.emit('round_progress', {
+            'round': turn_round,
+            'done': len(game.images_for(turn_round)),
+            'total': len(game.players)
+        }, room=room_code)
+        return game
+    
+    if game.completed:
+        storage.expire_owner(game.id, game.completion_time + RESULTS_TTL)
+        view = game.to_dict()
+        completed = {
+            'game_id': game.id,
+            # Inverted games chain descriptions instead of prompts
+            'prompts': view['descriptions'] if inverted else view['prompts'],
+            'images': view['images']
+        }
+        if game.simultaneous:
+            completed['chains'] = view['chains']
+        socketio.emit('game_completed', completed, room=room_code)
+        # Clean up after game completion (keep game data for results page)
+        cleanup_room(room_code)
+        return game
+    
+    tracer.turn_started(room_code, game.id, game.current_round)
+    timeout = room_settings.get(room_code, {}).get('time_limit', 20)
+    if game.simultaneous:
+        # Every chain moves one seat; each player gets the image their new chain ended on
+        socketio.emit('next_round', {
+            'round': game.current_round,
+            'images': game.assignments(),
+            'image_sets': {name: image_set(path) for name, path in game.assignments().items()},
+            'timeout': timeout,
+            'start_timer': True
+        }, room=room_code)
+        schedule_turn_timeout(room_code, game)
+        return game
+    
+    next_turn = {
+        'current_player': game.current_player_name,
+        'round': game.current_round,
+        'timeout': timeout,
+        'start_timer': True  # Signal to start timer
+    }
+    if inverted:
+        # Emit next turn with description to all players
+        next_turn['description'] = game.latest_description()
+        socketio.emit('next_turn_inverted', next_turn, room=room_code)
+    else:
+        # Emit next turn with image to all players
+        next_turn['image'] = game.latest_image()
+        next_turn['image_set'] = image_set(next_turn['image'])
+        socketio.emit('next_turn', next_turn, room=room_code)
+    schedule_turn_timeout(room_code, game)
+    return game
+
+@socket_handler('submit_prompt')
 def handle_submit_prompt(data):
     room_code = data['room_code']
     prompt = data['prompt']
     player_name = data['player_name']
     
-    if room_code not in games:
-        return
-    
-    game = games[room_code]
+    # Check the turn and add the prompt in one atomic step
+    def add_prompt(game):
+        if game is None:
+            return None
+        if game.simultaneous:
+            # Everyone prompts at once, once per round
+            if player_name not in game.player_names:
+                return 'not_your_turn'
+            if game.has_prompt_from(player_name, game.current_round):
+                return 'already_submitted'
+        elif game.current_player_name != player_name:
+            return 'not_your_turn'
+        elif game.has_prompt(game.current_round):
+            return 'already_submitted'
+        # Backpressure: if the shared queue is full, hand the turn back to the player
+        if generation_engine.queue_depth() >= generation_engine.max_queue:
+            return 'busy'
+        game.add_prompt(player_name, prompt)
+        # A snapshot, so the rest of the handler does not depend on the game still being there
+        return game.copy()
     
-    # Check if it's this player's turn
-    current_player = game['players'][game['current_player']]
-    if current_player['name'] != player_name:
+    game = state.update(games, room_code, add_prompt)
+    if game is None or game == 'already_submitted':
+        return
+    if game == 'not_your_turn':
         emit('error', {'message': 'Not your turn'})
         return
+    if game == 'busy':
+        emit('generation_busy', {'message': 'Image generator is busy, please submit again in a moment'})
+        return
+    turn_round = game.current_round
+    simultaneous = game.simultaneous
+    if not simultaneous or all(game.has_prompt_from(name, turn_round) for name in game.player_names):
+        # The turn now ends when the images are ready, not when time runs out
+        turn_timers.cancel(room_code, turn_round)
+    deadline = provider_deadline(room_code, game)
+    lane = game.chain_of(player_name, turn_round) if simultaneous else None
     
-    # Add prompt to game
-    game['prompts'].append({
-        'player': player_name,
-        'text': prompt,
-        'round': game['current_round']
-    })
+    allow_cached = room_settings.get(room_code, DEFAULT_ROOM_SETTINGS).get('allow_cached', True)
+    # The job runs on a worker thread, so it enters the turn's trace itself
+    trace = tracer.trace_for(room_code, game.id, turn_round)
+    submitted = time.time()
+    
+    # Generate image asynchronously on the shared generation worker pool
+    def generate_and_continue(job):
+        with trace.span('image_job', queued_ms=round((time.time() - submitted) * 1000, 3)) as job_span:
+            try:
+                # Generate image
+                with tracing.span('generate_image', size=len(prompt)) as span:
+                    image_path = generate_image(prompt, room_code, use_cache=allow_cached, deadline=deadline)
+                    if not image_path:
+                        span.outcome = 'failed'
+                if job.cancelled:
+                    # Room was torn down while we were waiting on OpenAI
+                    job_span.outcome = 'cancelled'
+                    return
+                taken = {}
+                if not image_path:
+                    # Use a pre-generated fallback image if generation fails
+                    print(f"Image generation failed for prompt: '{prompt}', using fallback")
+                    image_path = taken[player_name] = get_random_stock_image()
+                    job_span.outcome = 'fallback'
+                
+                if not image_path:
+                    # If even fallback fails, create a placeholder
+                    print("Both image generation and fallback failed, using placeholder")
+                    image_path = "static/img/placeholder.svg"
+                    job_span.outcome = 'placeholder'
+                elif not job.cancelled:
+                    prepare_derivatives(image_path)
+                
+                def record_image(game):
+                    if game.has_image_from(player_name, turn_round):
+                        # Timed out while generating; the fallback already filled this chain
+                        return False
+                    game.add_image(player_name, image_path)
+                
+                recorded = finish_turn(room_code, turn_round, record_image) is not None
+                settle_fallbacks(taken, [player_name] if recorded else [])
+            except Exception as e:
+                print(f"Error in generate_and_continue: {e}")
+                ERRORS.inc(stage='generate_and_continue')
+                job_span.outcome = tracing.ERROR
+                if not rescue_turn(room_code, turn_round, hand_off):
+                    # Emit error event to hide loading wheel
+                    socketio.emit('image_generation_error', {
+                        'error': 'Image generation failed'
+                    }, room=room_code)
+            finally:
+                lifecycle.end(task)
+    
+    def hand_off():
+        # Shutting down before the image arrived: the player gets a fallback, as on a timeout
+        taken = {player_name: get_random_stock_image()}
+        
+        def record_fallback(game):
+            if game.has_image_from(player_name, turn_round):
+                return False
+            game.add_image(player_name, taken[player_name] or "static/img/placeholder.svg")
+        
+        recorded = finish_turn(room_code, turn_round, record_fallback) is not None
+        settle_fallbacks(taken, [player_name] if recorded else [])
     
-    # Emit generating event to all players in the room
+    # Emit generating event to all players in the room, with how busy the queue is
+    # (in simultaneous games only to the player, the others are still typing)
     emit('image_generating', {
         'player': player_name,
-        'prompt': prompt
-    }, room=room_code)
+        'prompt': prompt,
+        'queue_position': generation_engine.jobs_ahead(room_code, lane),  # jobs that start before this one
+        'queue_depth': generation_engine.queue_depth() + 1
+    }, room=None if simultaneous else room_code)
     
-    # Generate image asynchronously using Flask-SocketIO background task
-    def generate_and_continue():
-        try:
-            # Generate image
-            image_path = generate_image(prompt, room_code)
-            if not image_path:
-                # Use random stock image if generation fails
-                print(f"Image generation failed for prompt: '{prompt}', using fallback")
-                image_path = get_random_stock_image()
-            
-            if image_path:
-                game['images'].append({
-                    'player': player_name,
-                    'path': image_path,
-                    'round': game['current_round']
-                })
-            else:
-                # If even fallback fails, create a placeholder
-                print("Both image generation and fallback failed, using placeholder")
-                image_path = "static/img/placeholder.svg"
-                game['images'].append({
-                    'player': player_name,
-                    'path': image_path,
-                    'round': game['current_round']
-                })
-            
-            # Move to next player
-            game['current_player'] = (game['current_player'] + 1) % len(game['players'])
-            game['current_round'] += 1
-            game['round_start_time'] = time.time()
-            
-            # Check if game is complete
-            if game['current_round'] >= len(game['players']):
-                game['status'] = 'completed'
-                game['completion_time'] = time.time()
-                socketio.emit('game_completed', {
-                    'game_id': game['id'],
-                    'prompts': game['prompts'],
-                    'images': game['images']
-                }, room=room_code)
-                # Clean up after game completion (keep game data for results page)
-                if room_code in rooms:
-                    del rooms[room_code]
-                if room_code in room_creators:
-                    del room_creators[room_code]
-                if room_code in room_settings:
-                    del room_settings[room_code]
-            else:
-                next_player = game['players'][game['current_player']]['name']
-                # Emit next turn with image to all players
-                socketio.emit('next_turn', {
-                    'current_player': next_player,
-                    'round': game['current_round'],
-                    'image': image_path,
-                    'timeout': room_settings.get(room_code, {}).get('time_limit', 20),
-                    'start_timer': True  # Signal to start timer
-                }, room=room_code)
-        except Exception as e:
-            print(f"Error in generate_and_continue: {e}")
-            # Emit error event to hide loading wheel
-            socketio.emit('image_generation_error', {
-                'error': 'Image generation failed'
-            }, room=room_code)
-    
-    # Start image generation in a background task
-    socketio.start_background_task(generate_and_continue)
+    # Queue image generation; workers pick rooms (and chains) round-robin
+    task = lifecycle.begin(room_code, hand_off)
+    if generation_engine.submit(room_code, generate_and_continue, lane=lane) is None:
+        lifecycle.end(task)
+        def remove_prompt(game):
+            if game is not None:
+                game.remove_prompt(turn_round, player_name)
+                return game.copy()
+        game = state.update(games, room_code, remove_prompt)
+        if game is not None and game.current_round == turn_round:
+            # Hand the rest of the turn back to the player
+            schedule_turn_timeout(room_code, game)
+        emit('image_generation_error', {
+            'error': 'Image generator is busy'
+        }, room=room_code)
 
-@socketio.on('submit_drawing')
+@socket_handler('submit_drawing')
 def handle_submit_drawing(data):
     """Handle drawing submission for inverted game mode"""
     room_code = data['room_code']
     player_name = data['player_name']
-    image_data = data['image_data']
+    # Strokes from the drawing canvas; a binary PNG or base64 data URL from older clients
+    drawing = data.get('strokes')
+    image = data.get('image')
+    if image is None and data.get('image_data'):
+        image = data['image_data']
     
-    if room_code not in games:
+    game = games.get(room_code)
+    if game is None:
         return
     
-    game = games[room_code]
-    
     # Check if it's inverted mode
-    if game.get('gamemode') != 'inverted':
+    if game.gamemode != 'inverted':
         emit('error', {'message': 'Not in inverted mode'})
         return
     
     # Check if it's this player's turn
-    current_player = game['players'][game['current_player']]
-    if current_player['name'] != player_name:
+    if game.current_player_name != player_name:
         emit('error', {'message': 'Not your turn'})
         return
     
     # Save the drawing
     try:
-        # Remove data URL prefix (e.g., "data:image/png;base64,")
-        if ',' in image_data:
-            image_data = image_data.split(',')[1]
-        
-        # Decode base64 image data
-        image_bytes = base64.b64decode(image_data)
-        
-        # Create filename with timestamp
-        timestamp = int(time.time())
-        filename = f'drawing_{timestamp}_{player_name}.png'
-        
-        # Ensure the directory exists
-        save_dir = 'static/canvas_drawings'
-        os.makedirs(save_dir, exist_ok=True)
+        # A fresh name every time, since browsers keep canvas_drawings files forever
+        stem = f'drawing_{uuid.uuid4()}'
+        if drawing is not None:
+            # Keep the strokes; pixels are only rendered for the vision model
+            drawing = strokes.parse_strokes(drawing)
+            with DRAWING_SAVE_SECONDS.time(format='strokes'), tracing.span('save_drawing', format='strokes') as span:
+                file_path, image_bytes = strokes.save_strokes(drawing, 'static/canvas_drawings', stem), None
+                span.size = os.path.getsize(file_path)
+        else:
+            if isinstance(image, str):
+                image = read_data_url(image, MAX_UPLOAD_BYTES)
+            # Write the bytes we were sent; the extension comes from the image itself
+            with DRAWING_SAVE_SECONDS.time(format='upload'), tracing.span('save_drawing', format='upload') as span:
+                file_path, image_bytes = save_upload(image, 'static/canvas_drawings', stem, MAX_UPLOAD_BYTES)
+                span.size = len(image_bytes)
         
-        # Save the file
-        file_path = os.path.join(save_dir, filename)
-        with open(file_path, 'wb') as f:
-            f.write(image_bytes)
+        # Add image to game, unless the turn moved on while we were saving
+        def add_drawing(game):
+            if game is None or game.current_player_name != player_name:
+                return None
+            if game.has_image(game.current_round):
+                return None
+            game.add_image(player_name, file_path)
+            return game.current_round
         
-        # Add image to game
-        game['images'].append({
-            'player': player_name,
-            'path': f'static/canvas_drawings/{filename}',
-            'round': game['current_round']
-        })
+        turn_round = state.update(games, room_code, add_drawing)
+        if turn_round is None:
+            return
+        turn_timers.cancel(room_code, turn_round)
+        deadline = provider_deadline(room_code, game)
+        storage.track(game.id, file_path)
         
         # Emit processing event to all players
         emit('image_processing', {
@@ -579,253 +1095,275 @@ def handle_submit_drawing(data):
             'message': 'Processing your drawing...'
         }, room=room_code)
         
+        allow_cached = room_settings.get(room_code, DEFAULT_ROOM_SETTINGS).get('allow_cached', True)
+        trace = tracer.trace_for(room_code, game.id, turn_round)
+        
         # Process the drawing asynchronously
         def process_drawing_and_continue():
-            try:
-                # Describe the image using ChatGPT
-                description = describe_image(file_path)
-                if not description:
-                    description = "A simple drawing"
-                
-                # Add description to game
-                game['descriptions'].append({
-                    'player': player_name,
-                    'text': description,
-                    'round': game['current_round']
-                })
-                
-                # Move to next player
-                game['current_player'] = (game['current_player'] + 1) % len(game['players'])
-                game['current_round'] += 1
-                game['round_start_time'] = time.time()
-                
-                # Check if game is complete
-                if game['current_round'] >= len(game['players']):
-                    game['status'] = 'completed'
-                    game['completion_time'] = time.time()
-                    socketio.emit('game_completed', {
-                        'game_id': game['id'],
-                        'prompts': game['descriptions'],  # Use descriptions instead of prompts
-                        'images': game['images']
-                    }, room=room_code)
-                    # Clean up after game completion
-                    if room_code in rooms:
-                        del rooms[room_code]
-                    if room_code in room_creators:
-                        del room_creators[room_code]
-                    if room_code in room_settings:
-                        del room_settings[room_code]
-                else:
-                    next_player = game['players'][game['current_player']]['name']
-                    # Emit next turn with description to all players
-                    socketio.emit('next_turn_inverted', {
-                        'current_player': next_player,
-                        'round': game['current_round'],
-                        'description': description,
-                        'timeout': room_settings.get(room_code, {}).get('time_limit', 20),
-                        'start_timer': True
-                    }, room=room_code)
-            except Exception as e:
-                print(f"Error in process_drawing_and_continue: {e}")
-                # Emit error event
-                socketio.emit('image_processing_error', {
-                    'error': 'Image processing failed'
-                }, room=room_code)
+            with trace.span('describe_job') as job_span:
+                try:
+                    # Describe the image using ChatGPT
+                    # Cropped, scaled and quantized, with the cheapest detail level that keeps the lines
+                    with tracing.span('vision_prep') as span:
+                        if drawing is not None:
+                            pixels, detail = run_in_thread(vision_prep.prepare_strokes, drawing)
+                        else:
+                            pixels, detail = run_in_thread(vision_prep.prepare_image, image_bytes)
+                        span.size = len(pixels)
+                    # Stream the description to the room as it is written
+                    def forward_delta(text):
+                        socketio.emit('description_delta', {
+                            'player': player_name,
+                            'round': turn_round,
+                            'text': text
+                        }, room=room_code)
+                    
+                    # Blank canvases and near-duplicates of earlier drawings reuse a description
+                    description, cache_key = None, None
+                    if description_cache is not None:
+                        with tracing.span('description_cache') as span:
+                            description, cache_key = description_cache.lookup(pixels, use_cache=allow_cached)
+                            span.outcome = 'hit' if description else 'miss'
+                    if description:
+                        forward_delta(description)
+                    else:
+                        started = time.time()
+                        with DESCRIBE_SECONDS.time(), tracing.span('describe_image', size=len(pixels),
+                                                                   detail=detail) as span:
+                            description = describe_image(file_path, deadline=deadline, image_bytes=pixels,
+                                                         detail=detail, on_delta=forward_delta,
+                                                         room_code=room_code)
+                            if not description:
+                                span.outcome = 'failed'
+                        if description and cache_key is not None:
+                            description_cache.store(cache_key, description, time.time() - started)
+                    if not description:
+                        FALLBACKS.inc(kind='description')
+                        description = "A simple drawing"
+                        job_span.outcome = 'fallback'
+                    
+                    finish_turn(room_code, turn_round, lambda game: game.add_description(player_name, description))
+                except Exception as e:
+                    print(f"Error in process_drawing_and_continue: {e}")
+                    ERRORS.inc(stage='process_drawing')
+                    job_span.outcome = tracing.ERROR
+                    if not rescue_turn(room_code, turn_round, hand_off):
+                        # Emit error event
+                        socketio.emit('image_processing_error', {
+                            'error': 'Image processing failed'
+                        }, room=room_code)
+                finally:
+                    lifecycle.end(task)
+        
+        def hand_off():
+            # Shutting down before the description arrived: use the placeholder, as on a timeout
+            finish_turn(room_code, turn_round, lambda game: game.add_description(player_name, "A simple drawing"))
         
         # Start image processing in a background task
+        task = lifecycle.begin(room_code, hand_off)
         socketio.start_background_task(process_drawing_and_continue)
-        
+    
+    except UploadTooLarge:
+        emit('error', {'message': f'Drawing is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB'})
+    except strokes.StrokeError as e:
+        emit('error', {'message': f'Invalid drawing: {e}'})
     except Exception as e:
         print(f"Error saving drawing: {e}")
+        ERRORS.inc(stage='save_drawing')
         emit('error', {'message': 'Failed to save drawing'})
 
-@socketio.on('timeout_prompt')
-def handle_timeout_prompt(data):
-    room_code = data['room_code']
-    
-    if room_code not in games:
-        return
-    
-    game = games[room_code]
-    current_player = game['players'][game['current_player']]['name']
+def turn_deadline(room_code, game):
+    """When the current turn runs out, from the room's time limit"""
+    time_limit = room_settings.get(room_code, DEFAULT_ROOM_SETTINGS).get('time_limit', 20)
+    return game.round_start_time + time_limit + TURN_GRACE_SECONDS
+
+def provider_deadline(room_code, game):
+    """Deadline for the OpenAI work of a turn: the rest of the turn, within the provider limits"""
+    now = time.time()
+    remaining = turn_deadline(room_code, game) - now if game is not None else PROVIDER_MAX_SECONDS
+    return now + min(max(remaining, PROVIDER_MIN_SECONDS), PROVIDER_MAX_SECONDS)
+
+def rescue_turn(room_code, turn_round, hand_off):
+    """
+    Turn work failed after the turn's deadline was cancelled, so no timer will
+    move the room on: finish the turn with hand_off's fallback now. Returns
+    False if that failed too, in which case a background task retries it.
+    """
+    try:
+        hand_off()
+        return True
+    except Exception as e:
+        print(f"Error finishing turn {turn_round} in room {room_code}: {e}")
+        ERRORS.inc(stage='rescue_turn')
     
-    # Use random stock image
-    image_path = get_random_stock_image()
-    if image_path:
-        game['images'].append({
-            'player': current_player,
-            'path': image_path,
-            'round': game['current_round']
-        })
+    def retry():
+        for delay in TURN_RESCUE_RETRY_DELAYS:
+            socketio.sleep(delay)
+            try:
+                hand_off()
+                return
+            except Exception as e:
+                print(f"Error finishing turn {turn_round} in room {room_code}: {e}")
+                ERRORS.inc(stage='rescue_turn')
     
-    # Move to next player
-    game['current_player'] = (game['current_player'] + 1) % len(game['players'])
-    game['current_round'] += 1
-    game['round_start_time'] = time.time()
-    
-    # Check if game is complete
-    if game['current_round'] >= len(game['players']):
-        game['status'] = 'completed'
-        game['completion_time'] = time.time()
-        emit('game_completed', {
-            'game_id': game['id'],
-            'prompts': game['prompts'],
-            'images': game['images']
-        }, room=room_code)
-        # Clean up after game completion (keep game data for results page)
-        if room_code in rooms:
-            del rooms[room_code]
-        if room_code in room_creators:
-            del room_creators[room_code]
-        if room_code in room_settings:
-            del room_settings[room_code]
-    else:
-        next_player = game['players'][game['current_player']]['name']
-        # Emit next turn with image to all players
-        emit('next_turn', {
-            'current_player': next_player,
-            'round': game['current_round'],
-            'image': image_path,
-            'timeout': room_settings.get(room_code, {}).get('time_limit', 20),
-            'start_timer': True  # Start timer for timeout case too
-        }, room=room_code)
+    socketio.start_background_task(retry)
+    return False
 
-@socketio.on('timeout_drawing')
-def handle_timeout_drawing(data):
-    """Handle drawing timeout for inverted game mode"""
-    room_code = data['room_code']
+def schedule_turn_timeout(room_code, game):
+    """Arm the server-side timer for the game's current turn"""
+    turn_timers.schedule(room_code, game.current_round, turn_deadline(room_code, game))
+
+def timeout_prompt_turn(room_code, turn_round):
+    """Give players who ran out of time a fallback image and move on"""
+    game = games.get(room_code)
+    if game is None or game.current_round != turn_round:
+        return
+    
+    def out_of_time(game):
+        # Players with a prompt in flight are left to their own generation
+        names = game.player_names if game.simultaneous else [game.current_player_name]
+        return [name for name in names
+                if not game.has_prompt_from(name, turn_round) and not game.has_image_from(name, turn_round)]
     
-    if room_code not in games:
+    missing = out_of_time(game)
+    if not missing:
         return
     
-    game = games[room_code]
-    current_player = game['players'][game['current_player']]['name']
+    # Use a fallback image from the warm pool, or the placeholder if it is empty
+    taken = {name: get_random_stock_image() for name in missing}
+    used = []
     
-    # Create a placeholder drawing
-    placeholder_path = "static/img/placeholder.svg"
-    game['images'].append({
-        'player': current_player,
-        'path': placeholder_path,
-        'round': game['current_round']
-    })
+    def record_fallback(game):
+        # Players may have submitted since; those keep their own image
+        used[:] = [name for name in out_of_time(game) if name in taken]
+        if not used:
+            return False
+        for name in used:
+            game.add_image(name, taken[name] or "static/img/placeholder.svg")
     
-    # Add a default description
-    game['descriptions'].append({
-        'player': current_player,
-        'text': "A simple drawing",
-        'round': game['current_round']
-    })
+    if finish_turn(room_code, turn_round, record_fallback) is None:
+        used.clear()
+    elif used:
+        TURN_TIMEOUTS.inc(len(used), mode='prompt')
+    # Pool images nobody got go back instead of sitting unused in static/generated
+    settle_fallbacks(taken, used)
+
+def timeout_drawing_turn(room_code, turn_round):
+    """Record a placeholder drawing for a player who ran out of time (inverted mode)"""
+    def record_placeholder(game):
+        if game.has_image(turn_round):
+            # A drawing was submitted and is being described; let that advance the turn
+            return False
+        current_player = game.current_player_name
+        game.add_image(current_player, "static/img/placeholder.svg")
+        game.add_description(current_player, "A simple drawing")
     
-    # Move to next player
-    game['current_player'] = (game['current_player'] + 1) % len(game['players'])
-    game['current_round'] += 1
-    game['round_start_time'] = time.time()
-    
-    # Check if game is complete
-    if game['current_round'] >= len(game['players']):
-        game['status'] = 'completed'
-        game['completion_time'] = time.time()
-        emit('game_completed', {
-            'game_id': game['id'],
-            'prompts': game['descriptions'],
-            'images': game['images']
-        }, room=room_code)
-        # Clean up after game completion
-        if room_code in rooms:
-            del rooms[room_code]
-        if room_code in room_creators:
-            del room_creators[room_code]
-        if room_code in room_settings:
-            del room_settings[room_code]
-    else:
-        next_player = game['players'][game['current_player']]['name']
-        # Emit next turn with description to all players
-        emit('next_turn_inverted', {
-            'current_player': next_player,
-            'round': game['current_round'],
-            'description': "A simple drawing",
-            'timeout': room_settings.get(room_code, {}).get('time_limit', 20),
-            'start_timer': True
-        }, room=room_code)
+    if finish_turn(room_code, turn_round, record_placeholder):
+        TURN_TIMEOUTS.inc(mode='drawing')
 
-@socketio.on('disconnect')
+def expire_turn(room_code, turn_round):
+    """Called by the turn timers when a turn's deadline passes"""
+    game = games.get(room_code)
+    if game is None:
+        return
+    with tracer.trace_for(room_code, game.id, turn_round).span('turn_timeout'):
+        if game.gamemode == 'inverted':
+            timeout_drawing_turn(room_code, turn_round)
+        else:
+            timeout_prompt_turn(room_code, turn_round)
+
+# Server-side deadlines for every running turn, checked by one background task
+turn_timers = TurnTimers(
+    expire_turn,
+    resolution=TURN_TIMER_RESOLUTION,
+    spawn=socketio.start_background_task,
+    sleep=socketio.sleep
+)
+
+def expire_if_overdue(room_code):
+    """Timeouts reported by older clients only count once the server deadline has passed"""
+    game = games.get(room_code)
+    if game is not None and time.time() >= turn_deadline(room_code, game):
+        turn_timers.cancel(room_code, game.current_round)
+        expire_turn(room_code, game.current_round)
+
+@socket_handler('timeout_prompt')
+def handle_timeout_prompt(data):
+    expire_if_overdue(data['room_code'])
+
+@socket_handler('timeout_drawing')
+def handle_timeout_drawing(data):
+    """Handle drawing timeout for inverted game mode"""
+    expire_if_overdue(data['room_code'])
+
+@socket_handler('disconnect')
 def handle_disconnect():
-    # Remove player from all rooms
-    # Create a copy of the dictionary to avoid modification during iteration
-    rooms_copy = dict(rooms)
-    for room_code, players in rooms_copy.items():
-        rooms[room_code] = [p for p in players if p['id'] != request.sid]
-        
-        if len(rooms[room_code]) == 0:
-            # Don't delete room if game is running
+    # Remove the player from the rooms this socket joined
+    for room_code, player_names in room_registry.leave(request.sid):
+        if len(player_names) == 0:
+            # Don't delete room if game is running; the game sweeper evicts it if nobody comes back
             if room_code not in games:
-                del rooms[room_code]
-                if room_code in room_creators:
-                    del room_creators[room_code]
-                if room_code in room_settings:
-                    del room_settings[room_code]
+                cleanup_room(room_code)
         else:
             emit('player_list_updated', {
-                'players': [p['name'] for p in rooms[room_code]],
-                'ready_to_start': len(rooms[room_code]) >= MIN_PLAYERS,
+                'players': player_names,
+                'ready_to_start': len(player_names) >= MIN_PLAYERS,
                 'creator': room_creators.get(room_code),
-                'settings': room_settings.get(room_code, {'time_limit': 20, 'gamemode': 'classic'})
+                'settings': room_settings.get(room_code, DEFAULT_ROOM_SETTINGS)
             }, room=room_code)
 
-@socketio.on('get_game_state')
+@socket_handler('get_game_state')
 def handle_get_game_state(data):
     """Handle request for current game state"""
     print(f"🔍 get_game_state called with: {data}")
     room_code = data['room_code']
     player_name = data.get('player_name', 'Unknown')
     
-    if room_code not in games:
+    game = games.get(room_code)
+    if game is None:
         print(f"❌ No game found for room {room_code}")
         emit('error', {'message': 'No game found for this room'})
         return
     
-    game = games[room_code]
-    current_player = game['players'][game['current_player']]['name']
-    print(f"🎮 Game found: {game.get('gamemode', 'classic')} mode, current player: {current_player}")
+    current_player = game.current_player_name
+    print(f"🎮 Game found: {game.gamemode} mode, current player: {current_player}")
     
     # Send current game state
-    if game.get('gamemode') == 'inverted':
+    if game.gamemode == 'inverted':
         # For inverted mode, send the current description or starting prompt
-        current_description = None
-        if game['descriptions']:
-            current_description = game['descriptions'][-1]['text']
-        elif game['current_round'] == 0:
+        current_description = game.latest_description()
+        if current_description is None and game.current_round == 0:
             # First round - send starting prompt
             current_description = "Draw whatever you want for the AI to analyze!"
         
         game_state_data = {
             'current_player': current_player,
-            'round': game['current_round'],
+            'round': game.current_round,
             'description': current_description,
-            'players': [p['name'] for p in game['players']],
+            'players': game.player_names,
             'is_my_turn': current_player == player_name,
             'timeout': room_settings.get(room_code, {}).get('time_limit', 20)
         }
         print(f"📤 Emitting game_state_update_inverted: {game_state_data}")
         emit('game_state_update_inverted', game_state_data)
     else:
-        # For classic mode, send current image
-        current_image = None
-        if game['images']:
-            current_image = game['images'][-1]['path']
+        # For classic mode, send current image (simultaneous: the image of the player's chain)
+        current_image, is_my_turn = player_view(game, player_name)
         
         game_state_data = {
+            'gamemode': game.gamemode,
             'current_player': current_player,
-            'round': game['current_round'],
+            'round': game.current_round,
             'image': current_image,
-            'players': [p['name'] for p in game['players']],
-            'is_my_turn': current_player == player_name,
+            'image_set': image_set(current_image),
+            'players': game.player_names,
+            'is_my_turn': is_my_turn,
             'timeout': room_settings.get(room_code, {}).get('time_limit', 20)
         }
         print(f"📤 Emitting game_state_update: {game_state_data}")
         emit('game_state_update', game_state_data)
 
-@socketio.on('update_settings')
+@socket_handler('update_settings')
 def handle_update_settings(data):
     room_code = data['room_code']
     player_name = data['player_name']
@@ -837,12 +1375,32 @@ def handle_update_settings(data):
         return
     
     # Update settings
-    room_settings[room_code].update(new_settings)
+    def apply_settings(settings):
+        if settings is None:
+            return None
+        settings.update(new_settings)
+        return dict(settings)
+    
+    settings = state.update(room_settings, room_code, apply_settings)
+    if settings is None:
+        return
     
     # Notify all players in the room
     emit('settings_updated', {
-        'settings': room_settings[room_code]
+        'settings': settings
     }, room=room_code)
 
+def drain_and_exit():
+    """Stop taking joins, give turn work DRAIN_TIMEOUT to finish (then hand it off), and exit"""
+    print(f"Draining: no new joins, waiting up to {DRAIN_TIMEOUT:.0f}s for {lifecycle.in_flight()} turn tasks",
+          flush=True)
+    handed_off = lifecycle.drain(DRAIN_TIMEOUT)
+    print(f"Drained ({handed_off} handed off), exiting", flush=True)
+    # Give clients a moment to collect the last turn events (long-polling ones come back for them)
+    socketio.sleep(DRAIN_FLUSH_SECONDS)
+    # The server loop owns the main thread; every write (state, caches, files) is already done
+    os._exit(0)
+
 if __name__ == '__main__':
-    socketio.run(app, debug=True, host='0.0.0.0', port=8000)
+    # Development only and without the debugger; run.py --production serves real load
+    socketio.run(app, host='0.0.0.0', port=8000, allow_unsafe_werkzeug=socketio.async_mode == 'threading')
@@ -0,0 +1,144 @@
+"""
+Cache-friendly static files.
+
+Files under static/ come in two kinds:
+
+- Generated images, their derivatives, canvas drawings and the fallback
+  pool and prompt cache are written once under a fresh uuid (canvas
+  drawings keep a drawing_ or canvas_drawing_ prefix) or content hash and
+  never change, so browsers may keep them for a year without asking
+  again. They are not hashed.
+- Everything else (static/img: the logo, icons, stock art, the starting
+  image) can change between deploys. A manifest of content digests is built
+  at startup and refreshed in the background when a file's size or mtime
+  changes. Pages link these files as /static/<path>?v=<digest>; a request
+  whose version matches is cacheable forever, anything else must
+  revalidate, with the digest as a strong ETag.
+
+Conditional and range requests are answered by werkzeug's send_file, which
+hands the file to the server's sendfile support (wsgi.file_wrapper) or,
+with USE_X_SENDFILE, to the proxy in front.
+"""
+import os
+import threading
+import time
+from urllib.parse import quote
+
+from image_cache import file_digest
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+DIGEST_LENGTH = 16  # hex digits of SHA-256 used in URLs and ETags
+
+
+class AssetManifest:
+    """Content digests of the mutable static files, and the caching policy for all of them"""
+
+    def __init__(self, static_dir, immutable_dirs=('generated', 'canvas_drawings', 'fallback_pool', 'image_cache'),
+                 refresh_interval=30, spawn=None, sleep=None):
+        self.static_dir = os.path.normpath(static_dir)
+        self.immutable_dirs = tuple(immutable_dirs)
+        self.refresh_interval = refresh_interval
+        self._spawn = spawn
+        self._sleep = sleep or time.sleep
+        self._lock = threading.Lock()
+        self._digests = {}  # path relative to static_dir -> (size, mtime, digest)
+        self._started = False
+        self.refreshes = 0
+        self.rehashed = 0
+        self.responses = {}  # status code -> count
+        self.bytes_sent = 0
+        self.refresh()
+
+    def _relative(self, path):
+        """'static/img/x.png', '/static/img/x.png' or 'img/x.png' -> 'img/x.png'"""
+        path = path.lstrip('/')
+        prefix = os.path.basename(self.static_dir) + '/'
+        return path[len(prefix):] if path.startswith(prefix) else path
+
+    def is_immutable(self, filename):
+        return self._relative(filename).split('/', 1)[0] in self.immutable_dirs
+
+    def refresh(self):
+        """Rescan the mutable files, hashing only those whose size or mtime changed"""
+        with self._lock:
+            known = dict(self._digests)
+        digests = {}
+        for root, dirs, files in os.walk(self.static_dir):
+            relative_root = os.path.relpath(root, self.static_dir)
+            if relative_root.split(os.sep, 1)[0] in self.immutable_dirs:
+                dirs[:] = []
+                continue
+            for name in files:
+                if name.startswith('.'):
+                    continue  # temp files still being written
+                path = os.path.join(root, name)
+                key = os.path.relpath(path, self.static_dir).replace(os.sep, '/')
+                try:
+                    st = os.stat(path)
+                    entry = known.get(key)
+                    if entry is None or entry[:2] != (st.st_size, st.st_mtime):
+                        entry = (st.st_size, st.st_mtime, file_digest(path)[:DIGEST_LENGTH])
+                        self.rehashed += 1
+                except OSError:
+                    continue
+                digests[key] = entry
+        with self._lock:
+            self._digests = digests
+            self.refreshes += 1
+
+    def digest(self, filename):
+        entry = self._digests.get(self._relative(filename))
+        return entry[2] if entry else None
+
+    def url(self, path):
+        """Browser URL for an app-relative path such as 'static/img/logo.png'"""
+        filename = self._relative(path)
+        url = f"/{os.path.basename(self.static_dir)}/{quote(filename)}"
+        digest = self.digest(filename)
+        return f"{url}?v={digest}" if digest else url
+
+    def files(self, directory, extensions):
+        """Manifest paths (app-relative) of the files in a static subdirectory"""
+        prefix = directory.strip('/') + '/'
+        return sorted(f"{os.path.basename(self.static_dir)}/{key}" for key in self._digests
+                      if key.startswith(prefix) and key.lower().endswith(extensions))
+
+    def cache_control(self, filename, version=None):
+        if self.is_immutable(filename):
+            return IMMUTABLE
+        digest = self.digest(filename)
+        if version and digest and version == digest:
+            return IMMUTABLE
+        return REVALIDATE
+
+    def note_response(self, status_code, length):
+        with self._lock:
+            self.responses[status_code] = self.responses.get(status_code, 0) + 1
+            self.bytes_sent += length or 0
+
+    def start(self):
+        """Start the background refresh (once)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._spawn(self._refresh_loop)
+
+    def _refresh_loop(self):
+        while True:
+            self._sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error refreshing asset manifest: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._digests),
+                'refreshes': self.refreshes,
+                'rehashed': self.rehashed,
+                'responses': {str(status): count for status, count in sorted(self.responses.items())},
+                'bytes_sent': self.bytes_sent,
+            }
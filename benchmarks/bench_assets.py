@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark static file serving: what building and refreshing the asset
+manifest costs, and the server time and bytes of a full response, a 304
+revalidation and a range request for generated images.
+
+A browser that has seen a results page before sends no request at all for
+the generated images (they are immutable), where it used to revalidate
+every one of them.
+
+    python benchmarks/bench_assets.py --requests 200
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+os.environ.setdefault('OPENAI_API_KEY', 'bench')
+
+from assets import AssetManifest  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Static file serving benchmark')
+    parser.add_argument('--requests', type=int, default=200, help='requests per kind')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    manifest = AssetManifest('static')
+    build_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    manifest.refresh()
+    refresh_ms = (time.perf_counter() - start) * 1000
+    print(f"manifest: {len(manifest._digests)} files, built in {build_ms:.1f} ms, "
+          f"unchanged refresh {refresh_ms:.1f} ms")
+
+    import app as teleprompt
+    client = teleprompt.app.test_client()
+    images = sorted(path for path in glob.glob('static/generated/*.png'))[:10]
+    if not images:
+        sys.exit("No PNGs in static/generated")
+    etags = {path: client.get('/' + path).headers['ETag'] for path in images}
+
+    kinds = (
+        ('full', lambda path: {}),
+        ('if-none-match', lambda path: {'If-None-Match': etags[path]}),
+        ('range 64 KB', lambda path: {'Range': 'bytes=0-65535'}),
+    )
+    print(f"{'request':>14} {'status':>6} {'ms':>7} {'KB':>8}")
+    for name, headers in kinds:
+        sent = 0
+        start = time.perf_counter()
+        for i in range(args.requests):
+            path = images[i % len(images)]
+            response = client.get('/' + path, headers=headers(path))
+            sent += len(response.get_data())
+            status = response.status_code
+        elapsed = (time.perf_counter() - start) / args.requests * 1000
+        print(f"{name:>14} {status:6d} {elapsed:7.2f} {sent / args.requests / 1024:8.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark image derivatives: how long the WebP/JPEG copies take to write
+and how many bytes a room downloads with and without them.
+
+Uses the PNGs in static/generated (real generated images) unless --images
+points elsewhere. A classic game shows each image to the player whose turn
+it is, in the 512 px-wide game box, and then every player loads every image
+on the results page at about 1024 px.
+
+    python benchmarks/bench_derivatives.py --players 4 --limit 10
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+import derivatives  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Image derivative encoding cost and bandwidth per room')
+    parser.add_argument('--images', default=os.path.join(BENCH_DIR, '..', 'static', 'generated'))
+    parser.add_argument('--limit', type=int, default=10, help='images to use')
+    parser.add_argument('--players', type=int, default=4)
+    args = parser.parse_args()
+
+    sources = [path for path in sorted(glob.glob(os.path.join(args.images, '*.png')))
+               if not derivatives.is_variant(path)][:args.limit]
+    if not sources:
+        sys.exit(f"No PNGs in {args.images}")
+
+    sizes = {}
+    turn_ms = total_ms = 0.0
+    with tempfile.TemporaryDirectory() as tmp:
+        for source in sources:
+            path = shutil.copy(source, tmp)
+            start = time.perf_counter()
+            derivatives.make_derivatives(path, derivatives.TURN_WIDTHS)
+            turn_ms += (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            derivatives.make_derivatives(path)
+            total_ms += (time.perf_counter() - start) * 1000
+            sizes.setdefault('png', []).append(os.path.getsize(path))
+            for width in derivatives.WIDTHS:
+                for extension in derivatives.FORMATS:
+                    variant = derivatives.variant_path(path, width, extension)
+                    if os.path.exists(variant):
+                        sizes.setdefault(f'{width}w.{extension}', []).append(os.path.getsize(variant))
+
+    n = len(sources)
+    print(f"{n} images, before the turn moves on {turn_ms / n:.0f} ms, in the background {total_ms / n:.0f} ms")
+    print(f"{'file':>12} {'avg KB':>8}")
+    average = {name: sum(values) / len(values) for name, values in sizes.items()}
+    for name, size in average.items():
+        print(f"{name:>12} {size / 1024:8.1f}")
+
+    # One player sees each image during the game; every player sees every image on the results page
+    views = n * (1 + args.players)
+    before = views * average['png']
+    after = n * (average['512w.webp'] + args.players * average.get('1024w.webp', average['512w.webp']))
+    print(f"room of {args.players}, {n} images: PNG {before / 1024 ** 2:.1f} MB, "
+          f"WebP {after / 1024 ** 2:.1f} MB ({before / after:.0f}x less)")
+
+
+if __name__ == '__main__':
+    main()
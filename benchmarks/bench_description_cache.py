@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark the description cache: how often redrawn versions of a sketch
+(jittered, shifted and resized) find the original, how often unrelated
+sketches match by mistake, and what fingerprinting and lookups cost with
+a full index.
+
+    python benchmarks/bench_description_cache.py --sketches 200 --entries 5000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_vision import sketch  # noqa: E402
+from description_cache import DescriptionCache, fingerprint  # noqa: E402
+from strokes import parse_strokes, stroke_points  # noqa: E402
+from vision_prep import prepare_strokes  # noqa: E402
+
+
+def redraw(drawing, rng, jitter=2, shift=30, resize=0.15):
+    """The same sketch drawn again: every point wobbles, and the whole thing moves and changes size"""
+    dx, dy = rng.randint(-shift, shift), rng.randint(-shift, shift)
+    scale = rng.uniform(1 - resize, 1 + resize)
+    cx, cy = drawing['width'] / 2, drawing['height'] / 2
+    strokes = []
+    for stroke in drawing['strokes']:
+        points = [(round(cx + (x - cx) * scale + dx + rng.randint(-jitter, jitter)),
+                   round(cy + (y - cy) * scale + dy + rng.randint(-jitter, jitter)))
+                  for x, y in stroke_points(stroke['p'])]
+        deltas = list(points[0])
+        for (x0, y0), (x1, y1) in zip(points, points[1:]):
+            deltas += [x1 - x0, y1 - y0]
+        strokes.append({'c': stroke['c'], 'w': stroke['w'], 'p': deltas})
+    return parse_strokes(dict(drawing, strokes=strokes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Description cache accuracy and lookup cost')
+    parser.add_argument('--sketches', type=int, default=200)
+    parser.add_argument('--entries', type=int, default=5000, help='index size for the lookup timing')
+    parser.add_argument('--distances', type=int, nargs='+', default=[4, 6, 8, 10])
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    originals = [sketch(seed) for seed in range(args.sketches)]
+    start = time.perf_counter()
+    images = [prepare_strokes(drawing)[0] for drawing in originals]
+    prepare_ms = (time.perf_counter() - start) / len(images) * 1000
+    start = time.perf_counter()
+    keys = [fingerprint(image)[:2] for image in images]
+    fingerprint_ms = (time.perf_counter() - start) / len(images) * 1000
+    redrawn = [prepare_strokes(redraw(drawing, rng))[0] for drawing in originals]
+    print(f"prepare {prepare_ms:.1f} ms, fingerprint {fingerprint_ms:.2f} ms per drawing")
+
+    print(f"{'distance':>8} {'redraw hits':>12} {'wrong matches':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for distance in args.distances:
+            # Half the sketches are known; their redraws should hit, the other half should miss
+            known = len(originals) // 2
+            cache = DescriptionCache(os.path.join(tmp, f'index-{distance}.json'), max_distance=distance)
+            for i in range(known):
+                cache.store(keys[i], f'sketch {i}')
+            hits = sum(cache.lookup(redrawn[i])[0] == f'sketch {i}' for i in range(known))
+            wrong = sum(cache.lookup(images[i])[0] is not None for i in range(known, len(originals)))
+            print(f"{distance:8d} {hits / known:11.0%} {wrong / (len(originals) - known):13.0%}")
+
+        cache = DescriptionCache(os.path.join(tmp, 'full.json'), max_entries=args.entries)
+        for i in range(args.entries):
+            cache._put(i, rng.getrandbits(64), rng.getrandbits(64), f'entry {i}', 1.0, 0.0)
+        cache._count = args.entries
+        start = time.perf_counter()
+        for dhash, ahash in keys:
+            cache._find(dhash, ahash)
+        lookup_us = (time.perf_counter() - start) / len(keys) * 1e6
+    print(f"lookup in {args.entries} entries: {lookup_us:.0f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark the game model: memory per finished game as the old dict of dicts
+against game_model.Game, and the cost of one turn transition.
+
+    python benchmarks/bench_game_model.py --games 10000 --players 4
+"""
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from game_model import Game  # noqa: E402
+from state import InMemoryStateStore  # noqa: E402
+
+
+def old_game(i, player_count, now):
+    """A finished classic game as start_game() and the handlers used to build it"""
+    game = {
+        'id': f'game-{i}',
+        'players': [{'name': f'player{p}', 'id': f'sid-{i}-{p}'} for p in range(player_count)],
+        'current_round': 0,
+        'current_player': 0,
+        'prompts': [],
+        'images': [{'path': 'static/img/starting-img.png', 'prompt': 'Starting image'}],
+        'status': 'waiting_for_prompt',
+        'start_time': now,
+        'round_start_time': now,
+        'gamemode': 'classic'
+    }
+    for r in range(player_count):
+        game['prompts'].append({'player': f'player{r}', 'text': f'prompt {i} {r}', 'round': r})
+        game['images'].append({'player': f'player{r}', 'path': f'static/generated/{i}-{r}.png', 'round': r})
+        game['current_player'] = (game['current_player'] + 1) % len(game['players'])
+        game['current_round'] += 1
+        game['round_start_time'] = now
+        if game['current_round'] >= len(game['players']):
+            game['status'] = 'completed'
+            game['completion_time'] = now
+    return game
+
+
+def new_game(i, player_count, now):
+    players = [(f'player{p}', f'sid-{i}-{p}') for p in range(player_count)]
+    game = Game(f'game-{i}', 'classic', players, now, starting_image='static/img/starting-img.png')
+    for r in range(player_count):
+        game.add_prompt(f'player{r}', f'prompt {i} {r}')
+        game.add_image(f'player{r}', f'static/generated/{i}-{r}.png')
+        game.advance(now)
+    return game
+
+
+def measure_memory(build, games, player_count):
+    gc.collect()
+    tracemalloc.start()
+    now = time.time()
+    kept = [build(i, player_count, now) for i in range(games)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return size / games
+
+
+def measure_transition(rounds, player_count):
+    """Mean microseconds for state.update() + record + advance on one room"""
+    state = InMemoryStateStore()
+    players = [(f'player{p}', f'sid{p}') for p in range(player_count)]
+
+    def record_and_advance(game):
+        game.add_image(game.current_player_name, 'static/generated/x.png')
+        game.advance(time.time())
+        return game.copy()
+
+    elapsed = 0.0
+    for r in range(rounds):
+        if r % player_count == 0:
+            state.games['R'] = Game('g', 'classic', players, time.time())
+        start = time.perf_counter()
+        state.update(state.games, 'R', record_and_advance)
+        elapsed += time.perf_counter() - start
+    return elapsed / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure game model memory and transition cost')
+    parser.add_argument('--games', type=int, default=10000)
+    parser.add_argument('--players', type=int, default=4)
+    parser.add_argument('--rounds', type=int, default=10000)
+    args = parser.parse_args()
+
+    old = measure_memory(old_game, args.games, args.players)
+    new = measure_memory(new_game, args.games, args.players)
+    print(f"bytes per finished {args.players}-player game: dict {old:.0f}, Game {new:.0f} ({old / new:.1f}x smaller)")
+    print(f"turn transition: {measure_transition(args.rounds, args.players):.1f} us")
+
+
+if __name__ == '__main__':
+    main()
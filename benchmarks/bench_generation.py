@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark the generation worker pool against the local stub image server.
+
+Compares the old one-background-task-per-prompt behaviour ("unbounded")
+with GenerationEngine, reporting wall time, peak concurrent provider calls
+seen by the stub, and how evenly rooms were served.
+
+    python benchmarks/bench_generation.py --rooms 20 --prompts 4 --workers 4
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+import requests
+from openai import OpenAI
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from generation import GenerationEngine  # noqa: E402
+from stub_server import start_stub_server  # noqa: E402
+
+
+def make_generate(client):
+    """The provider half of app.generate_image, without writing files"""
+    def generate(prompt):
+        try:
+            response = client.images.generate(model="dall-e-2", prompt=prompt, n=1, size="1024x1024")
+            return len(requests.get(response.data[0].url).content)
+        except Exception:
+            errors.append(prompt)
+            return 0
+    errors = []
+    generate.errors = errors
+    return generate
+
+
+def run_unbounded(generate, rooms, prompts):
+    finished = {}
+    lock = threading.Lock()
+    threads = []
+
+    def task(room, i):
+        generate(f"room {room} prompt {i}")
+        with lock:
+            finished.setdefault(room, []).append((i, time.time()))
+
+    for i in range(prompts):
+        for room in range(rooms):
+            thread = threading.Thread(target=task, args=(room, i))
+            thread.start()
+            threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return finished
+
+
+def run_pool(generate, rooms, prompts, workers):
+    engine = GenerationEngine(max_workers=workers, max_queue=rooms * prompts)
+    finished = {}
+    lock = threading.Lock()
+    done = threading.Semaphore(0)
+
+    def task(job, room, i):
+        generate(f"room {room} prompt {i}")
+        with lock:
+            finished.setdefault(room, []).append((i, time.time()))
+        done.release()
+
+    for i in range(prompts):
+        for room in range(rooms):
+            engine.submit(room, task, room, i)
+    for _ in range(rooms * prompts):
+        done.acquire()
+    return finished
+
+
+def summarize(name, finished, started, state, errors):
+    wall = time.time() - started
+    last_per_room = [max(t for _, t in entries) - started for entries in finished.values()]
+    in_order = all([i for i, _ in entries] == sorted(i for i, _ in entries) for entries in finished.values())
+    stats = state.snapshot()
+    print(f"{name:>10}: wall {wall:6.2f}s  peak provider calls {stats['max_in_flight']:4d}  "
+          f"room finish min/max {min(last_per_room):5.2f}/{max(last_per_room):5.2f}s  "
+          f"per-room order kept: {in_order}  errors {len(errors)}")
+    errors.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rooms', type=int, default=20)
+    parser.add_argument('--prompts', type=int, default=4, help='prompts submitted per room')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.3)
+    args = parser.parse_args()
+
+    server, state, base_url = start_stub_server(latency=args.latency, jitter=args.latency / 5)
+    generate = make_generate(OpenAI(api_key='stub', base_url=base_url, max_retries=0))
+    print(f"{args.rooms} rooms x {args.prompts} prompts, stub latency {args.latency}s")
+
+    started = time.time()
+    summarize('unbounded', run_unbounded(generate, args.rooms, args.prompts), started, state, generate.errors)
+
+    state.reset()
+    started = time.time()
+    summarize(f'pool({args.workers})', run_pool(generate, args.rooms, args.prompts, args.workers), started, state, generate.errors)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
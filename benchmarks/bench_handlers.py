@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the in-process hot paths of app.py, with a stored
+baseline to catch regressions.
+
+Socket.IO handlers are called the way Flask-SocketIO calls them: in the
+request context of a connected test client's socket. So each number is the
+handler's own work, including encoding what it emits to the room, without
+the test client's packet round trip. OpenAI calls go to the stub in a
+background thread; only the fallback pool makes them, when a game starts.
+
+    python benchmarks/bench_handlers.py                      # compare with benchmarks/baselines/handlers.json
+    python benchmarks/bench_handlers.py --json results.json  # also write the results
+    python benchmarks/bench_handlers.py --update-baseline    # after an intended change, or on a new machine
+
+Each benchmark reports the median and p95 microseconds per call, from the
+fastest of --repeat runs (the slower ones measured the machine). Disconnect
+is measured at each --rooms size, and disconnect_scaling is the largest
+size's median over the smallest: about 1 while disconnect only touches the
+departing socket's rooms, and in the hundreds if it ever scans every room
+again. The run fails (exit status 1) when a median is more than --tolerance
+above its baseline, or the scaling ratio is over --max-scaling; the ratio
+needs no baseline, so that check means the same on any machine.
+"""
+import argparse
+import contextlib
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+os.chdir(ROOT)
+
+from stub_server import start_stub_server  # noqa: E402
+
+BASELINE = os.path.join(BENCH_DIR, 'baselines', 'handlers.json')
+ROOM = 'BENCH'
+
+
+@contextlib.contextmanager
+def no_gc():
+    """Like timeit: a collection landing in one call costs with the whole heap, not the handler"""
+    gc.collect()
+    gc.disable()
+    try:
+        yield
+    finally:
+        gc.enable()
+
+
+def timed_calls(fn, calls, setup=None):
+    """Microseconds of each fn() call; setup() runs untimed before each one"""
+    samples = []
+    with no_gc():
+        for i in range(calls):
+            if setup is not None:
+                setup(i)
+            start = time.perf_counter()
+            fn(i)
+            samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+
+def summary(samples):
+    ordered = sorted(samples)
+    return {
+        'median_us': round(statistics.median(ordered), 2),
+        'p95_us': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+        'calls': len(ordered),
+    }
+
+
+class Bench:
+    def __init__(self, teleprompt, players, results_players):
+        self.t = teleprompt
+        self.players = players
+        self.results_players = results_players
+        self.clients = []
+
+    def client(self):
+        client = self.t.socketio.test_client(self.t.app)
+        self.clients.append(client)
+        return client
+
+    def handler_calls(self, handler, data, calls, client_for, setup=None):
+        """Microseconds of each handler(data) call (handler() when data is None) for client_for(i)'s socket"""
+        server = self.t.socketio.server
+        samples = []
+        with no_gc():
+            for i in range(calls):
+                if setup is not None:
+                    setup(i)
+                sid = server.manager.sid_from_eio_sid(client_for(i).eio_sid, '/')
+                with self.t.app.request_context(server.get_environ(sid)):
+                    self.t.request.sid = sid
+                    self.t.request.namespace = '/'
+                    start = time.perf_counter()
+                    handler() if data is None else handler(data)
+                    samples.append((time.perf_counter() - start) * 1e6)
+        return samples
+
+    def drain(self):
+        # The test clients queue everything they receive; nothing here reads it
+        for client in self.clients:
+            if client.is_connected():
+                client.get_received()
+
+    def fill_room(self, room_code, player_count):
+        """A lobby with player_count players joined through the handler; returns their clients"""
+        clients = []
+        for p in range(player_count):
+            client = self.client()
+            client.emit('join_room', {'room_code': room_code, 'player_name': f'player{p}', 'is_creator': p == 0})
+            clients.append(client)
+        return clients
+
+    def close(self, room_code, clients):
+        """Disconnect a room's clients, so later benchmarks do not also emit to them, and tear it down"""
+        for client in clients:
+            if client.is_connected():
+                client.disconnect()
+        self.clients = [client for client in self.clients if client.is_connected()]
+        self.end_game(room_code)
+        self.t.cleanup_room(room_code)
+
+    def end_game(self, room_code):
+        self.t.games.pop(room_code, None)
+        self.t.turn_timers.cancel(room_code)
+        self.t.tracer.room_ended(room_code)
+
+    def join_room(self, calls):
+        """A player rejoining a full room (a page reload), and a newcomer bounced from it"""
+        clients = self.fill_room(ROOM + 'J', self.players)
+        creator = clients[0]
+        rejoin = {'room_code': ROOM + 'J', 'player_name': 'player1'}
+        newcomer = {'room_code': ROOM + 'J', 'player_name': 'late'}
+        handler = self.t.handle_join_room
+        results = {
+            'join_room (rejoin full room)': summary(self.handler_calls(
+                handler, rejoin, calls, lambda i: clients[1], setup=lambda i: self.drain())),
+            'join_room (room full)': summary(self.handler_calls(
+                handler, newcomer, calls, lambda i: creator, setup=lambda i: self.drain())),
+        }
+        self.close(ROOM + 'J', clients)
+        return results
+
+    def disconnect(self, room_counts, calls):
+        """A lobby player leaving, with room_count other lobbies open in the process"""
+        registry = self.t.room_registry
+        results = {}
+        created = 0
+        for room_count in sorted(room_counts):
+            # Other lobbies are put in the registry directly; joining them through the handler would take minutes
+            while created < room_count:
+                room_code = f'{ROOM}-{created}'
+                registry.create_room(room_code)
+                for p in range(self.players):
+                    registry.join(room_code, f'player{p}', f'{room_code}-sid{p}', self.players)
+                created += 1
+            room_code = f'{ROOM}D{room_count}'
+            clients = self.fill_room(room_code, self.players - 1)
+            leaving = []
+
+            def join(i):
+                if leaving:
+                    # Gone from the lobby already; out of the Socket.IO room too, or the room's emits grow
+                    leaving[-1].disconnect()
+                self.drain()
+                client = self.client()
+                client.emit('join_room', {'room_code': room_code, 'player_name': 'leaving'})
+                leaving.append(client)
+
+            samples = self.handler_calls(self.t.handle_disconnect, None, calls, lambda i: leaving[i], setup=join)
+            leaving[-1].disconnect()
+            results[f'disconnect ({room_count} rooms)'] = summary(samples)
+            self.close(room_code, clients)
+        for r in range(created):
+            registry.remove_room(f'{ROOM}-{r}')
+        return results
+
+    def start_game(self, calls):
+        """start_game_manual for a full lobby, through the checks to game_started"""
+        clients = self.fill_room(ROOM + 'S', self.players)
+        creator = clients[0]
+        start = {'room_code': ROOM + 'S', 'player_name': 'player0'}
+
+        def reset(i):
+            self.drain()
+            self.end_game(ROOM + 'S')
+
+        samples = self.handler_calls(self.t.handle_start_game_manual, start, calls, lambda i: creator, setup=reset)
+        results = {'start_game': summary(samples)}
+        self.close(ROOM + 'S', clients)
+        return results
+
+    def get_game_state(self, calls):
+        """A player's page asking for the state of a running game, in both game modes"""
+        results = {}
+        for gamemode in ('classic', 'inverted'):
+            room_code = f'{ROOM}G{gamemode}'
+            clients = self.fill_room(room_code, self.players)
+            self.t.room_settings[room_code]['gamemode'] = gamemode
+            clients[0].emit('start_game_manual', {'room_code': room_code, 'player_name': 'player0'})
+            request = {'room_code': room_code, 'player_name': 'player1'}
+            samples = self.handler_calls(self.t.handle_get_game_state, request, calls, lambda i: clients[1],
+                                         setup=lambda i: self.drain())
+            results[f'get_game_state ({gamemode})'] = summary(samples)
+            self.close(room_code, clients)
+        return results
+
+    def round_advance(self, games):
+        """finish_turn recording a classic turn's prompt and image, to the next turn and to game_completed"""
+        advance, complete = [], []
+        with no_gc():
+            for g in range(games):
+                room_code = f'{ROOM}R{g}'
+                clients = self.fill_room(room_code, self.players)
+                clients[0].emit('start_game_manual', {'room_code': room_code, 'player_name': 'player0'})
+                for turn_round in range(self.players):
+                    self.drain()
+                    player = f'player{turn_round}'
+
+                    def record(game):
+                        # Generated paths that are not on disk, so storage tracks them without touching real files
+                        game.add_prompt(player, f'prompt {g} {turn_round}')
+                        game.add_image(player, f'static/generated/bench-{g}-{turn_round}.png')
+
+                    start = time.perf_counter()
+                    self.t.finish_turn(room_code, turn_round, record)
+                    elapsed = (time.perf_counter() - start) * 1e6
+                    (complete if turn_round == self.players - 1 else advance).append(elapsed)
+                self.t.storage.release(self.t.games[room_code].id)
+                self.close(room_code, clients)
+        return {
+            'finish_turn (next turn)': summary(advance),
+            'finish_turn (game completed)': summary(complete),
+        }
+
+    def random_static_image(self, calls):
+        return {'get_random_static_image': summary(timed_calls(lambda i: self.t.get_random_static_image(), calls))}
+
+    def results_page(self, calls):
+        """The results template for a finished classic game of results_players players"""
+        from game_model import Game
+        players = [(f'player{p}', f'sid{p}') for p in range(self.results_players)]
+        game = Game('bench-results', 'classic', players, time.time(), starting_image=self.t.STARTING_IMAGE)
+        for r in range(self.results_players):
+            game.add_prompt(f'player{r}', f'a prompt of about the usual length for round {r} of the game')
+            game.add_image(f'player{r}', f'static/generated/bench-results-{r}.png')
+            game.advance(time.time())
+        view = game.to_dict()
+        with self.t.app.test_request_context(f'/results/{ROOM}'):
+            samples = timed_calls(lambda i: self.t.render_template('results.html', game=view), calls)
+        return {f'results render ({self.results_players} players)': summary(samples)}
+
+
+def compare(current, baseline, tolerance, max_scaling):
+    """Medians more than tolerance above the baseline, and disconnect scaling over max_scaling"""
+    regressions = []
+    for name, result in current['handlers'].items():
+        base = baseline.get('handlers', {}).get(name)
+        if base is not None and result['median_us'] > base['median_us'] * (1 + tolerance):
+            regressions.append(f"{name}: {result['median_us']:.1f} us, baseline {base['median_us']:.1f} us")
+    if current['disconnect_scaling'] > max_scaling:
+        regressions.append(f"disconnect_scaling: {current['disconnect_scaling']:.2f}x, more than {max_scaling:.1f}x")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for the app.py handlers, against a baseline')
+    parser.add_argument('--calls', type=int, default=500, help='calls per benchmark')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of every benchmark; the fastest is kept')
+    parser.add_argument('--rooms', type=int, nargs='+', default=[100, 1000, 10000],
+                        help='open lobbies for the disconnect benchmark')
+    parser.add_argument('--players', type=int, default=4, help='players per room (the lobby holds at most 4)')
+    parser.add_argument('--results-players', type=int, default=8, help='players in the results page game')
+    parser.add_argument('--games', type=int, default=50, help='games played through for finish_turn')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--tolerance', type=float, default=1.0, help='allowed slowdown over the baseline (1.0 = 2x)')
+    parser.add_argument('--max-scaling', type=float, default=2.0, help='allowed disconnect time growth over --rooms')
+    parser.add_argument('--update-baseline', action='store_true', help='write these results as the new baseline')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    stub, _, base_url = start_stub_server(latency=0, jitter=0)
+    os.environ['OPENAI_BASE_URL'] = base_url
+    os.environ.setdefault('OPENAI_API_KEY', 'bench')
+
+    # The handlers print every event they handle; that is not what is being measured here
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        import app as teleprompt
+        # Sweeps are not measured here, and would delete old files in static/generated on a long run
+        teleprompt.storage.sweep_interval = 10 ** 9
+        bench = Bench(teleprompt, args.players, args.results_players)
+        handlers = {}
+        for _ in range(args.repeat):
+            run = {}
+            run.update(bench.join_room(args.calls))
+            run.update(bench.disconnect(args.rooms, min(args.calls, 200)))
+            run.update(bench.start_game(args.calls))
+            run.update(bench.get_game_state(args.calls))
+            run.update(bench.round_advance(args.games))
+            run.update(bench.random_static_image(args.calls))
+            run.update(bench.results_page(args.calls))
+            for name, result in run.items():
+                if name not in handlers or result['median_us'] < handlers[name]['median_us']:
+                    handlers[name] = result
+    stub.shutdown()
+
+    smallest, largest = min(args.rooms), max(args.rooms)
+    scaling = (handlers[f'disconnect ({largest} rooms)']['median_us']
+               / handlers[f'disconnect ({smallest} rooms)']['median_us'])
+    current = {'handlers': handlers, 'disconnect_scaling': round(scaling, 3)}
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.update_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    regressions = compare(current, baseline, args.tolerance, args.max_scaling)
+
+    print(f"{'benchmark':>36} {'median us':>10} {'p95 us':>10} {'baseline':>10}")
+    for name, result in handlers.items():
+        base = baseline.get('handlers', {}).get(name)
+        base_text = f"{base['median_us']:10.1f}" if base else f"{'-':>10}"
+        print(f"{name:>36} {result['median_us']:10.1f} {result['p95_us']:10.1f} {base_text}")
+    print(f"disconnect {largest} rooms / {smallest} rooms: {scaling:.2f}x (at most {args.max_scaling:.1f}x)")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(dict(current, regressions=regressions), f, indent=2)
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(current, f, indent=2)
+            f.write('\n')
+        print(f"Baseline written to {os.path.relpath(args.baseline)}")
+    elif not baseline:
+        print(f"No baseline at {os.path.relpath(args.baseline)}; run with --update-baseline to store one")
+    if regressions:
+        print(f"\n{len(regressions)} regressed:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
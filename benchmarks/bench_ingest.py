@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark image ingest: the old download -> decode -> numpy copy -> PNG
+re-encode path against streaming the bytes straight to disk.
+
+Each variant runs in its own subprocess so peak RSS is not shared, and the
+stub image server runs in a third process so its CPU is not counted.
+
+    python benchmarks/bench_ingest.py --images 10
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+
+def current_rss_kb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() // 1024
+
+
+def ingest_old(url, save_dir):
+    """What generate_image() used to do"""
+    import uuid
+    from io import BytesIO
+
+    import numpy as np
+    import requests
+    from PIL import Image
+
+    image_bytes = requests.get(url).content
+    image = Image.open(BytesIO(image_bytes))
+    numpy_array = np.array(image)  # noqa: F841 - kept to match the old code path
+    image_path = os.path.join(save_dir, f"{uuid.uuid4()}.png")
+    image.save(image_path, "PNG")
+    return image_path
+
+
+def ingest_new(url, save_dir):
+    from ingest import download_image
+    return download_image(url, save_dir)
+
+
+def run_variant(variant, url, images):
+    ingest = ingest_old if variant == 'old' else ingest_new
+    # Import everything and warm the connection before measuring
+    import numpy  # noqa: F401
+    import requests  # noqa: F401
+    from PIL import Image  # noqa: F401
+    import ingest as ingest_module  # noqa: F401
+
+    with tempfile.TemporaryDirectory() as save_dir:
+        ingest(url, save_dir)
+        rss_before = current_rss_kb()
+        tracemalloc.start()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        for _ in range(images):
+            ingest(url, save_dir)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # kB on Linux
+
+    print(json.dumps({
+        'variant': variant,
+        'cpu_ms_per_image': cpu / images * 1000,
+        'wall_ms_per_image': wall / images * 1000,
+        'tracemalloc_peak_kb': traced_peak // 1024,
+        'peak_rss_growth_kb': max(0, peak_rss - rss_before),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare old and streaming image ingest')
+    parser.add_argument('--images', type=int, default=10)
+    parser.add_argument('--variant', choices=['old', 'new'], help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        run_variant(args.variant, args.url, args.images)
+        return
+
+    port = 8123
+    stub = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, 'stub_server.py'),
+                             '--port', str(port), '--latency', '0'], stdout=subprocess.PIPE)
+    try:
+        stub.stdout.readline()  # wait until it is listening
+        url = f'http://127.0.0.1:{port}/files/bench.png'
+        results = []
+        for variant in ('old', 'new'):
+            output = subprocess.check_output([sys.executable, __file__, '--variant', variant,
+                                              '--url', url, '--images', str(args.images)])
+            results.append(json.loads(output.decode().strip().splitlines()[-1]))
+    finally:
+        stub.terminate()
+
+    print(f"{'variant':>8} {'cpu ms/img':>11} {'wall ms/img':>12} {'py peak kB':>11} {'rss growth kB':>14}")
+    for r in results:
+        print(f"{r['variant']:>8} {r['cpu_ms_per_image']:11.1f} {r['wall_ms_per_image']:12.1f} "
+              f"{r['tracemalloc_peak_kb']:11d} {r['peak_rss_growth_kb']:14d}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+Load test: full rooms of simulated players against the real server.
+
+Starts the OpenAI stand-in (stub_server.py) and `run.py --production` on
+free ports, then drives --rooms rooms of --players Socket.IO clients each
+through join_room -> start_game_manual -> submit_prompt / submit_drawing
+-> game_completed, spreading the rooms over the --modes. Reports:
+
+- turns per second;
+- turn latency percentiles, from a player's submit until the room moves on;
+- the server's event loop lag, from its /metrics;
+- server memory per room: peak RSS growth over the idle server, and the
+  games' own approximate size.
+
+    python benchmarks/bench_load.py --rooms 50 --players 4 --modes classic inverted
+    python benchmarks/bench_load.py --rooms 100 --latency 2 --shape lognormal --error-rate 0.02 --json run.json
+
+The server runs in run.py's production default, eventlet (`pip install
+eventlet`), unless --async-mode says otherwise; the report names the mode.
+Server settings such as GENERATION_WORKERS are read from the environment as
+usual. Without the websocket-client package the clients long-poll, which
+costs the server more than browsers on WebSocket do. Images and drawings
+written during the run are deleted afterwards.
+"""
+import argparse
+import json
+import os
+import queue
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import socketio
+
+try:
+    import websocket  # noqa: F401  (websocket-client, for the WebSocket transport)
+    TRANSPORTS = None
+except ImportError:
+    TRANSPORTS = ['polling']
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, BENCH_DIR)
+
+from bench_strokes import random_drawing  # noqa: E402
+
+MODES = ('classic', 'inverted', 'simultaneous')
+OUTPUT_DIRS = ('static/generated', 'static/canvas_drawings')
+# The room creator's client follows the game; every client hears about its own failed submits
+ROOM_EVENTS = ('player_list_updated', 'settings_updated', 'game_started', 'next_turn', 'next_turn_inverted',
+               'next_round', 'game_completed', 'image_generation_error', 'image_processing_error')
+PLAYER_EVENTS = ('error', 'generation_busy')
+ERROR_EVENTS = ('error', 'image_generation_error', 'image_processing_error')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            requests.get(url, timeout=1)
+            return True
+        except requests.RequestException:
+            time.sleep(0.2)
+    return False
+
+
+def rss_bytes(pid):
+    """Resident memory of a process (Linux), or None"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def histogram_summary(metrics_text, name):
+    """Mean and bucket-bound p50/p99 of a Prometheus histogram, in seconds"""
+    buckets = [(float(bound), int(float(count))) for bound, count in
+               re.findall(rf'^{name}_bucket\{{le="([^"]+)"\}} (\S+)$', metrics_text, re.M)]
+    total = re.search(rf'^{name}_sum (\S+)$', metrics_text, re.M)
+    count = re.search(rf'^{name}_count (\S+)$', metrics_text, re.M)
+    if not buckets or not count or float(count.group(1)) == 0:
+        return None
+    count = float(count.group(1))
+
+    def quantile(q):
+        return next(bound for bound, cumulative in buckets if cumulative >= q * count)
+
+    return {'mean': float(total.group(1)) / count, 'p50': quantile(0.5), 'p99': quantile(0.99), 'samples': int(count)}
+
+
+class RoomBot:
+    """Plays one game with a room full of clients"""
+
+    def __init__(self, url, room_code, mode, players, time_limit, timeout):
+        self.url = url
+        self.room_code = room_code
+        self.mode = mode
+        self.names = [f'p{i}' for i in range(players)]
+        self.time_limit = time_limit
+        self.timeout = timeout
+        self.events = queue.Queue()
+        self.clients = {}
+        self.turns = []  # seconds from submit to the room moving on
+        self.errors = []
+        self.busy = 0
+        self.completed = False
+
+    def _listen(self, client, events):
+        for event in events:
+            client.on(event, lambda data=None, event=event: self.events.put((event, data or {}, time.perf_counter())))
+
+    def _wait(self, *names, until=None):
+        """The next of the named events (for which until(data) holds), noting errors on the way"""
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                event, data, received = self.events.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                raise TimeoutError(f"{self.room_code}: no {'/'.join(names)} within {self.timeout}s")
+            if event in ERROR_EVENTS:
+                self.errors.append(f"{event}: {data.get('message') or data.get('error')}")
+            elif event == 'generation_busy':
+                self.busy += 1
+            if event in names and (until is None or until(data)):
+                return event, data, received
+
+    def _emit(self, player_name, event, data):
+        self.clients[player_name].emit(event, dict(data, room_code=self.room_code, player_name=player_name))
+
+    def _submit(self, player_name, turn):
+        if self.mode == 'inverted':
+            # A different sketch every turn, so the description cache does not answer for the stub
+            seed = hash((self.room_code, turn)) & 0xffffffff
+            self._emit(player_name, 'submit_drawing', {'strokes': random_drawing(12, 20, seed=seed)})
+        else:
+            self._emit(player_name, 'submit_prompt', {'prompt': f'{self.room_code} turn {turn}: a cat on a bicycle'})
+
+    def run(self):
+        try:
+            for i, name in enumerate(self.names):
+                client = socketio.Client(reconnection=False)
+                self._listen(client, ROOM_EVENTS + PLAYER_EVENTS if i == 0 else PLAYER_EVENTS)
+                client.connect(self.url, transports=TRANSPORTS, wait_timeout=self.timeout)
+                self.clients[name] = client
+                self._emit(name, 'join_room', {'is_creator': i == 0})
+                self._wait('player_list_updated', until=lambda data, n=i + 1: len(data.get('players', [])) == n)
+            creator = self.names[0]
+            self._emit(creator, 'update_settings', {'settings': {'gamemode': self.mode, 'time_limit': self.time_limit}})
+            self._wait('settings_updated')
+            self._emit(creator, 'start_game_manual', {})
+            _, data, _ = self._wait('game_started')
+            if self.mode == 'simultaneous':
+                self._play_simultaneous()
+            else:
+                self._play_in_turns(data['current_player'])
+            self.completed = True
+        except Exception as e:
+            self.errors.append(f"{type(e).__name__}: {e}")
+        finally:
+            for client in self.clients.values():
+                try:
+                    client.disconnect()
+                except Exception:
+                    pass
+        return self
+
+    def _play_in_turns(self, current_player):
+        next_event = 'next_turn_inverted' if self.mode == 'inverted' else 'next_turn'
+        for turn in range(len(self.names)):
+            submitted = time.perf_counter()
+            self._submit(current_player, turn)
+            event, data, received = self._wait(next_event, 'game_completed', 'generation_busy')
+            while event == 'generation_busy':
+                # The turn came back to the player; try again like a player would
+                time.sleep(1)
+                self._submit(current_player, turn)
+                event, data, received = self._wait(next_event, 'game_completed', 'generation_busy')
+            self.turns.append(received - submitted)
+            if event == 'game_completed':
+                return
+            current_player = data['current_player']
+
+    def _play_simultaneous(self):
+        for turn in range(len(self.names)):
+            for name in self.names:
+                self._submit(name, turn)
+            submitted = time.perf_counter()
+            _, _, received = self._wait('next_round', 'game_completed')
+            # Every player's turn in the round ends together
+            self.turns.extend([received - submitted] * len(self.names))
+
+
+def start_stub(args, port):
+    command = [sys.executable, os.path.join(BENCH_DIR, 'stub_server.py'), '--port', str(port),
+               '--latency', str(args.latency), '--jitter', str(args.jitter), '--shape', args.shape,
+               '--slow-rate', str(args.slow_rate), '--slow-latency', str(args.slow_latency),
+               '--error-rate', str(args.error_rate), '--token-interval', str(args.token_interval),
+               '--image', args.images]
+    return subprocess.Popen(command, stdout=subprocess.DEVNULL)
+
+
+def start_server(args, port, stub_port, log):
+    env = dict(os.environ, OPENAI_BASE_URL=f'http://127.0.0.1:{stub_port}/v1', OPENAI_API_KEY='stub')
+    command = [sys.executable, 'run.py', '--production', '--async-mode', args.async_mode,
+               '--host', '127.0.0.1', '--port', str(port)]
+    return subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+def listing():
+    return {os.path.join(directory, name) for directory in OUTPUT_DIRS
+            for name in (os.listdir(os.path.join(ROOT, directory)) if os.path.isdir(os.path.join(ROOT, directory))
+                         else [])}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated rooms against the server and a local OpenAI stand-in')
+    parser.add_argument('--rooms', type=int, default=20)
+    parser.add_argument('--players', type=int, default=4, help='players per room (2-4)')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=['classic', 'inverted'])
+    parser.add_argument('--ramp', type=float, default=5.0, help='seconds over which rooms start')
+    parser.add_argument('--time-limit', type=int, default=60, help='turn time limit in the rooms')
+    parser.add_argument('--timeout', type=float, default=120.0, help='seconds a room may wait for any event')
+    parser.add_argument('--async-mode', choices=('eventlet', 'gevent', 'threading'),
+                        default=os.getenv('TELEPROMPT_ASYNC_MODE', 'eventlet'),
+                        help='server async mode, eventlet like run.py --production (run.py --async-mode)')
+    parser.add_argument('--latency', type=float, default=0.5, help='mean OpenAI latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.1, help='latency standard deviation')
+    parser.add_argument('--shape', choices=('normal', 'lognormal'), default='normal')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='fraction of calls that are slow')
+    parser.add_argument('--slow-latency', type=float, default=5.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of calls that fail')
+    parser.add_argument('--token-interval', type=float, default=0.02, help='seconds between streamed words')
+    parser.add_argument('--images', default=os.path.join(ROOT, 'static', 'generated'),
+                        help='PNG or directory of PNGs the stub serves as generated images')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    stub_port, port = free_port(), free_port()
+    url = f'http://127.0.0.1:{port}'
+    before = listing()
+    stub = start_stub(args, stub_port)
+    log = tempfile.TemporaryFile()
+    server = start_server(args, port, stub_port, log)
+    try:
+        if not wait_until_up(f'{url}/health', server):
+            log.seek(0)
+            sys.exit(f"Server did not start:\n{log.read().decode(errors='replace')[-2000:]}")
+        idle_rss = rss_bytes(server.pid)
+        peak_rss = [idle_rss or 0]
+        running = threading.Event()
+        running.set()
+
+        def sample_memory():
+            while running.is_set():
+                peak_rss[0] = max(peak_rss[0], rss_bytes(server.pid) or 0)
+                time.sleep(0.2)
+
+        threading.Thread(target=sample_memory, daemon=True).start()
+
+        bots = [RoomBot(url, f'LOAD{i}', args.modes[i % len(args.modes)], args.players, args.time_limit, args.timeout)
+                for i in range(args.rooms)]
+        started = time.perf_counter()
+
+        def play(i):
+            time.sleep(args.ramp * i / max(1, args.rooms))
+            return bots[i].run()
+
+        with ThreadPoolExecutor(max_workers=args.rooms) as pool:
+            list(pool.map(play, range(args.rooms)))
+        elapsed = time.perf_counter() - started
+        running.clear()
+
+        metrics_text = requests.get(f'{url}/metrics').text
+        games = requests.get(f'{url}/stats').json()['games']
+        stub_stats = requests.get(f'http://127.0.0.1:{stub_port}/stats').json()
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        stub.terminate()
+        stub.wait()
+        log.close()
+        for path in listing() - before:
+            os.remove(os.path.join(ROOT, path))
+
+    results = {'rooms': args.rooms, 'players': args.players, 'async_mode': args.async_mode, 'elapsed': elapsed,
+               'modes': {}}
+    print(f"{args.async_mode} server, {args.rooms} rooms of {args.players}, {elapsed:.1f} s, stub: {stub_stats['requests']} calls, "
+          f"{stub_stats['max_in_flight']} at once, {stub_stats['errors']} failed")
+    print(f"{'mode':>13} {'games':>6} {'done':>5} {'turns':>6} {'turns/s':>8} {'p50 s':>7} {'p95 s':>7} "
+          f"{'p99 s':>7} {'errors':>7} {'busy':>5}")
+    for mode in ['all'] + list(args.modes):
+        group = [bot for bot in bots if mode in ('all', bot.mode)]
+        turns = [latency for bot in group for latency in bot.turns]
+        row = {
+            'games': len(group),
+            'completed': sum(bot.completed for bot in group),
+            'turns': len(turns),
+            'turns_per_second': len(turns) / elapsed,
+            'p50': percentile(turns, 0.5),
+            'p95': percentile(turns, 0.95),
+            'p99': percentile(turns, 0.99),
+            'errors': sum(len(bot.errors) for bot in group),
+            'busy': sum(bot.busy for bot in group),
+        }
+        results['modes'][mode] = row
+        latencies = ' '.join(f"{row[q]:7.2f}" if row[q] is not None else f"{'-':>7}" for q in ('p50', 'p95', 'p99'))
+        print(f"{mode:>13} {row['games']:6d} {row['completed']:5d} {row['turns']:6d} "
+              f"{row['turns_per_second']:8.2f} {latencies} {row['errors']:7d} {row['busy']:5d}")
+
+    lag = histogram_summary(metrics_text, 'teleprompt_event_loop_lag_seconds')
+    results['event_loop_lag'] = lag
+    if lag:
+        print(f"event loop lag: mean {lag['mean'] * 1000:.2f} ms, p50 <= {lag['p50'] * 1000:g} ms, "
+              f"p99 <= {lag['p99'] * 1000:g} ms ({lag['samples']} samples)")
+        if args.async_mode == 'threading':
+            # No event loop to block: the probe's thread only waits for the GIL
+            print("  (threading server: this is GIL contention, not the event loop lag of eventlet or gevent)")
+    if idle_rss:
+        per_room = (peak_rss[0] - idle_rss) / args.rooms
+        results['memory'] = {'idle_rss': idle_rss, 'peak_rss': peak_rss[0], 'per_room': per_room}
+        print(f"memory: idle {idle_rss / 1024 ** 2:.0f} MB, peak {peak_rss[0] / 1024 ** 2:.0f} MB, "
+              f"{per_room / 1024:.0f} KB per room")
+    if games['resident']:
+        print(f"games: {games['resident']} resident, {games['resident_bytes'] / games['resident'] / 1024:.1f} KB each")
+
+    failures = [f"{bot.room_code} ({bot.mode}): {error}" for bot in bots for error in bot.errors]
+    for failure in failures[:10]:
+        print(f"  {failure}")
+    if len(failures) > 10:
+        print(f"  ... and {len(failures) - 10} more")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
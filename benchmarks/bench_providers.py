@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Benchmark the provider layer against the stub with injected tail latency
+and errors:
+
+1. Tail latency: the same image calls with and without hedging, reporting
+   latency percentiles and how many extra requests hedging cost.
+2. Outage: every call fails; shows how quickly the circuit breaker stops
+   calling the provider and how it recovers once the errors stop.
+
+    python benchmarks/bench_providers.py --calls 200 --slow-rate 0.1
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+from openai import OpenAI  # noqa: E402
+
+from providers import CircuitBreaker, Provider, ProviderUnavailable  # noqa: E402
+from stub_server import start_stub_server  # noqa: E402
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run_calls(provider, client, calls, concurrency, budget):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        started = time.time()
+        try:
+            provider.call(client.images.generate, started + budget, model='dall-e-2', prompt='a cat',
+                          n=1, size='1024x1024')
+        except Exception:
+            with lock:
+                errors += 1
+            return
+        with lock:
+            latencies.append(time.time() - started)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(calls)))
+    return latencies, errors
+
+
+def tail_latency(client, stub, args):
+    print(f"{'variant':>10} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'max s':>7} {'requests':>9} {'hedges':>7}")
+    for name, max_hedges in (('no hedge', 0), ('hedged', 1)):
+        provider = Provider(name, max_hedges=max_hedges, hedge_quantile=args.quantile)
+        # Fill the histogram first so hedging has a latency profile to work from
+        run_calls(provider, client, provider.min_samples * 2, args.concurrency, args.budget)
+        stub.reset()
+        latencies, errors = run_calls(provider, client, args.calls, args.concurrency, args.budget)
+        requests = stub.snapshot()['requests']
+        print(f"{name:>10} {percentile(latencies, 0.5):7.2f} {percentile(latencies, 0.95):7.2f} "
+              f"{percentile(latencies, 0.99):7.2f} {max(latencies):7.2f} {requests:9d} "
+              f"{provider.stats()['hedges']:7d}" + (f"  ({errors} errors)" if errors else ''))
+
+
+def outage(client, stub, args):
+    provider = Provider('outage', breaker=CircuitBreaker(min_calls=10, cooldown=args.cooldown))
+    stub.configure(error_rate=1.0, slow_rate=0.0)
+    stub.reset()
+    started = time.time()
+    _, errors = run_calls(provider, client, args.calls, args.concurrency, args.budget)
+    elapsed = time.time() - started
+    stats = provider.stats()
+    print(f"outage: {errors} of {args.calls} calls failed in {elapsed:.2f}s; "
+          f"{stub.snapshot()['requests']} reached the provider, {stats['short_circuited']} failed fast "
+          f"(breaker {stats['breaker']})")
+
+    stub.configure(error_rate=0.0)
+    time.sleep(args.cooldown)
+    try:
+        provider.call(client.images.generate, time.time() + args.budget, model='dall-e-2', prompt='a cat',
+                      n=1, size='1024x1024')
+        print(f"recovery: probe after {args.cooldown:.0f}s succeeded, breaker {provider.breaker.state}")
+    except ProviderUnavailable:
+        print("recovery: breaker still open")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Hedging and circuit breaker benchmark')
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.2)
+    parser.add_argument('--slow-rate', type=float, default=0.1)
+    parser.add_argument('--slow-latency', type=float, default=2.0)
+    parser.add_argument('--quantile', type=float, default=0.9)
+    parser.add_argument('--budget', type=float, default=10.0, help='per-call deadline in seconds')
+    parser.add_argument('--cooldown', type=float, default=2.0)
+    args = parser.parse_args()
+
+    server, stub, base_url = start_stub_server(latency=args.latency, jitter=args.latency / 10,
+                                               slow_rate=args.slow_rate, slow_latency=args.slow_latency)
+    client = OpenAI(base_url=base_url, api_key='stub', max_retries=0)
+    try:
+        tail_latency(client, stub, args)
+        outage(client, stub, args)
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Benchmark the OpenAI rate-limit scheduler: rooms playing turns while
+background refills run, against a stub that answers requests over its
+images-per-minute limit with 429s.
+
+Three runs of the same workload:
+- direct: every request goes straight to the API, as before the scheduler;
+- scheduled: requests wait for a token bucket matched to the limit;
+- scheduled, limit set too high: the bucket is told twice the real limit
+  and has to learn it from the 429s and their retry-after.
+
+For active turns and background work separately it prints the share of
+requests that got an image before their deadline, the p50/p95 time to an
+image, and the p95 wait for the rate limit. It also prints the 429s the
+stub sent.
+
+    python benchmarks/bench_rate_limits.py --rooms 8 --turns 3 --background 12 --images-per-minute 60
+"""
+import argparse
+import functools
+import os
+import statistics
+import sys
+import threading
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+from openai import OpenAI  # noqa: E402
+
+from providers import Provider  # noqa: E402
+from ratelimit import ACTIVE_TURN, BACKGROUND, PRIORITY_NAMES, RateLimitScheduler, TokenBucket  # noqa: E402
+from stub_server import start_stub_server  # noqa: E402
+
+
+def percentile(values, q):
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def run(mode, args):
+    """Play the workload once; returns {priority: {'ok': [seconds], 'failed': n, 'waits': [seconds]}}"""
+    server, stub, base_url = start_stub_server(latency=args.latency, jitter=args.latency / 5,
+                                               images_per_minute=args.images_per_minute)
+    client = OpenAI(api_key='bench', base_url=base_url, max_retries=0)
+    provider = Provider('openai_images')
+    results = {priority: {'ok': [], 'failed': 0, 'waits': []} for priority in (ACTIVE_TURN, BACKGROUND)}
+    lock = threading.Lock()
+    scheduler = None
+    if mode != 'direct':
+        told = args.images_per_minute * (2 if mode == 'scheduled, limit set too high' else 1)
+
+        def observe(priority_name, seconds):
+            with lock:
+                results[PRIORITY_NAMES.index(priority_name)]['waits'].append(seconds)
+
+        scheduler = RateLimitScheduler([TokenBucket('images', told)], observe=observe)
+        provider.busy = scheduler.busy
+
+    def request(priority, room_code, prompt):
+        started = time.time()
+        admit = None
+        if scheduler is not None:
+            admit = functools.partial(scheduler.admit, {'images': 1}, priority, room_code)
+        try:
+            provider.call(client.images.generate, started + args.deadline, admit=admit,
+                          model='dall-e-2', prompt=prompt, n=1, size='1024x1024')
+        except Exception:
+            with lock:
+                results[priority]['failed'] += 1
+            return
+        with lock:
+            results[priority]['ok'].append(time.time() - started)
+
+    threads = []
+
+    def launch(*request_args):
+        thread = threading.Thread(target=request, args=request_args, daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    # Fallback refills are queued first, the way an emptied pool is refilled as games start
+    for b in range(args.background):
+        launch(BACKGROUND, None, f'fallback {b}')
+    for turn in range(args.turns):
+        for r in range(args.rooms):
+            launch(ACTIVE_TURN, f'ROOM{r}', f'room {r} turn {turn}')
+        time.sleep(args.turn_interval)
+    for thread in threads:
+        thread.join()
+    rate_limited = stub.snapshot()['rate_limited']
+    server.shutdown()
+    return results, rate_limited
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenAI calls with and without the rate-limit scheduler')
+    parser.add_argument('--rooms', type=int, default=8)
+    parser.add_argument('--turns', type=int, default=3, help='turns each room plays')
+    parser.add_argument('--turn-interval', type=float, default=5.0, help='seconds between turns')
+    parser.add_argument('--background', type=int, default=12, help='background generations queued at the start')
+    parser.add_argument('--images-per-minute', type=int, default=60, help="the stub's limit")
+    parser.add_argument('--latency', type=float, default=0.5, help='mean stub latency in seconds')
+    parser.add_argument('--deadline', type=float, default=15.0, help='seconds a request may take')
+    args = parser.parse_args()
+
+    print(f"{args.rooms} rooms x {args.turns} turns every {args.turn_interval:g}s, {args.background} background, "
+          f"limit {args.images_per_minute}/min, deadline {args.deadline:g}s")
+    print(f"{'mode':>30} {'priority':>12} {'ok':>6} {'p50 s':>6} {'p95 s':>6} {'wait p95':>8} {'429s':>5}")
+    for mode in ('direct', 'scheduled', 'scheduled, limit set too high'):
+        results, rate_limited = run(mode, args)
+        for priority, result in results.items():
+            total = len(result['ok']) + result['failed']
+            ok = result['ok']
+            wait = f"{percentile(result['waits'], 0.95):8.2f}" if result['waits'] else f"{'-':>8}"
+            print(f"{mode:>30} {PRIORITY_NAMES[priority]:>12} {len(ok) / total:6.0%} "
+                  f"{statistics.median(ok) if ok else float('nan'):6.2f} {percentile(ok, 0.95):6.2f} {wait} "
+                  f"{rate_limited if priority == ACTIVE_TURN else '':>5}")
+
+
+if __name__ == '__main__':
+    main()
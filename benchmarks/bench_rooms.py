@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark lobby disconnects and rejoins as the number of rooms grows: the
+old scan over every room's player list against the RoomRegistry indexes.
+
+    python benchmarks/bench_rooms.py --rooms 10 100 1000 10000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from room_registry import RoomRegistry  # noqa: E402
+from state import InMemoryStateStore  # noqa: E402
+
+PLAYERS_PER_ROOM = 4
+
+
+def old_join(state, rooms, room_code, player_name, sid):
+    """What handle_join_room used to do"""
+    def add_player(players):
+        for player in players:
+            if player['name'] == player_name:
+                player['id'] = sid
+                return [p['name'] for p in players]
+        if len(players) >= PLAYERS_PER_ROOM:
+            return 'full'
+        players.append({'name': player_name, 'id': sid})
+        return [p['name'] for p in players]
+    return state.update(rooms, room_code, add_player)
+
+
+def old_disconnect(state, rooms, sid):
+    """What handle_disconnect used to do"""
+    def remove_player(players):
+        if players is None:
+            return None
+        remaining = [p for p in players if p['id'] != sid]
+        if len(remaining) == len(players):
+            return None
+        players[:] = remaining
+        return [p['name'] for p in players]
+
+    changed = []
+    for room_code in list(rooms):
+        player_names = state.update(rooms, room_code, remove_player)
+        if player_names is not None:
+            changed.append((room_code, player_names))
+    return changed
+
+
+def populate(room_count, use_registry):
+    state = InMemoryStateStore()
+    registry = RoomRegistry(state, state.rooms)
+    for r in range(room_count):
+        room_code = f'R{r}'
+        if use_registry:
+            registry.create_room(room_code)
+        else:
+            state.rooms[room_code] = []
+        for p in range(PLAYERS_PER_ROOM):
+            sid = f'{room_code}-sid{p}'
+            if use_registry:
+                registry.join(room_code, f'player{p}', sid, PLAYERS_PER_ROOM)
+            else:
+                old_join(state, state.rooms, room_code, f'player{p}', sid)
+    return state, registry
+
+
+def measure(room_count, use_registry, cycles):
+    """Mean microseconds per disconnect + rejoin; cycles must not exceed room_count"""
+    state, registry = populate(room_count, use_registry)
+    start = time.perf_counter()
+    for i in range(cycles):
+        room_code = f'R{i % room_count}'
+        old_sid, new_sid = f'{room_code}-sid0', f'{room_code}-new{i}'
+        if use_registry:
+            registry.leave(old_sid)
+            registry.join(room_code, 'player0', new_sid, PLAYERS_PER_ROOM)
+        else:
+            old_disconnect(state, state.rooms, old_sid)
+            old_join(state, state.rooms, room_code, 'player0', new_sid)
+    return (time.perf_counter() - start) / cycles * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare room scans with the room registry')
+    parser.add_argument('--rooms', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--cycles', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'rooms':>7} {'scan us/op':>11} {'registry us/op':>15} {'speedup':>8}")
+    for room_count in args.rooms:
+        # Fewer cycles than rooms so every disconnect hits a fresh room
+        cycles = min(args.cycles, room_count)
+        scan = measure(room_count, False, cycles)
+        indexed = measure(room_count, True, cycles)
+        print(f"{room_count:7d} {scan:11.1f} {indexed:15.1f} {scan / indexed:7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
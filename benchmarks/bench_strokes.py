@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark vector drawings: bytes on the wire for a rough line drawing sent
+as strokes against the canvas PNG (binary and as the old base64 data URL),
+and the cost of rasterizing the strokes for the vision model.
+
+The browser's PNG is antialiased RGBA, which compresses far worse than a
+plain render, so it is imitated by rendering at 4x and scaling down.
+
+    python benchmarks/bench_strokes.py --strokes 40 --points 40
+"""
+import argparse
+import base64
+import io
+import json
+import math
+import os
+import random
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from PIL import Image  # noqa: E402
+
+from strokes import VISION_SHORT_SIDE, parse_strokes, rasterize  # noqa: E402
+
+COLORS = ('#000000', '#ff0000', '#0000ff', '#00aa00')
+
+
+def random_drawing(stroke_count, points, width=400, height=300, seed=1):
+    """Gently curving strokes like a quick marker sketch on the 400x300 canvas"""
+    rng = random.Random(seed)
+    strokes = []
+    for _ in range(stroke_count):
+        x, y = rng.randrange(width), rng.randrange(height)
+        heading = rng.uniform(0, 2 * math.pi)
+        deltas = [x, y]
+        for _ in range(points - 1):
+            heading += rng.uniform(-0.4, 0.4)
+            step = rng.uniform(2, 6)  # mousemove events are a few pixels apart
+            nx = min(max(round(x + step * math.cos(heading)), 0), width)
+            ny = min(max(round(y + step * math.sin(heading)), 0), height)
+            deltas += [nx - x, ny - y]
+            x, y = nx, ny
+        strokes.append({'c': rng.choice(COLORS), 'w': rng.choice((3, 5, 8)), 'p': deltas})
+    return {'v': 1, 'width': width, 'height': height, 'strokes': strokes}
+
+
+def canvas_png(drawing):
+    """The PNG canvas.toBlob() would send: antialiased RGBA at canvas size"""
+    supersampled = Image.open(io.BytesIO(rasterize(drawing, short_side=drawing['height'] * 4)))
+    image = supersampled.resize((drawing['width'], drawing['height']), Image.LANCZOS).convert('RGBA')
+    out = io.BytesIO()
+    image.save(out, format='PNG')
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stroke payload size and rasterization cost')
+    parser.add_argument('--strokes', type=int, default=40)
+    parser.add_argument('--points', type=int, default=40, help='points per stroke')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    drawing = parse_strokes(random_drawing(args.strokes, args.points))
+    encoded = json.dumps(drawing, separators=(',', ':')).encode()
+    stroke_bytes = len(encoded)
+    png = canvas_png(drawing)
+    data_url = len('data:image/png;base64,') + len(base64.b64encode(png))
+
+    print(f"{args.strokes} strokes x {args.points} points on a {drawing['width']}x{drawing['height']} canvas")
+    print(f"{'payload':>22} {'bytes':>9} {'vs strokes':>11}")
+    rows = (
+        ('strokes (json)', stroke_bytes),
+        ('strokes (deflated)', len(zlib.compress(encoded))),  # with websocket compression
+        ('canvas png', len(png)),
+        ('canvas png data url', data_url),
+    )
+    for name, size in rows:
+        print(f"{name:>22} {size:9d} {size / stroke_bytes:10.2f}x")
+
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        vision_png = rasterize(drawing)
+    elapsed = (time.perf_counter() - start) / args.repeat
+    print(f"rasterize at short side {VISION_SHORT_SIDE}px: {elapsed * 1000:.1f} ms, {len(vision_png)} bytes")
+
+
+if __name__ == '__main__':
+    main()
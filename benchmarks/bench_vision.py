@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark the vision pre-processing: request size, image tokens and
+round-trip time of describe calls against the stub, for the same sketch
+sent the old ways (full canvas PNG or full-canvas render, detail "high")
+and through vision_prep (cropped, scaled, quantized, detail picked).
+
+The stub charges --token-latency seconds per image token on top of its
+base latency, standing in for the time a vision model spends on pixels.
+
+    python benchmarks/bench_vision.py --calls 10 --token-latency 0.001
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+from openai import OpenAI  # noqa: E402
+
+import vision_prep  # noqa: E402
+from bench_strokes import canvas_png, random_drawing  # noqa: E402
+from strokes import parse_strokes, rasterize  # noqa: E402
+from stub_server import start_stub_server  # noqa: E402
+
+
+def sketch(seed, width=400, height=300):
+    """A rough drawing in the middle part of the canvas, as players tend to draw"""
+    drawing = random_drawing(30, 40, width=width * 2 // 3, height=height * 2 // 3, seed=seed)
+    for stroke in drawing['strokes']:
+        stroke['p'][0] += width // 6
+        stroke['p'][1] += height // 6
+    drawing['width'], drawing['height'] = width, height
+    return parse_strokes(drawing)
+
+
+def variants(drawing, png):
+    """(name, prepare) pairs; prepare returns (image bytes, detail)"""
+    return (
+        ('canvas png, high', lambda: (png, 'high')),
+        ('strokes 768px, high', lambda: (rasterize(drawing), 'high')),
+        ('canvas png, prepared', lambda: vision_prep.prepare_image(png)),
+        ('strokes, prepared', lambda: vision_prep.prepare_strokes(drawing)),
+    )
+
+
+def describe(client, image_bytes, detail):
+    image = base64.b64encode(image_bytes).decode('ascii')
+    client.chat.completions.create(
+        model='gpt-4o',
+        messages=[{'role': 'user', 'content': [
+            {'type': 'text', 'text': 'Describe this drawing.'},
+            {'type': 'image_url', 'image_url': {'url': f'data:image/png;base64,{image}', 'detail': detail}},
+        ]}],
+        max_tokens=500,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Vision pre-processing payload and latency benchmark')
+    parser.add_argument('--calls', type=int, default=10, help='describe calls per variant')
+    parser.add_argument('--latency', type=float, default=0.3, help='stub base latency in seconds')
+    parser.add_argument('--token-latency', type=float, default=0.001, help='stub seconds per image token')
+    args = parser.parse_args()
+
+    server, stub, base_url = start_stub_server(latency=args.latency, jitter=0.0, token_latency=args.token_latency)
+    client = OpenAI(base_url=base_url, api_key='stub', max_retries=0)
+    drawings = [sketch(seed) for seed in range(args.calls)]
+    pngs = [canvas_png(drawing) for drawing in drawings]
+
+    print(f"{'variant':>22} {'detail':>6} {'image KB':>9} {'request KB':>11} {'tokens':>7} "
+          f"{'prep ms':>8} {'round trip ms':>14}")
+    try:
+        for index, (name, _) in enumerate(variants(drawings[0], pngs[0])):
+            stub.reset()
+            image_bytes = prep = trip = 0.0
+            for drawing, png in zip(drawings, pngs):
+                prepare = variants(drawing, png)[index][1]
+                start = time.perf_counter()
+                data, detail = prepare()
+                prep += time.perf_counter() - start
+                image_bytes += len(data)
+                start = time.perf_counter()
+                describe(client, data, detail)
+                trip += time.perf_counter() - start
+            stats = stub.snapshot()
+            n = len(drawings)
+            print(f"{name:>22} {detail:>6} {image_bytes / n / 1024:9.1f} {stats['request_bytes'] / n / 1024:11.1f} "
+                  f"{stats['image_tokens'] / n:7.0f} {prep / n * 1000:8.1f} {trip / n * 1000:14.0f}")
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
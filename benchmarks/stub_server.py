@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the OpenAI image and chat endpoints, used by the benchmarks.
+
+POST /v1/images/generations returns a URL pointing back at this server, and
+GET /files/<name> serves a real PNG from disk (one file, or the PNGs of a
+directory in turn), so the full generate -> download -> save path runs
+without touching the real API.
+POST /v1/chat/completions answers with a fixed description. Images in the
+request are priced in tokens the way the vision models count them (85 for
+detail "low", 85 + 170 per 512 px tile for "high"), and token_latency adds
+that many seconds per image token, so bigger images are slower. With
+"stream": true the description comes back as server-sent events, one word
+every token_interval seconds.
+
+Latency is normally distributed around latency with sd jitter, or with
+shape="lognormal" skewed to the right the way real API latency is; a
+slow_rate share of calls take slow_latency instead. With images_per_minute
+set, image requests over that rate get a 429 with a retry-after header.
+Like the real account limit it refills continuously, and at most ten
+seconds' worth can be spent at once. Latency, tail latency,
+errors and rate limits can be injected to exercise the provider layer,
+either with command-line flags or at runtime with
+POST /control {"latency": ..., "error_rate": ...}.
+"""
+import argparse
+import base64
+import glob
+import io
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image
+
+DEFAULT_IMAGE = os.path.join(os.path.dirname(__file__), '..', 'static', 'img', 'starting-img.png')
+DEFAULT_DESCRIPTION = "A smiling stick figure waving next to a small house with a tree"
+RATE_BURST_SECONDS = 10  # seconds of images_per_minute that can be used at once
+CONTROL_FIELDS = ('latency', 'jitter', 'slow_rate', 'slow_latency', 'error_rate', 'token_latency',
+                  'token_interval', 'images_per_minute')
+
+
+def image_tokens(url, detail):
+    """Prompt tokens an image_url part costs a vision model"""
+    if detail == 'low' or not url.startswith('data:'):
+        return 85
+    data = base64.b64decode(url[url.index(',') + 1:])
+    width, height = Image.open(io.BytesIO(data)).size
+    if detail == 'auto' and max(width, height) <= 512:
+        return 85
+    # Fit in 2048 x 2048, then bring the short side down to 768, then count 512 px tiles
+    scale = min(1.0, 2048 / max(width, height))
+    scale *= min(1.0, 768 / (min(width, height) * scale))
+    tiles = math.ceil(width * scale / 512) * math.ceil(height * scale / 512)
+    return 85 + 170 * tiles
+
+
+def request_image_tokens(request):
+    tokens = 0
+    for message in request.get('messages', []):
+        content = message.get('content')
+        if isinstance(content, list):
+            for part in content:
+                if part.get('type') == 'image_url':
+                    image_url = part['image_url']
+                    tokens += image_tokens(image_url['url'], image_url.get('detail', 'auto'))
+    return tokens
+
+
+class StubState:
+    """Latency and error settings plus counters shared by all handler threads"""
+
+    def __init__(self, image_path=DEFAULT_IMAGE, latency=0.5, jitter=0.1, slow_rate=0.0, slow_latency=5.0,
+                 error_rate=0.0, token_latency=0.0, token_interval=0.02, shape='normal', images_per_minute=0):
+        paths = sorted(glob.glob(os.path.join(image_path, '*.png'))) if os.path.isdir(image_path) else [image_path]
+        self.images = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                self.images.append(f.read())
+        self.image_bytes = self.images[0]
+        self.shape = shape  # 'normal' or 'lognormal'
+        self.latency = latency
+        self.jitter = jitter
+        self.slow_rate = slow_rate  # fraction of calls that take slow_latency instead
+        self.slow_latency = slow_latency
+        self.error_rate = error_rate  # fraction of calls answered with a 500
+        self.token_latency = token_latency  # extra seconds per image token in a chat request
+        self.token_interval = token_interval  # seconds between streamed output tokens
+        self.images_per_minute = images_per_minute  # 0 for no limit
+        self.lock = threading.Lock()
+        self._allowance = None  # image requests that can go through now (None until the first one)
+        self._allowance_at = time.time()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.image_tokens = 0
+        self.request_bytes = 0
+
+    def delay(self):
+        if random.random() < self.slow_rate:
+            return self.slow_latency
+        if self.shape == 'lognormal' and self.latency > 0:
+            # Mean latency and sd jitter, with the long right tail of real API latency
+            sigma = math.sqrt(math.log(1 + (self.jitter / self.latency) ** 2))
+            return random.lognormvariate(math.log(self.latency) - sigma ** 2 / 2, sigma)
+        return max(0.0, random.gauss(self.latency, self.jitter))
+
+    def image_for(self, name):
+        """The PNG behind a generated image URL; the same name always gets the same file"""
+        return self.images[zlib.crc32(name.encode('utf-8')) % len(self.images)]
+
+    def should_fail(self):
+        if random.random() < self.error_rate:
+            with self.lock:
+                self.errors += 1
+            return True
+        return False
+
+    def image_retry_after(self):
+        """Seconds until an image request would be let through, or None to let this one through"""
+        if not self.images_per_minute:
+            return None
+        now = time.time()
+        rate = self.images_per_minute / 60
+        burst = max(1.0, rate * RATE_BURST_SECONDS)
+        with self.lock:
+            if self._allowance is None:
+                self._allowance = burst
+            self._allowance = min(burst, self._allowance + (now - self._allowance_at) * rate)
+            self._allowance_at = now
+            if self._allowance >= 1:
+                self._allowance -= 1
+                return None
+            self.rate_limited += 1
+            return (1 - self._allowance) / rate
+
+    def configure(self, **settings):
+        for name, value in settings.items():
+            if name in CONTROL_FIELDS:
+                setattr(self, name, float(value))
+
+    def enter(self, request_bytes=0, image_tokens=0):
+        with self.lock:
+            self.in_flight += 1
+            self.requests += 1
+            self.request_bytes += request_bytes
+            self.image_tokens += image_tokens
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def leave(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'errors': self.errors,
+                'rate_limited': self.rate_limited,
+                'request_bytes': self.request_bytes,
+                'image_tokens': self.image_tokens,
+                'settings': {name: getattr(self, name) for name in CONTROL_FIELDS},
+            }
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.errors = 0
+            self.rate_limited = 0
+            self.request_bytes = 0
+            self.image_tokens = 0
+            self.max_in_flight = self.in_flight
+
+
+def make_handler(state):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, payload, status=200, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_chunk(self, data):
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def _stream_completion(self, model):
+            """Answer a streamed chat completion as server-sent events, one word at a time"""
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            completion_id = f'chatcmpl-{random.getrandbits(32):x}'
+            words = DEFAULT_DESCRIPTION.split(' ')
+            for i, word in enumerate(words + [None]):
+                if i:
+                    time.sleep(state.token_interval)
+                delta = {'content': word if i == 0 else ' ' + word} if word is not None else {}
+                if i == 0:
+                    delta['role'] = 'assistant'
+                chunk = {
+                    'id': completion_id,
+                    'object': 'chat.completion.chunk',
+                    'created': int(time.time()),
+                    'model': model,
+                    'choices': [{'index': 0, 'delta': delta, 'finish_reason': None if word is not None else 'stop'}]
+                }
+                self._send_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+            self._send_chunk(b"data: [DONE]\n\n")
+            self._send_chunk(b"")
+
+        def _send_error(self):
+            self._send_json({'error': {'message': 'injected failure', 'type': 'server_error'}}, status=500)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length)
+            path = self.path.rstrip('/')
+            if path == '/control':
+                state.configure(**json.loads(body or b'{}'))
+                self._send_json(state.snapshot())
+            elif path.endswith('/images/generations') or path.endswith('/chat/completions'):
+                request = json.loads(body or b'{}')
+                retry_after = state.image_retry_after() if path.endswith('/images/generations') else None
+                if retry_after is not None:
+                    self._send_json({'error': {'message': 'Rate limit reached for images per minute',
+                                               'type': 'requests', 'code': 'rate_limit_exceeded'}},
+                                    status=429, headers={'retry-after': str(math.ceil(retry_after)),
+                                                         'retry-after-ms': str(int(retry_after * 1000))})
+                    return
+                tokens = request_image_tokens(request) if path.endswith('/chat/completions') else 0
+                state.enter(len(body), tokens)
+                try:
+                    time.sleep(state.delay() + tokens * state.token_latency)
+                    if state.should_fail():
+                        self._send_error()
+                    elif request.get('stream'):
+                        self._stream_completion(request.get('model', 'stub'))
+                    elif path.endswith('/images/generations'):
+                        host, port = self.server.server_address[:2]
+                        self._send_json({
+                            'created': int(time.time()),
+                            'data': [{'url': f'http://{host}:{port}/files/{random.getrandbits(64):x}.png'}]
+                        })
+                    else:
+                        self._send_json({
+                            'id': f'chatcmpl-{random.getrandbits(32):x}',
+                            'object': 'chat.completion',
+                            'created': int(time.time()),
+                            'model': request.get('model', 'stub'),
+                            'choices': [{
+                                'index': 0,
+                                'message': {'role': 'assistant', 'content': DEFAULT_DESCRIPTION},
+                                'finish_reason': 'stop'
+                            }],
+                            'usage': {'prompt_tokens': tokens, 'completion_tokens': 0, 'total_tokens': tokens}
+                        })
+                finally:
+                    state.leave()
+            else:
+                self._send_json({'error': {'message': 'not found'}}, status=404)
+
+        def do_GET(self):
+            if self.path.startswith('/files/'):
+                image_bytes = state.image_for(self.path)
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/png')
+                self.send_header('Content-Length', str(len(image_bytes)))
+                self.end_headers()
+                self.wfile.write(image_bytes)
+            elif self.path == '/stats':
+                self._send_json(state.snapshot())
+            else:
+                self._send_json({'error': {'message': 'not found'}}, status=404)
+
+    return StubHandler
+
+
+class StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # unbounded benchmarks open hundreds of connections at once
+
+    def handle_error(self, request, client_address):
+        # Clients that gave up at their deadline hang up mid-response; that is expected here
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def start_stub_server(host='127.0.0.1', port=0, **kwargs):
+    """Start the stub in a daemon thread; returns (server, state, base_url)"""
+    state = StubState(**kwargs)
+    server = StubHTTPServer((host, port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, state, f'http://{host}:{port}/v1'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local OpenAI image and chat endpoint stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--latency', type=float, default=0.5, help='mean generation latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.1, help='latency standard deviation')
+    parser.add_argument('--slow-rate', type=float, default=0.0, help='fraction of calls that are slow')
+    parser.add_argument('--slow-latency', type=float, default=5.0, help='latency of the slow calls')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of calls that return 500')
+    parser.add_argument('--token-latency', type=float, default=0.0, help='extra seconds per image token')
+    parser.add_argument('--token-interval', type=float, default=0.02, help='seconds between streamed words')
+    parser.add_argument('--shape', choices=('normal', 'lognormal'), default='normal', help='latency distribution')
+    parser.add_argument('--images-per-minute', type=int, default=0, help='answer image requests over this with 429')
+    parser.add_argument('--image', default=DEFAULT_IMAGE,
+                        help='PNG served for every generation, or a directory of PNGs to serve in turn')
+    args = parser.parse_args()
+
+    server, _, base_url = start_stub_server(args.host, args.port, image_path=args.image,
+                                            latency=args.latency, jitter=args.jitter,
+                                            slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                                            error_rate=args.error_rate, token_latency=args.token_latency,
+                                            token_interval=args.token_interval, shape=args.shape,
+                                            images_per_minute=args.images_per_minute)
+    print(f"Stub OpenAI server running, set OPENAI_BASE_URL={base_url}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
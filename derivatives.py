@@ -0,0 +1,173 @@
+"""
+Smaller copies of generated images for the browser.
+
+A generated image is a 1024x1024 PNG of 1.5-2 MB, shown in a box a few
+hundred pixels wide. When an image lands in static/generated it is also
+written as WebP and JPEG at a few widths next to the original:
+
+    static/generated/<id>.png  ->  <id>.256w.webp, <id>.512w.webp, <id>.1024w.webp, <id>.256w.jpg, ...
+
+Pages and socket events carry an image set (srcset strings per format) so
+the browser downloads the size it will actually display. Files without
+derivatives (stock art, placeholders, drawings) are served as they are.
+
+Which derivatives exist is remembered per image (recorded when they are
+written, looked up once otherwise), so building an image set for every
+emit and results page does not stat each size again.
+"""
+import os
+import re
+import uuid
+
+from PIL import Image
+
+WIDTHS = (256, 512, 1024)
+TURN_WIDTHS = (256, 512)  # enough for the in-game image box; written before the turn moves on
+# extension -> (MIME type, Pillow format, save options)
+FORMATS = {
+    'webp': ('image/webp', 'WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('image/jpeg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+FALLBACK_WIDTH = 512  # plain src for browsers without srcset
+SOURCE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+
+VARIANT_RE = re.compile(r'\.\d+w\.(webp|jpg)$')
+
+# image path without extension -> {(width, extension)} of its derivatives on disk. Plain dict
+# operations only: make_derivatives may run on a worker thread outside the event loop
+_known = {}
+KNOWN_LIMIT = 20000  # images remembered; past this everything is looked up again
+
+
+def is_variant(path):
+    return bool(VARIANT_RE.search(path))
+
+
+def has_source_extension(path):
+    return bool(path) and path.lower().endswith(SOURCE_EXTENSIONS) and not is_variant(path)
+
+
+def variant_path(image_path, width, extension):
+    return f"{os.path.splitext(image_path)[0]}.{width}w.{extension}"
+
+
+def variant_paths(image_path):
+    """Every derivative path an image can have, whether written or not"""
+    return [variant_path(image_path, width, extension) for extension in FORMATS for width in WIDTHS]
+
+
+def _stem(path):
+    path = os.path.normpath(path)
+    return VARIANT_RE.sub('', path) if is_variant(path) else os.path.splitext(path)[0]
+
+
+def _on_disk(image_path):
+    return {(width, extension) for extension in FORMATS for width in WIDTHS
+            if os.path.exists(variant_path(image_path, width, extension))}
+
+
+def known_variants(image_path):
+    """{(width, extension)} of the derivatives of image_path that exist, from memory after the first look"""
+    stem = _stem(image_path)
+    present = _known.get(stem)
+    if present is None:
+        if len(_known) >= KNOWN_LIMIT:
+            _known.clear()
+        # setdefault: a make_derivatives that finished meanwhile has the newer answer
+        present = _known.setdefault(stem, _on_disk(image_path))
+    return present
+
+
+def forget(path):
+    """path (an image or one of its derivatives) was deleted or moved; look again next time"""
+    _known.pop(_stem(path), None)
+
+
+def existing_variants(image_path):
+    if not has_source_extension(image_path):
+        return []
+    return [path for path in variant_paths(image_path) if os.path.exists(path)]
+
+
+def _save(image, path, image_format, options):
+    temp_path = os.path.join(os.path.dirname(path), f".{uuid.uuid4()}.part")
+    try:
+        image.save(temp_path, format=image_format, **options)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def make_derivatives(image_path, widths=WIDTHS):
+    """
+    Write the WebP and JPEG derivatives of image_path at widths that do not
+    exist yet. Widths above the original are skipped. Returns the paths written.
+    """
+    if not has_source_extension(image_path):
+        return []
+    missing = [variant_path(image_path, width, extension)
+               for extension in FORMATS for width in widths
+               if not os.path.exists(variant_path(image_path, width, extension))]
+    if not missing:
+        return []
+
+    with Image.open(image_path) as source:
+        source.load()
+        image = source.convert('RGB')
+    written = []
+    # Largest first, each size scaled down from the one before: every step is at most 4x
+    previous = image
+    for width in sorted(widths, reverse=True):
+        if width > image.width:
+            continue
+        height = max(1, round(image.height * width / image.width))
+        resized = previous if previous.width == width else previous.resize((width, height), Image.LANCZOS)
+        previous = resized
+        for extension, (_, image_format, options) in FORMATS.items():
+            path = variant_path(image_path, width, extension)
+            if path in missing:
+                _save(resized, path, image_format, options)
+                written.append(path)
+    _known[_stem(image_path)] = _on_disk(image_path)
+    return written
+
+
+def move_with_variants(src, dst):
+    """os.replace an image along with any derivatives written next to it"""
+    forget(src)
+    forget(dst)
+    os.replace(src, dst)
+    for width in WIDTHS:
+        for extension in FORMATS:
+            try:
+                os.replace(variant_path(src, width, extension), variant_path(dst, width, extension))
+            except FileNotFoundError:
+                pass
+
+
+def image_set(image_path, url=None):
+    """
+    {'src': url, 'sources': [{'type': MIME type, 'srcset': '<url> 256w, ...'}]}
+    for an image with derivatives, None otherwise. Paths are relative to
+    the app root, as games store them; url(path) turns one into a URL.
+    """
+    if not has_source_extension(image_path):
+        return None
+    url = url or (lambda path: f"/{path}")
+    stem = os.path.splitext(image_path)[0]
+    present = known_variants(image_path)
+    sources = []
+    src = None
+    for extension, (mime_type, _, _) in FORMATS.items():
+        widths = [width for width in WIDTHS if (width, extension) in present]
+        if not widths:
+            continue
+        sources.append({'type': mime_type,
+                        'srcset': ', '.join(f"{url(f'{stem}.{w}w.{extension}')} {w}w" for w in widths)})
+        if extension == 'jpg':
+            src = url(f"{stem}.{min(widths, key=lambda w: abs(w - FALLBACK_WIDTH))}w.jpg")
+    if not sources:
+        return None
+    return {'src': src or url(image_path), 'sources': sources}
@@ -0,0 +1,161 @@
+"""
+Perceptual-hash cache of drawing descriptions.
+
+Inverted-mode drawings repeat a lot: smiley faces, stick figures, houses,
+and canvases with nothing on them. Each drawing (as prepared for the vision
+model, so already cropped to the ink) gets two 64-bit perceptual hashes
+from a downscaled greyscale copy: a difference hash (is each pixel darker
+than its right neighbour) and an average hash (is it darker than the
+mean). A drawing whose hashes are both within max_distance bits of a
+remembered one reuses that description instead of calling the model.
+Drawings with almost no ink skip the call altogether.
+
+The hashes live in fixed-size NumPy arrays, so a lookup is one vectorized
+XOR and popcount over every entry. The least recently used entry is
+replaced once the cache is full, and the index is saved as JSON so it
+survives restarts.
+"""
+import io
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+HASH_SIZE = 8  # 8 x 8 bits = 64-bit hashes
+INK_THRESHOLD = 32  # grey levels below white that count as ink
+MIN_INK_PIXELS = 50  # fewer ink pixels than this is a blank canvas
+BLANK_DESCRIPTION = "A blank white canvas with nothing drawn on it"
+
+# Set bits in every byte value, for popcounts on uint64 arrays viewed as bytes
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _pack(bits):
+    return int(np.packbits(bits.ravel()).view('>u8')[0])
+
+
+def fingerprint(image_bytes):
+    """(dhash, ahash, ink pixels) of an encoded image"""
+    image = Image.open(io.BytesIO(image_bytes)).convert('L')
+    ink = int(np.count_nonzero(np.asarray(image) < 255 - INK_THRESHOLD))
+    # Box filtering averages every pixel in, so thin lines are not skipped over
+    wide = np.asarray(image.resize((HASH_SIZE + 1, HASH_SIZE), Image.BOX), dtype=np.int16)
+    square = np.asarray(image.resize((HASH_SIZE, HASH_SIZE), Image.BOX), dtype=np.float32)
+    return _pack(wide[:, 1:] < wide[:, :-1]), _pack(square < square.mean()), ink
+
+
+def hamming(values, query):
+    """Bit distance from query to each uint64 in values"""
+    return POPCOUNT[(values ^ np.uint64(query)).view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.int32)
+
+
+class DescriptionCache:
+    """Bounded, persistent index of drawing fingerprints -> descriptions"""
+
+    def __init__(self, index_path, max_entries=5000, max_distance=6):
+        self.index_path = index_path
+        self.max_entries = max_entries
+        self.max_distance = max_distance  # bits each hash may differ by and still match
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._dhash = np.zeros(max_entries, dtype=np.uint64)
+        self._ahash = np.zeros(max_entries, dtype=np.uint64)
+        self._last_used = np.zeros(max_entries, dtype=np.float64)
+        self._seconds = np.zeros(max_entries, dtype=np.float64)  # what the model call took
+        self._descriptions = [None] * max_entries
+        self._count = 0
+        self.hits = 0
+        self.misses = 0
+        self.blank = 0
+        self.saved_seconds = 0.0
+        os.makedirs(os.path.dirname(index_path) or '.', exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = []
+        # Most recently used last, so the newest entries survive a smaller max_entries
+        for dhash, ahash, description, seconds, last_used in saved[-self.max_entries:]:
+            self._put(self._count, int(dhash, 16), int(ahash, 16), description, seconds, last_used)
+            self._count += 1
+
+    def _save_index(self, entries):
+        temp_path = self.index_path + '.tmp'
+        with self._save_lock:
+            with open(temp_path, 'w') as f:
+                json.dump(entries, f)
+            os.replace(temp_path, self.index_path)
+
+    def _put(self, slot, dhash, ahash, description, seconds, last_used):
+        self._dhash[slot] = dhash
+        self._ahash[slot] = ahash
+        self._descriptions[slot] = description
+        self._seconds[slot] = seconds
+        self._last_used[slot] = last_used
+
+    def _find(self, dhash, ahash):
+        if not self._count:
+            return None
+        distance_d = hamming(self._dhash[:self._count], dhash)
+        distance_a = hamming(self._ahash[:self._count], ahash)
+        close = (distance_d <= self.max_distance) & (distance_a <= self.max_distance)
+        if not close.any():
+            return None
+        return int(np.argmin(np.where(close, distance_d + distance_a, np.iinfo(np.int32).max)))
+
+    def lookup(self, image_bytes, use_cache=True):
+        """
+        Return (description or None, key). key is what store() takes once
+        the model has described a miss. Blank drawings always get
+        BLANK_DESCRIPTION; use_cache=False only skips the reuse of others' descriptions.
+        """
+        dhash, ahash, ink = fingerprint(image_bytes)
+        with self._lock:
+            if ink < MIN_INK_PIXELS:
+                self.blank += 1
+                return BLANK_DESCRIPTION, None
+            slot = self._find(dhash, ahash) if use_cache else None
+            if slot is None:
+                self.misses += 1
+                return None, (dhash, ahash)
+            self.hits += 1
+            self.saved_seconds += self._seconds[slot]
+            self._last_used[slot] = time.time()
+            return self._descriptions[slot], (dhash, ahash)
+
+    def store(self, key, description, seconds=0.0):
+        """Remember what the model said about a drawing lookup() missed"""
+        dhash, ahash = key
+        with self._lock:
+            if self._find(dhash, ahash) is not None:
+                return  # a near-duplicate was stored while this one was being described
+            if self._count < self.max_entries:
+                slot = self._count
+                self._count += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+            self._put(slot, dhash, ahash, description, seconds, time.time())
+            order = np.argsort(self._last_used[:self._count], kind='stable')
+            entries = [[f'{int(self._dhash[i]):016x}', f'{int(self._ahash[i]):016x}', self._descriptions[i],
+                        round(float(self._seconds[i]), 3), float(self._last_used[i])] for i in order]
+        self._save_index(entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': self._count,
+                'max_entries': self.max_entries,
+                'max_distance': self.max_distance,
+                'hits': self.hits,
+                'misses': self.misses,
+                'blank': self.blank,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'saved_seconds': round(self.saved_seconds, 2),
+            }
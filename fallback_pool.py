@@ -0,0 +1,152 @@
+"""
+Warm pool of pre-generated fallback images.
+
+Timeouts and failed generations used to pay for a fresh DALL-E call before
+the turn could advance. Instead we keep a few ready images on disk and hand
+one out instantly; when the pool drops to the low-water mark it is topped up
+again in the background.
+
+Refills that fail (an outage, a spell of 429s) back off exponentially, and
+until one succeeds again only a single refill is tried at a time, so the
+pool does not keep paying for calls that are bound to fail.
+"""
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+
+from derivatives import is_variant
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.gif', '.webp')
+
+
+class FallbackPool:
+    """Pre-generated fallback images kept on disk, refilled at low priority"""
+
+    def __init__(self, pool_dir, prompts, generate, submit, target_size=8, low_water=3, move=os.replace,
+                 backoff=5.0, max_backoff=300.0, clock=None):
+        # generate(prompt, save_dir) -> path or None; submit(func) queues low-priority work;
+        # move(src, dst) hands an image out (and anything written alongside it)
+        self.pool_dir = pool_dir
+        self.prompts = list(prompts)
+        self.generate = generate
+        self.submit = submit
+        self.target_size = target_size
+        self.low_water = low_water
+        self.move = move
+        self.backoff = backoff  # seconds before retrying after the first failed refill, doubling after each
+        self.max_backoff = max_backoff
+        self._clock = clock or time.time
+        self._lock = threading.Lock()
+        self._ready = deque()
+        self._refilling = 0
+        self._failures = 0  # failed refills since the last one that worked
+        self._retry_at = 0.0
+        self.failed = 0
+        self.handed_out = 0
+        self.misses = 0
+        os.makedirs(pool_dir, exist_ok=True)
+        self.load()
+
+    def load(self):
+        """Pick up images left in the pool directory by a previous run"""
+        with self._lock:
+            self._ready.clear()
+            for name in sorted(os.listdir(self.pool_dir)):
+                if name.endswith(IMAGE_EXTENSIONS) and not name.startswith('.') and not is_variant(name):
+                    self._ready.append(os.path.join(self.pool_dir, name))
+
+    def take(self, dest_dir):
+        """
+        Move a ready image into dest_dir and return its path.
+        Returns None if the pool is empty; never waits on a generation.
+        """
+        while True:
+            with self._lock:
+                if not self._ready:
+                    self.misses += 1
+                    break
+                pool_path = self._ready.popleft()
+            extension = os.path.splitext(pool_path)[1]
+            image_path = os.path.join(dest_dir, f"{uuid.uuid4()}{extension}")
+            try:
+                self.move(pool_path, image_path)
+            except OSError as e:
+                print(f"Dropping unusable fallback image {pool_path}: {e}")
+                continue
+            with self._lock:
+                self.handed_out += 1
+            self.maybe_refill()
+            return image_path
+
+        self.maybe_refill()
+        return None
+
+    def put_back(self, image_path):
+        """Return an image take() handed out that no turn ended up using; it is next in line"""
+        pool_path = os.path.join(self.pool_dir, os.path.basename(image_path))
+        try:
+            self.move(image_path, pool_path)
+        except OSError as e:
+            print(f"Could not return fallback image {image_path}: {e}")
+            return
+        with self._lock:
+            self._ready.appendleft(pool_path)
+            self.handed_out -= 1
+
+    def maybe_refill(self):
+        """Queue refills once ready + in-progress images fall to the low-water mark"""
+        with self._lock:
+            available = len(self._ready) + self._refilling
+            if available > self.low_water:
+                return
+            if self._failures:
+                # Backing off: wait out the delay, then probe with one refill at a time
+                if self._refilling or self._clock() < self._retry_at:
+                    return
+                needed = 1
+            else:
+                needed = self.target_size - available
+            self._refilling += needed
+        for _ in range(needed):
+            self.submit(self._refill_one)
+
+    def _refill_one(self, job):
+        image_path = None
+        try:
+            image_path = self.generate(random.choice(self.prompts), self.pool_dir)
+        finally:
+            with self._lock:
+                self._refilling -= 1
+                if image_path:
+                    self._ready.append(image_path)
+                    self._failures = 0
+                else:
+                    self.failed += 1
+                    now = self._clock()
+                    # The rest of a burst failing together does not push the delay further out
+                    if now >= self._retry_at:
+                        self._failures += 1
+                        self._retry_at = now + min(self.max_backoff, self.backoff * 2 ** (self._failures - 1))
+                    failures = self._failures
+                    delay = self._retry_at - now
+        if image_path:
+            # Recovered: top the pool up in full again
+            self.maybe_refill()
+        else:
+            print(f"Fallback pool refill failed ({failures} in a row), next try in {delay:.0f}s")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ready': len(self._ready),
+                'refilling': self._refilling,
+                'target_size': self.target_size,
+                'low_water': self.low_water,
+                'handed_out': self.handed_out,
+                'failed': self.failed,
+                'backing_off': self._failures > 0,
+                'misses': self.misses,
+            }
@@ -0,0 +1,234 @@
+"""
+Compact game model.
+
+A running game is one object with __slots__ instead of a dict of dicts.
+Players are (name, socket id) tuples and prompts, images and descriptions
+are (player, value, round) tuples, so a game costs a handful of small
+objects however long the chain gets. to_dict() builds the dict view the
+results page and the game_completed event use; to_state() / from_state()
+is the plain-list form the Redis state store saves.
+
+Games are only changed through state.update(), which holds the room's
+lock, and advance() is the single turn transition.
+
+In simultaneous games every player starts a chain and all of them play
+each round at once. Chain c is held by player (c + round) % n, so the
+chains rotate one seat per round. Entries stay (player, value, round), and
+the chain is worked out from the player and round.
+"""
+import sys
+
+WAITING_FOR_PROMPT = 'waiting_for_prompt'
+WAITING_FOR_DRAWING = 'waiting_for_drawing'
+COMPLETED = 'completed'
+
+SIMULTANEOUS = 'simultaneous'
+
+# Entry tuple fields
+PLAYER, VALUE, ROUND = 0, 1, 2
+
+
+def _has_round(entries, turn_round):
+    # Entries are appended in round order, so the newest ones are at the end
+    for entry in reversed(entries):
+        if entry[ROUND] == turn_round:
+            return True
+        if entry[ROUND] is not None and entry[ROUND] < turn_round:
+            return False
+    return False
+
+
+class Game:
+    """One game's players, turn pointer and chain of prompts/images/descriptions"""
+
+    __slots__ = (
+        'id', 'gamemode', 'players', 'current_round', 'current_player', 'status',
+        'start_time', 'round_start_time', 'completion_time',
+        'prompts', 'images', 'descriptions',
+    )
+
+    def __init__(self, game_id, gamemode, players, now, starting_image=None):
+        self.id = game_id
+        self.gamemode = gamemode
+        self.players = [tuple(p) for p in players]  # (name, socket id)
+        self.current_round = 0
+        self.current_player = 0
+        self.status = WAITING_FOR_DRAWING if gamemode == 'inverted' else WAITING_FOR_PROMPT
+        self.start_time = now
+        self.round_start_time = now
+        self.completion_time = None
+        self.prompts = []
+        self.images = [(None, starting_image, None)] if starting_image else []
+        self.descriptions = []
+
+    @property
+    def current_player_name(self):
+        return self.players[self.current_player][0]
+
+    @property
+    def player_names(self):
+        return [name for name, _ in self.players]
+
+    @property
+    def completed(self):
+        return self.status == COMPLETED
+
+    @property
+    def simultaneous(self):
+        return self.gamemode == SIMULTANEOUS
+
+    def has_prompt(self, turn_round):
+        return _has_round(self.prompts, turn_round)
+
+    def has_image(self, turn_round):
+        return _has_round(self.images, turn_round)
+
+    def has_prompt_from(self, player, turn_round):
+        return any(e[PLAYER] == player and e[ROUND] == turn_round for e in self.prompts)
+
+    def has_image_from(self, player, turn_round):
+        return any(e[PLAYER] == player and e[ROUND] == turn_round for e in self.images)
+
+    def round_complete(self, turn_round):
+        """Whether every chain has its image for turn_round (always true with one chain)"""
+        if not self.simultaneous:
+            return True
+        return sum(1 for e in self.images if e[ROUND] == turn_round) >= len(self.players)
+
+    def chain_of(self, player, turn_round):
+        """Index of the chain player holds in turn_round"""
+        index = self.player_names.index(player)
+        return (index - turn_round) % len(self.players)
+
+    def holder(self, chain, turn_round):
+        """Name of the player holding chain in turn_round"""
+        return self.players[(chain + turn_round) % len(self.players)][0]
+
+    def chain_image(self, chain, turn_round):
+        """The image chain shows at the start of turn_round"""
+        if turn_round == 0:
+            return self.images[0][VALUE] if self.images and self.images[0][ROUND] is None else None
+        previous = self.holder(chain, turn_round - 1)
+        for player, path, entry_round in reversed(self.images):
+            if entry_round == turn_round - 1 and player == previous:
+                return path
+        return None
+
+    def assignments(self):
+        """Player name -> the image they prompt on this round"""
+        return {
+            name: self.chain_image(self.chain_of(name, self.current_round), self.current_round)
+            for name in self.player_names
+        }
+
+    def chains(self):
+        """Each chain as its starting image and one step per round"""
+        prompts = {(p, r): text for p, text, r in self.prompts}
+        images = {(p, r): path for p, path, r in self.images if r is not None}
+        chains = []
+        for chain in range(len(self.players)):
+            steps = []
+            for turn_round in range(min(self.current_round, len(self.players))):
+                player = self.holder(chain, turn_round)
+                steps.append({
+                    'player': player,
+                    'prompt': prompts.get((player, turn_round)),
+                    'image': images.get((player, turn_round)),
+                    'round': turn_round,
+                })
+            chains.append({
+                'starter': self.players[chain][0],
+                'starting_image': self.chain_image(chain, 0),
+                'steps': steps,
+            })
+        return chains
+
+    def add_prompt(self, player, text):
+        self.prompts.append((player, text, self.current_round))
+
+    def remove_prompt(self, turn_round, player=None):
+        self.prompts = [
+            p for p in self.prompts
+            if p[ROUND] != turn_round or (player is not None and p[PLAYER] != player)
+        ]
+
+    def add_image(self, player, path):
+        self.images.append((player, path, self.current_round))
+
+    def add_description(self, player, text):
+        self.descriptions.append((player, text, self.current_round))
+
+    def images_for(self, turn_round):
+        return [e[VALUE] for e in self.images if e[ROUND] == turn_round]
+
+    def latest_image(self):
+        return self.images[-1][VALUE] if self.images else None
+
+    def latest_description(self):
+        return self.descriptions[-1][VALUE] if self.descriptions else None
+
+    def advance(self, now):
+        """Move to the next player (or round); returns True once every player has had a turn"""
+        if not self.simultaneous:
+            self.current_player = (self.current_player + 1) % len(self.players)
+        self.current_round += 1
+        self.round_start_time = now
+        if self.current_round >= len(self.players):
+            self.status = COMPLETED
+            self.completion_time = now
+        return self.completed
+
+    def copy(self):
+        """Snapshot for use after the room lock is released (entries are immutable tuples)"""
+        game = Game.__new__(Game)
+        for name in self.__slots__:
+            value = getattr(self, name)
+            setattr(game, name, list(value) if isinstance(value, list) else value)
+        return game
+
+    def approx_bytes(self):
+        """Rough memory footprint: the object, its lists, entry tuples and their values"""
+        size = sys.getsizeof(self)
+        for name in self.__slots__:
+            value = getattr(self, name)
+            size += sys.getsizeof(value)
+            if isinstance(value, list):
+                for entry in value:
+                    size += sys.getsizeof(entry)
+                    if isinstance(entry, tuple):
+                        size += sum(sys.getsizeof(item) for item in entry)
+        return size
+
+    def to_dict(self):
+        """Dict view with one dict per player and entry, as the templates expect"""
+        view = {
+            'id': self.id,
+            'gamemode': self.gamemode,
+            'players': [{'name': name, 'id': sid} for name, sid in self.players],
+            'current_round': self.current_round,
+            'current_player': self.current_player,
+            'status': self.status,
+            'start_time': self.start_time,
+            'round_start_time': self.round_start_time,
+            'completion_time': self.completion_time,
+            'prompts': [{'player': p, 'text': t, 'round': r} for p, t, r in self.prompts],
+            'images': [{'player': p, 'path': path, 'round': r} for p, path, r in self.images],
+            'descriptions': [{'player': p, 'text': t, 'round': r} for p, t, r in self.descriptions],
+        }
+        if self.simultaneous:
+            view['chains'] = self.chains()
+        return view
+
+    def to_state(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    @classmethod
+    def from_state(cls, values):
+        game = cls.__new__(cls)
+        for name, value in zip(cls.__slots__, values):
+            setattr(game, name, value)
+        # JSON turns tuples into lists
+        game.players = [tuple(p) for p in game.players]
+        for name in ('prompts', 'images', 'descriptions'):
+            setattr(game, name, [tuple(e) for e in getattr(game, name)])
+        return game
@@ -0,0 +1,264 @@
+"""
+Keeping the games mapping small.
+
+Finished games used to stay in memory until someone happened to open their
+results page after the hour was up, and games everyone had left stayed
+forever. A background sweep now:
+
+- drops completed games once their results expire (results_ttl after
+  completion);
+- drops running games whose room has had nobody in it for abandoned_ttl;
+- keeps at most max_games resident, moving the completed games viewed least
+  recently to the archive. Archived results are written to disk as gzipped
+  compact state (Game.to_state()) and the results page still finds them
+  until they expire.
+
+on_evict(room_code, game, reason) lets the app tear down the room, its
+timers and queued work, and release the game's files.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from game_model import Game
+
+EXPIRED = 'expired'
+ABANDONED = 'abandoned'
+ARCHIVED = 'archived'
+
+
+class GameArchive:
+    """Completed games on disk, one gzipped JSON file per room, until they expire"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._expiry = {}  # file path -> expires_at, so sweeps need not open the files
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.json.gz'):
+                    continue
+                try:
+                    with gzip.open(entry.path, 'rt', encoding='utf-8') as f:
+                        self._expiry[entry.path] = json.load(f)['expires_at']
+                except (OSError, ValueError, KeyError):
+                    self._expiry[entry.path] = 0  # unreadable: gone on the next sweep
+
+    def _path(self, room_code):
+        # Room codes come from players; hash them instead of trusting them as file names
+        name = hashlib.sha256(room_code.encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.directory, f"{name}.json.gz")
+
+    def put(self, room_code, game, expires_at):
+        path = self._path(room_code)
+        temp_path = os.path.join(self.directory, f".{uuid.uuid4()}.part")
+        try:
+            with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+                json.dump({'expires_at': expires_at, 'game': game.to_state()}, f, separators=(',', ':'))
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        with self._lock:
+            self._expiry[path] = expires_at
+
+    def get(self, room_code, now=None):
+        """The archived game, or None if there is none or it has expired"""
+        path = self._path(room_code)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if saved['expires_at'] <= (now or time.time()):
+            self.remove(room_code)
+            return None
+        return Game.from_state(saved['game'])
+
+    def remove(self, room_code):
+        self._remove_file(self._path(room_code))
+
+    def _remove_file(self, path):
+        with self._lock:
+            self._expiry.pop(path, None)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def sweep(self, now=None):
+        """Delete expired archives; returns how many"""
+        now = now or time.time()
+        with self._lock:
+            expired = [path for path, expires_at in self._expiry.items() if expires_at <= now]
+        for path in expired:
+            self._remove_file(path)
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            paths = list(self._expiry)
+        size = 0
+        for path in paths:
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return {'files': len(paths), 'bytes': size}
+
+
+class GameSweeper:
+    """Evicts expired and abandoned games and keeps the resident count under max_games"""
+
+    def __init__(self, state, games, archive, has_players, on_evict=None, results_ttl=3600,
+                 abandoned_ttl=600, max_games=500, sweep_interval=30, spawn=None, sleep=None, clock=None):
+        self.state = state  # for its atomic remove_if
+        self.games = games
+        self.archive = archive
+        self.has_players = has_players  # has_players(room_code) -> whether anyone is connected
+        self.on_evict = on_evict
+        self.results_ttl = results_ttl
+        self.abandoned_ttl = abandoned_ttl
+        self.max_games = max_games
+        self.sweep_interval = sweep_interval
+        self._spawn = spawn
+        self._sleep = sleep or time.sleep
+        self._clock = clock or time.time
+        self._lock = threading.Lock()
+        self._viewed = {}  # room_code -> last time its results page was opened
+        self._empty_since = {}  # room_code -> first sweep that found a running game's room empty
+        self._sizes = {}  # room_code -> (game id, entry count, approx bytes); finished games never change
+        self.evicted = {EXPIRED: 0, ABANDONED: 0, ARCHIVED: 0}
+        self.resident = 0
+        self.resident_bytes = 0
+        self._started = False
+
+    def viewed(self, room_code):
+        """Note that a game's results were just looked at"""
+        with self._lock:
+            self._viewed[room_code] = self._clock()
+
+    def _last_viewed(self, room_code, game):
+        return max(self._viewed.get(room_code, 0), game.completion_time or game.start_time)
+
+    def _verdict(self, room_code, game, now):
+        """Why the game should go now, or None to keep it (before the cap)"""
+        if game.completed:
+            if now - (game.completion_time or game.start_time) > self.results_ttl:
+                return EXPIRED
+            return None
+        if self.has_players(room_code):
+            self._empty_since.pop(room_code, None)
+            return None
+        empty_since = self._empty_since.setdefault(room_code, now)
+        return ABANDONED if now - empty_since > self.abandoned_ttl else None
+
+    def _approx_bytes(self, room_code, game):
+        entries = len(game.prompts) + len(game.images) + len(game.descriptions)
+        cached = self._sizes.get(room_code)
+        if cached is None or cached[:2] != (game.id, entries):
+            cached = (game.id, entries, game.approx_bytes())
+            self._sizes[room_code] = cached
+        return cached[2]
+
+    def _evict(self, room_code, game, reason, now):
+        """
+        Remove the game if it is still exactly what the sweep looked at (a turn
+        may have moved on since, in this or another process); returns it or None
+        """
+        seen = game.to_state()
+        if reason == ARCHIVED:
+            # Written first so the results page always finds the game in one place or the
+            # other; if the game changed meanwhile it stays resident and shadows this copy
+            self.archive.put(room_code, game, (game.completion_time or now) + self.results_ttl)
+        if self.state.remove_if(self.games, room_code, lambda current: current.to_state() == seen) is None:
+            return None
+        with self._lock:
+            self._viewed.pop(room_code, None)
+            self._empty_since.pop(room_code, None)
+            self._sizes.pop(room_code, None)
+            self.evicted[reason] += 1
+        if self.on_evict is not None:
+            self.on_evict(room_code, game, reason)
+        return game
+
+    def sweep(self, now=None, batch_size=200):
+        """Evict what has to go; returns the number of games evicted"""
+        now = now or self._clock()
+        kept = []  # (last viewed, room_code, game, bytes) of completed games that may be archived
+        resident = resident_bytes = evicted = 0
+        room_codes = list(self.games)
+        for i, room_code in enumerate(room_codes):
+            if i and i % batch_size == 0:
+                # Yield between batches so handlers keep running
+                self._sleep(0)
+            game = self.games.get(room_code)
+            if game is None:
+                continue
+            reason = self._verdict(room_code, game, now)
+            if reason is not None and self._evict(room_code, game, reason, now) is not None:
+                evicted += 1
+                continue
+            size = self._approx_bytes(room_code, game)
+            resident += 1
+            resident_bytes += size
+            if game.completed:
+                with self._lock:
+                    kept.append((self._last_viewed(room_code, game), room_code, game, size))
+
+        # Over the cap: archive completed games, least recently viewed first
+        kept.sort(key=lambda item: item[0])
+        for _, room_code, game, size in kept:
+            if resident <= self.max_games:
+                break
+            if self._evict(room_code, game, ARCHIVED, now) is not None:
+                evicted += 1
+                resident -= 1
+                resident_bytes -= size
+
+        # Forget rooms this sweep did not find (views of archived results included)
+        seen = set(room_codes)
+        with self._lock:
+            for tracked in (self._viewed, self._empty_since, self._sizes):
+                for room_code in [code for code in tracked if code not in seen]:
+                    del tracked[room_code]
+            self.resident = resident
+            self.resident_bytes = resident_bytes
+        self.archive.sweep(now)
+        return evicted
+
+    def start(self):
+        """Start the background sweep (once)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._spawn(self._run)
+
+    def _run(self):
+        while True:
+            self._sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error sweeping games: {e}")
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'resident': self.resident,
+                'resident_bytes': self.resident_bytes,
+                'max_games': self.max_games,
+                'evicted': dict(self.evicted),
+            }
+        stats['archive'] = self.archive.stats()
+        return stats
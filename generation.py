@@ -0,0 +1,219 @@
+"""
+Bounded worker pool for image generation.
+
+Every room gets its own FIFO queue so turns in a room are generated in the
+order they were submitted, while the rooms themselves are served round-robin
+so one busy room cannot starve the others. The number of workers is the
+global limit on concurrent provider calls.
+
+A room can split its work into lanes (one per chain in simultaneous games).
+Each lane is a FIFO of its own and takes its own turn in the round-robin,
+so the chains of one room are generated in parallel.
+
+Background work (such as refilling the fallback pool) sits in its own
+queue and only runs when no room is waiting, on at most max_background
+workers, so it never delays an active turn by more than one call.
+"""
+import threading
+import time
+from collections import deque
+
+
+class GenerationJob:
+    """A queued unit of work for one room"""
+
+    __slots__ = ('room_code', 'queue_key', 'func', 'args', 'cancelled', 'enqueued_at', 'started_at')
+
+    def __init__(self, room_code, func, args, queue_key=None):
+        self.room_code = room_code
+        self.queue_key = queue_key if queue_key is not None else room_code
+        self.func = func
+        self.args = args
+        self.cancelled = False
+        self.enqueued_at = time.time()
+        self.started_at = None
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class GenerationEngine:
+    """Runs generation jobs on a fixed number of workers with per-room ordering"""
+
+    def __init__(self, max_workers=4, max_queue=200, max_background=1, spawn=None):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.max_background = max_background
+        # spawn(func) starts a worker; app.py passes socketio.start_background_task
+        self._spawn = spawn or self._spawn_thread
+        self._cond = threading.Condition()
+        self._room_queues = {}  # queue key -> deque of jobs waiting to run
+        self._ready = deque()  # queue keys with queued work and nothing in flight
+        self._running = {}  # queue key -> job currently being processed
+        self._lanes = {}  # room_code -> queue keys of the room's lanes
+        self._background = deque()  # low-priority jobs not tied to a room
+        self._background_running = 0
+        self._pending = 0
+        self._started = False
+        self._completed = 0
+        self._cancelled = 0
+        self._rejected = 0
+
+    @staticmethod
+    def _spawn_thread(func):
+        thread = threading.Thread(target=func, daemon=True)
+        thread.start()
+        return thread
+
+    def start(self):
+        """Start the workers (called lazily on the first submit)"""
+        with self._cond:
+            if self._started:
+                return
+            self._started = True
+        for _ in range(self.max_workers):
+            self._spawn(self._worker)
+
+    def submit(self, room_code, func, *args, lane=None):
+        """
+        Queue func(job, *args) for room_code, on one of its lanes if given.
+        Returns the job, or None if the queue is full.
+        """
+        if not self._started:
+            self.start()
+
+        key = room_code if lane is None else (room_code, lane)
+        job = GenerationJob(room_code, func, args, queue_key=key)
+        with self._cond:
+            if self._pending >= self.max_queue:
+                self._rejected += 1
+                return None
+            if lane is not None:
+                self._lanes.setdefault(room_code, set()).add(key)
+            self._room_queues.setdefault(key, deque()).append(job)
+            self._pending += 1
+            if key not in self._running and key not in self._ready:
+                self._ready.append(key)
+            self._cond.notify()
+        return job
+
+    def submit_background(self, func, *args):
+        """Queue func(job, *args) at low priority; only runs when rooms are idle"""
+        if not self._started:
+            self.start()
+
+        job = GenerationJob(None, func, args)
+        with self._cond:
+            self._background.append(job)
+            self._cond.notify()
+        return job
+
+    def jobs_ahead(self, room_code, lane=None):
+        """
+        How many queued jobs would start before one submitted now for
+        room_code (and lane). Rooms take one job per turn, so a room with a
+        long queue holds up a newcomer by one job, not by all of them.
+        """
+        key = room_code if lane is None else (room_code, lane)
+        with self._cond:
+            rounds = len(self._room_queues.get(key, ()))  # the new job's place in its own queue
+            # The line as it will be served: waiting keys, then ours if it is new, then
+            # keys with a job in flight, which rejoin at the back when it finishes
+            order = list(self._ready)
+            if key not in self._ready and key not in self._running:
+                order.append(key)
+            order += [k for k in self._running if k in self._room_queues and k != key]
+            if key in self._running:
+                order.append(key)
+            ahead = rounds
+            before = True
+            for k in order:
+                if k == key:
+                    before = False
+                    continue
+                ahead += min(len(self._room_queues.get(k, ())), rounds + 1 if before else rounds)
+            return ahead
+
+    def queue_depth(self):
+        """Total number of jobs waiting for a worker"""
+        with self._cond:
+            return self._pending
+
+    def cancel_room(self, room_code):
+        """Drop queued jobs for a room (all lanes) and flag its running jobs as cancelled"""
+        with self._cond:
+            for key in [room_code, *self._lanes.pop(room_code, ())]:
+                queued = self._room_queues.pop(key, None)
+                if queued:
+                    for job in queued:
+                        job.cancel()
+                    self._pending -= len(queued)
+                    self._cancelled += len(queued)
+                if key in self._ready:
+                    self._ready.remove(key)
+                running = self._running.get(key)
+                if running is not None:
+                    running.cancel()
+
+    def _can_run_background(self):
+        return self._background and self._background_running < self.max_background
+
+    def _next_job(self):
+        with self._cond:
+            while not self._ready and not self._can_run_background():
+                self._cond.wait()
+            if not self._ready:
+                job = self._background.popleft()
+                self._background_running += 1
+                job.started_at = time.time()
+                return job
+            key = self._ready.popleft()
+            room_jobs = self._room_queues[key]
+            job = room_jobs.popleft()
+            if not room_jobs:
+                del self._room_queues[key]
+            self._pending -= 1
+            self._running[key] = job
+            job.started_at = time.time()
+            return job
+
+    def _finish(self, job):
+        with self._cond:
+            self._completed += 1
+            if job.room_code is None:
+                self._background_running -= 1
+                if self._background:
+                    self._cond.notify()
+                return
+            self._running.pop(job.queue_key, None)
+            # The room (or lane) goes to the back of the line if it has more work
+            if job.queue_key in self._room_queues:
+                self._ready.append(job.queue_key)
+                self._cond.notify()
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            try:
+                if not job.cancelled:
+                    job.func(job, *job.args)
+            except Exception as e:
+                print(f"Error in generation job for room {job.room_code}: {e}")
+            finally:
+                self._finish(job)
+
+    def stats(self):
+        """Snapshot of queue and worker counters"""
+        with self._cond:
+            return {
+                'workers': self.max_workers,
+                'queue_depth': self._pending,
+                'queue_limit': self.max_queue,
+                'rooms_waiting': len(self._room_queues),
+                'in_flight': len(self._running),
+                'background_queued': len(self._background),
+                'background_running': self._background_running,
+                'completed': self._completed,
+                'cancelled': self._cancelled,
+                'rejected': self._rejected,
+            }
@@ -0,0 +1,221 @@
+"""
+Content-addressed prompt -> image cache.
+
+Players repeat prompts all the time ("a cat", "a dog on the moon"), so a
+generated image is remembered under a key built from the normalized prompt,
+model and size. Image files are stored once under the SHA-256 of their
+contents and hard-linked into static/generated on a hit, so evicting a
+cache entry never breaks an image a game is still showing. The image's
+WebP/JPEG derivatives are kept next to the blob and linked along with it,
+so a hit does not encode them all over again.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+
+from derivatives import variant_paths
+
+# Rough list price of one dall-e-2 1024x1024 image, used to report savings
+IMAGE_COST_USD = 0.02
+
+
+def normalize_prompt(prompt):
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    prompt = re.sub(r'\s+', ' ', prompt.strip().lower())
+    return prompt.rstrip('.!?,;: ')
+
+
+def cache_key(prompt, model, size):
+    raw = f"{model}|{size}|{normalize_prompt(prompt)}"
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class ImageCache:
+    """LRU, size-bounded index of generated images keyed on prompt/model/size"""
+
+    def __init__(self, cache_dir, max_entries=1000, max_bytes=500 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self._lock = threading.Lock()
+        # key -> {'blob': file name, 'seconds': generation latency}; oldest first
+        self._entries = OrderedDict()
+        # blob file name -> {'bytes': size, 'refs': number of keys using it}
+        self._blobs = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        """Rebuild the in-memory index, dropping entries whose file has gone"""
+        try:
+            with open(self.index_path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = []
+        for key, blob, seconds in saved:
+            blob_path = os.path.join(self.cache_dir, blob)
+            if not os.path.exists(blob_path):
+                continue
+            self._entries[key] = {'blob': blob, 'seconds': seconds}
+            self._add_blob_ref(blob, os.path.getsize(blob_path) + self._variant_bytes(blob_path))
+
+    @staticmethod
+    def _variant_bytes(blob_path):
+        return sum(os.path.getsize(path) for path in variant_paths(blob_path) if os.path.exists(path))
+
+    def _save_index(self):
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump([[key, e['blob'], e['seconds']] for key, e in self._entries.items()], f)
+        os.replace(temp_path, self.index_path)
+
+    def _add_blob_ref(self, blob, size):
+        if blob in self._blobs:
+            self._blobs[blob]['refs'] += 1
+        else:
+            self._blobs[blob] = {'bytes': size, 'refs': 1}
+            self.total_bytes += size
+
+    def _drop_entry(self, key):
+        entry = self._entries.pop(key)
+        blob = self._blobs[entry['blob']]
+        blob['refs'] -= 1
+        if blob['refs'] == 0:
+            del self._blobs[entry['blob']]
+            self.total_bytes -= blob['bytes']
+            blob_path = os.path.join(self.cache_dir, entry['blob'])
+            for path in [blob_path, *variant_paths(blob_path)]:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            oldest_key = next(iter(self._entries))
+            self._drop_entry(oldest_key)
+
+    def lookup(self, prompt, model, size, dest_dir):
+        """Return a fresh path in dest_dir for a cached image, or None on a miss"""
+        key = cache_key(prompt, model, size)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_seconds += entry['seconds']
+            blob = entry['blob']
+
+        image_path = os.path.join(dest_dir, f"{uuid.uuid4()}{os.path.splitext(blob)[1]}")
+        try:
+            link_or_copy(os.path.join(self.cache_dir, blob), image_path)
+        except OSError as e:
+            print(f"Cached image {blob} unavailable: {e}")
+            with self._lock:
+                if key in self._entries:
+                    self._drop_entry(key)
+                self.hits -= 1
+                self.misses += 1
+                self.saved_seconds -= entry['seconds']
+            return None
+        # Derivatives kept from an earlier turn; any still missing are written as usual
+        for cached, linked in zip(variant_paths(os.path.join(self.cache_dir, blob)), variant_paths(image_path)):
+            if os.path.exists(cached):
+                try:
+                    link_or_copy(cached, linked)
+                except OSError:
+                    pass
+        return image_path
+
+    def store(self, prompt, model, size, image_path, seconds=0.0):
+        """Remember a freshly generated image for this prompt"""
+        key = cache_key(prompt, model, size)
+        blob = file_digest(image_path) + os.path.splitext(image_path)[1]
+        blob_path = os.path.join(self.cache_dir, blob)
+        if not os.path.exists(blob_path):
+            link_or_copy(image_path, blob_path)
+
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None and existing['blob'] == blob:
+                self._entries.move_to_end(key)
+                return
+            if existing is not None:
+                self._drop_entry(key)
+            self._entries[key] = {'blob': blob, 'seconds': seconds}
+            self._add_blob_ref(blob, os.path.getsize(blob_path))
+            self._evict()
+            self._save_index()
+
+    def store_variants(self, image_path):
+        """Keep the derivatives written for a cached image next to its blob, for later hits"""
+        blob = file_digest(image_path) + os.path.splitext(image_path)[1]
+        with self._lock:
+            if blob not in self._blobs:
+                return
+        blob_path = os.path.join(self.cache_dir, blob)
+        added = []
+        for written, cached in zip(variant_paths(image_path), variant_paths(blob_path)):
+            if os.path.exists(written) and not os.path.exists(cached):
+                try:
+                    link_or_copy(written, cached)
+                except OSError:
+                    continue
+                added.append(cached)
+        size = sum(os.path.getsize(path) for path in added)
+        with self._lock:
+            if blob in self._blobs:
+                self._blobs[blob]['bytes'] += size
+                self.total_bytes += size
+                entries = len(self._entries)
+                self._evict()
+                if len(self._entries) != entries:
+                    self._save_index()
+                return
+        # Evicted while we were linking
+        for path in added:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'saved_seconds': round(self.saved_seconds, 2),
+                'saved_usd': round(self.hits * IMAGE_COST_USD, 2),
+            }
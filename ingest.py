@@ -0,0 +1,97 @@
+"""
+Streaming ingest of generated images.
+
+The provider hands us a URL to an already-encoded PNG, so there is no
+reason to decode it and encode it again. We stream the response body
+straight to a temporary file through a pooled session, check the magic
+bytes of the first chunk, and rename it into place once it is complete.
+"""
+import os
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+CHUNK_SIZE = 64 * 1024
+DOWNLOAD_TIMEOUT = (5, 30)  # (connect, read) seconds
+MAX_IMAGE_BYTES = 20 * 1024 * 1024
+
+# Magic bytes -> file extension for the formats the providers return
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF8', 'gif'),
+)
+
+
+class IngestError(Exception):
+    """Raised when a downloaded file is not an image we can serve"""
+
+
+def sniff_image_type(head):
+    """Return the file extension for an image header, or None"""
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+def create_session(pool_size=10):
+    """HTTP session that keeps connections to the image CDN alive between turns"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+http_session = create_session()
+
+
+def download_image(url, save_dir, session=None, timeout=DOWNLOAD_TIMEOUT, max_bytes=MAX_IMAGE_BYTES,
+                   deadline=None):
+    """
+    Stream an image from url into save_dir without decoding it.
+    deadline (a time.time() value) bounds the whole download, not just each read.
+    Returns the saved path; raises IngestError or requests exceptions on failure.
+    """
+    session = session or http_session
+    if deadline is not None:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise IngestError("Deadline passed before the download started")
+        timeout = (min(timeout[0], remaining), min(timeout[1], remaining))
+    image_id = str(uuid.uuid4())
+    temp_path = os.path.join(save_dir, f".{image_id}.part")
+    extension = None
+    written = 0
+
+    try:
+        with session.get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            with open(temp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    if extension is None:
+                        extension = sniff_image_type(chunk[:16])
+                        if extension is None:
+                            raise IngestError(f"Not an image (starts with {chunk[:8]!r})")
+                    written += len(chunk)
+                    if written > max_bytes:
+                        raise IngestError(f"Image larger than {max_bytes} bytes")
+                    if deadline is not None and time.time() > deadline:
+                        raise IngestError("Deadline passed during the download")
+                    f.write(chunk)
+
+        if extension is None:
+            raise IngestError("Empty image response")
+
+        image_path = os.path.join(save_dir, f"{image_id}.{extension}")
+        os.replace(temp_path, image_path)
+        return image_path
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -0,0 +1,84 @@
+"""
+Graceful shutdown.
+
+On SIGTERM the server drains instead of dropping games mid-turn:
+
+- it stops taking new joins and games (handlers check accepting), and
+  /health turns 503 so the load balancer sends new players elsewhere;
+- turn work already submitted (an image being generated, a drawing being
+  described) gets up to the drain timeout to finish;
+- whatever is still running then is handed off: each task registered a
+  hand_off() that finishes its turn without it, the same way a turn that
+  runs out of time does (a fallback image, a placeholder description), so
+  the room can carry on from the shared state on another process.
+"""
+import itertools
+import threading
+import time
+
+
+class Lifecycle:
+    """Whether the server takes new rooms, and the turn work it still owes"""
+
+    def __init__(self, poll_interval=0.25, sleep=None, clock=None):
+        self.poll_interval = poll_interval
+        self._sleep = sleep or time.sleep
+        self._clock = clock or time.time
+        self._lock = threading.Lock()
+        self._tasks = {}  # token -> (room_code, hand_off)
+        self._tokens = itertools.count(1)
+        self.draining = False
+        self.finished = 0
+        self.handed_off = 0
+
+    @property
+    def accepting(self):
+        return not self.draining
+
+    def begin(self, room_code, hand_off):
+        """Register turn work for a room; returns the token to end() it with"""
+        token = next(self._tokens)
+        with self._lock:
+            self._tasks[token] = (room_code, hand_off)
+        return token
+
+    def end(self, token):
+        with self._lock:
+            if self._tasks.pop(token, None) is not None:
+                self.finished += 1
+
+    def forget_room(self, room_code):
+        """Drop the work of a room that was torn down (its queued jobs were cancelled)"""
+        with self._lock:
+            for token in [token for token, task in self._tasks.items() if task[0] == room_code]:
+                del self._tasks[token]
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._tasks)
+
+    def drain(self, timeout):
+        """Stop accepting, wait up to timeout for turn work, hand off the rest; returns how many were"""
+        self.draining = True
+        deadline = self._clock() + timeout
+        while self.in_flight() and self._clock() < deadline:
+            self._sleep(self.poll_interval)
+        with self._lock:
+            left = list(self._tasks.values())
+            self._tasks.clear()
+        for room_code, hand_off in left:
+            try:
+                hand_off()
+            except Exception as e:
+                print(f"Error handing off work for room {room_code}: {e}")
+        self.handed_off += len(left)
+        return len(left)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'draining': self.draining,
+                'in_flight': len(self._tasks),
+                'finished': self.finished,
+                'handed_off': self.handed_off,
+            }
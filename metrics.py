@@ -0,0 +1,196 @@
+"""
+Prometheus metrics without the client library.
+
+Counters, gauges and histograms, optionally with labels, rendered in the
+Prometheus text format (version 0.0.4) by REGISTRY.render(). Gauges can be
+given a function instead of being set, so values such as the number of
+rooms are read when /metrics is scraped rather than kept up to date on
+every change.
+
+    DOWNLOAD_SECONDS = histogram('download_seconds', 'Image download time')
+    with DOWNLOAD_SECONDS.time():
+        ...
+"""
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = 'teleprompt_'
+# Seconds: from a fast socket handler up to a slow OpenAI call
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}  # label values -> value
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(value)}" for key, value in items]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        # function() -> value, or {label values tuple: value} for a labelled gauge
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        if self.function is None:
+            return super()._samples()
+        try:
+            value = self.function()
+        except Exception as e:
+            print(f"Error reading gauge {self.name}: {e}")
+            return []
+        items = sorted(value.items()) if isinstance(value, dict) else [((), value)]
+        return [f"{self.name}{_labels(self.label_names, key)} {_number(v)}" for key, v in items]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]  # counts, sum, count
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe how long the with block took, also when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, [list(state[0]), state[1], state[2]]) for key, state in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, [('le', _number(bound))])} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+
+class LagProbe:
+    """
+    Sleeps interval over and over and observes how late it wakes up: with
+    eventlet or gevent a blocked hub, with threads a busy interpreter
+    """
+
+    def __init__(self, histogram, interval=0.1, spawn=None, sleep=None):
+        self.histogram = histogram
+        self.interval = interval
+        self._spawn = spawn
+        self._sleep = sleep or time.sleep
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        """Start probing (once)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._spawn(self._run)
+
+    def _run(self):
+        while True:
+            started = time.perf_counter()
+            self._sleep(self.interval)
+            self.histogram.observe(max(0.0, time.perf_counter() - started - self.interval))
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labels=()):
+    return REGISTRY.register(Counter(name, documentation, labels))
+
+
+def gauge(name, documentation, labels=(), function=None):
+    return REGISTRY.register(Gauge(name, documentation, labels, function))
+
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labels, buckets))
@@ -0,0 +1,334 @@
+"""
+Deadline-bound, hedged calls to external providers (OpenAI).
+
+Every call gets an absolute deadline, usually what is left of the player's
+turn. A latency histogram per provider records how long successful calls
+take; once a call has run longer than the chosen percentile, a duplicate
+("hedge") is sent and whichever answers first wins. A circuit breaker
+watches the error rate and, when it spikes, fails calls immediately so
+the game falls back to local images instead of waiting on a sick API.
+
+Attempts can pass through a local admission step first (the shared OpenAI
+rate limits). Time spent there is not provider latency, and an attempt
+that never got out is not a provider failure.
+"""
+import bisect
+import contextlib
+import queue
+import threading
+import time
+from collections import deque
+
+# Histogram bucket upper bounds in seconds: 50 ms doubling up to ~100 s
+LATENCY_BUCKETS = tuple(0.05 * 2 ** i for i in range(12))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class ProviderError(Exception):
+    """Base class for failures raised by the provider layer itself"""
+
+
+class ProviderUnavailable(ProviderError):
+    """The circuit breaker is open; the provider is not being called"""
+
+
+class DeadlineExceeded(ProviderError):
+    """No attempt finished before the call's deadline"""
+
+
+class NotAttempted(ProviderError):
+    """The attempt was held back locally (e.g. by a rate limit) and never reached the provider"""
+
+
+class LatencyHistogram:
+    """Bucketed latencies; old samples are halved away so the shape tracks recent calls"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, window=500):
+        self.buckets = buckets
+        self.window = window  # halve all counts once this many samples are held
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self._total = 0
+        self.sum = 0.0
+        self.count = 0  # lifetime samples
+
+    def record(self, seconds):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self._total += 1
+            self.sum += seconds
+            self.count += 1
+            if self._total >= self.window:
+                self._counts = [c // 2 for c in self._counts]
+                self._total = sum(self._counts)
+
+    def samples(self):
+        with self._lock:
+            return self._total
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (0 < q <= 1), or None if empty"""
+        with self._lock:
+            if not self._total:
+                return None
+            rank = q * self._total
+            seen = 0
+            for i, count in enumerate(self._counts):
+                seen += count
+                if seen >= rank:
+                    return self.buckets[i] if i < len(self.buckets) else float('inf')
+        return None
+
+    def snapshot(self):
+        """Percentiles over the current window, for /stats"""
+        return {
+            'samples': self.samples(),
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+        }
+
+
+class CircuitBreaker:
+    """Opens when the recent error rate passes a threshold; probes again after a cooldown"""
+
+    def __init__(self, error_threshold=0.5, min_calls=10, window=30.0, cooldown=15.0, clock=None):
+        self.error_threshold = error_threshold
+        self.min_calls = min_calls  # don't judge on fewer outcomes than this
+        self.window = window  # seconds of outcomes considered
+        self.cooldown = cooldown  # seconds to stay open before a probe
+        self._clock = clock or time.time
+        self._lock = threading.Lock()
+        self._outcomes = deque()  # (time, ok)
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self.opened = 0
+
+    def allow(self):
+        """Whether a call may go out now"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self._clock() - self._opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                # Let exactly one probe through
+                self._probing = True
+                return True
+            return False
+
+    def release(self):
+        """The call allow() let through never reached the provider; a half-open breaker may probe again"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+
+    def record(self, ok):
+        with self._lock:
+            now = self._clock()
+            if self.state == HALF_OPEN:
+                if ok:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                else:
+                    self._open(now)
+                return
+            self._outcomes.append((now, ok))
+            while self._outcomes and now - self._outcomes[0][0] > self.window:
+                self._outcomes.popleft()
+            failures = sum(1 for _, success in self._outcomes if not success)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.error_threshold:
+                self._open(now)
+
+    def _open(self, now):
+        self.state = OPEN
+        self._opened_at = now
+        self._probing = False
+        self._outcomes.clear()
+        self.opened += 1
+
+
+def close_stream(value):
+    """discard hook for streamed responses: hang up on a stream that lost the race"""
+    response = getattr(value, 'response', None)
+    if response is not None:
+        response.close()
+
+
+class Provider:
+    """Runs calls to one external service with a deadline, hedging and a breaker"""
+
+    def __init__(self, name, hedge_quantile=0.9, max_hedges=1, min_samples=20,
+                 breaker=None, histogram=None, spawn=None, discard=None, busy=None):
+        self.name = name
+        self.hedge_quantile = hedge_quantile  # hedge once a call is slower than this quantile
+        self.max_hedges = max_hedges  # extra attempts per call (hedges and retries together)
+        self.min_samples = min_samples  # no hedging until the histogram has this many samples
+        self.breaker = breaker or CircuitBreaker()
+        self.histogram = histogram or LatencyHistogram()
+        self._spawn = spawn or self._spawn_thread
+        self.discard = discard  # called with successful results nobody will use (hedge losers)
+        self.busy = busy  # no hedging while busy() is true (a duplicate would only queue behind the rate limit)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.short_circuited = 0
+        self.deadline_exceeded = 0
+        self.not_attempted = 0
+
+    @staticmethod
+    def _spawn_thread(fn):
+        threading.Thread(target=fn, daemon=True).start()
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging, or None while there is too little data"""
+        if self.max_hedges <= 0 or self.histogram.samples() < self.min_samples:
+            return None
+        return self.histogram.percentile(self.hedge_quantile)
+
+    def call(self, fn, deadline, *args, admit=None, **kwargs):
+        """
+        Call fn(*args, timeout=<seconds left>, **kwargs) and return the first
+        successful result. Raises ProviderUnavailable while the breaker is
+        open, DeadlineExceeded if nothing finished in time, or the last error.
+
+        admit(deadline), if given, returns a context manager that every
+        attempt enters before fn is called. It may wait (for a rate limit),
+        raises NotAttempted if the attempt cannot go out in time, and sees
+        fn's errors on the way out. Latency is measured from admission, and
+        attempts that never went out are not retried or held against the
+        breaker.
+        """
+        self._count('calls')
+        if not self.breaker.allow():
+            self._count('short_circuited')
+            raise ProviderUnavailable(f"{self.name} circuit is open")
+
+        results = queue.Queue()
+        settle_lock = threading.Lock()
+        settled = False
+        sent = set()  # attempts that got past admission and have not answered yet
+
+        def attempt(index):
+            try:
+                with admit(deadline) if admit is not None else contextlib.nullcontext():
+                    started = time.time()
+                    with settle_lock:
+                        sent.add(index)
+                    value = fn(*args, timeout=max(0.1, deadline - started), **kwargs)
+            except Exception as e:
+                results.put((index, False, e))
+                return
+            # Late losers are still real latency samples
+            self.histogram.record(time.time() - started)
+            with settle_lock:
+                late = settled
+                if not late:
+                    results.put((index, True, value))
+            if late and self.discard:
+                self.discard(value)
+
+        def settle():
+            # Results that arrived but lost the race are handed to discard
+            nonlocal settled
+            with settle_lock:
+                settled = True
+            while self.discard:
+                try:
+                    _, ok, value = results.get_nowait()
+                except queue.Empty:
+                    break
+                if ok:
+                    self.discard(value)
+
+        def launch(index):
+            self._spawn(lambda: attempt(index))
+
+        launch(0)
+        attempts, pending = 1, 1
+        delay = self.hedge_delay()
+        hedge_at = time.time() + delay if delay is not None else None
+        last_error = None
+        reached = False  # an attempt reached the provider and failed
+
+        while True:
+            now = time.time()
+            if now >= deadline:
+                break
+            can_hedge = hedge_at is not None and attempts <= self.max_hedges and not (self.busy and self.busy())
+            wait_until = min(deadline, hedge_at) if can_hedge else deadline
+            try:
+                index, ok, value = results.get(timeout=max(0.0, wait_until - now))
+            except queue.Empty:
+                if can_hedge and time.time() >= hedge_at:
+                    # Slower than usual: race a duplicate against the first attempt
+                    launch(attempts)
+                    attempts += 1
+                    pending += 1
+                    self._count('hedges')
+                    hedge_at = time.time() + delay
+                continue
+
+            pending -= 1
+            with settle_lock:
+                sent.discard(index)
+            if ok:
+                if index > 0:
+                    self._count('hedge_wins')
+                self.breaker.record(True)
+                settle()
+                return value
+            last_error = value
+            reached = reached or not isinstance(value, NotAttempted)
+            if pending == 0:
+                if (attempts <= self.max_hedges and deadline - time.time() > 0
+                        and not isinstance(value, NotAttempted)):
+                    # Fast failure with budget left: try once more
+                    launch(attempts)
+                    attempts += 1
+                    pending += 1
+                    continue
+                break
+
+        settle()
+        with settle_lock:
+            # An attempt still out at the deadline counts as the provider failing
+            reached = reached or bool(sent)
+        if reached:
+            self.breaker.record(False)
+            self._count('failures')
+        else:
+            # Held back locally the whole time: the provider was never asked
+            self.breaker.release()
+            self._count('not_attempted')
+        if pending:
+            self._count('deadline_exceeded')
+            raise DeadlineExceeded(f"{self.name} call missed its deadline")
+        raise last_error
+
+    def stats(self):
+        with self._lock:
+            counters = {
+                'calls': self.calls,
+                'failures': self.failures,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'short_circuited': self.short_circuited,
+                'deadline_exceeded': self.deadline_exceeded,
+                'not_attempted': self.not_attempted,
+            }
+        counters['breaker'] = self.breaker.state
+        counters['breaker_opened'] = self.breaker.opened
+        counters['latency'] = self.histogram.snapshot()
+        return counters
@@ -0,0 +1,262 @@
+"""
+Shared rate limits for the OpenAI account.
+
+Every room uses the same API key, so image generations, vision descriptions
+and background work all count against one set of account limits. Before a
+request goes out it takes its cost from token buckets matched to those
+limits (images per minute, vision requests and tokens per minute). When a
+bucket runs dry, requests wait in priority order: active turns first, then
+drawing descriptions, then background work such as fallback refills.
+Within a priority the rooms take turns, so one busy room cannot hold up the
+others.
+
+A 429 pauses the buckets the request drew on for its retry-after and halves
+their rate. Every success wins back a little of the configured rate, so the
+scheduler settles just under a limit that is lower than it was told.
+"""
+import contextlib
+import threading
+import time
+from collections import OrderedDict, deque
+
+from providers import NotAttempted
+
+ACTIVE_TURN = 0
+VISION = 1
+BACKGROUND = 2
+PRIORITY_NAMES = ('active_turn', 'vision', 'background')
+# Share of every bucket a priority may not dip into, so work arriving first cannot spend what turns need
+RESERVE = (0.0, 0.0, 0.5)
+
+DEFAULT_RETRY_AFTER = 1.0  # seconds to back off after a 429 that did not say
+
+
+class QueueTimeout(NotAttempted):
+    """The request's deadline passed while it waited for the rate limits"""
+
+
+def retry_after(error):
+    """Seconds a 429 asked us to wait (DEFAULT_RETRY_AFTER if it did not say), or None for other errors"""
+    if getattr(error, 'status_code', None) != 429:
+        return None
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None) or {}
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        pass  # an HTTP date; not worth parsing for a few seconds
+    return DEFAULT_RETRY_AFTER
+
+
+class TokenBucket:
+    """per_minute tokens a minute, up to burst of them at once; not thread-safe, the scheduler locks"""
+
+    def __init__(self, name, per_minute, burst=None, min_share=0.1, recovery=0.05, clock=None):
+        self.name = name
+        self.limit = per_minute / 60.0  # configured tokens per second
+        self.rate = self.limit  # current tokens per second, lowered by 429s
+        self.capacity = burst or max(1.0, per_minute / 6.0)  # ten seconds' worth by default
+        self.min_share = min_share  # 429s never take the rate below this share of the limit
+        self.recovery = recovery  # share of the limit each success wins back
+        self._clock = clock or time.time
+        self.tokens = self.capacity
+        self._updated = self._clock()
+        self.paused_until = 0.0
+        self.throttled = 0
+
+    def _refill(self, now):
+        if now > self._updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def wait_time(self, amount, now, reserve=0.0):
+        """Seconds until amount can be taken leaving a reserve share of the bucket (0 if it can now)"""
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        # A request bigger than the bucket goes out when it is full and leaves it in debt
+        need = min(amount + self.capacity * reserve, self.capacity)
+        if self.tokens >= need:
+            return 0.0
+        return (need - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= amount
+
+    def throttle(self, seconds, now):
+        """The provider said 429: stop for seconds, then go at half the rate"""
+        self._refill(now)
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.rate = max(self.limit * self.min_share, self.rate / 2)
+        self.tokens = min(self.tokens, 0.0)
+        self.throttled += 1
+
+    def recover(self):
+        self.rate = min(self.limit, self.rate + self.limit * self.recovery)
+
+    def stats(self):
+        return {
+            'per_minute': round(self.limit * 60, 1),
+            'current_per_minute': round(self.rate * 60, 1),
+            'tokens': round(self.tokens, 1),
+            'paused': self.paused_until > self._clock(),
+            'throttled': self.throttled,
+        }
+
+
+class _Request:
+    __slots__ = ('costs', 'priority', 'room_code', 'granted')
+
+    def __init__(self, costs, priority, room_code):
+        self.costs = costs
+        self.priority = priority
+        self.room_code = room_code
+        self.granted = False
+
+
+class RateLimitScheduler:
+    """Admits requests against shared token buckets by priority, rooms taking turns within one"""
+
+    def __init__(self, buckets, retry_after=retry_after, observe=None, clock=None):
+        self.buckets = {bucket.name: bucket for bucket in buckets}
+        self.retry_after = retry_after  # error -> seconds to back off, or None if it was not a rate limit
+        self.observe = observe  # observe(priority name, seconds waited) for every request, admitted or not
+        self._clock = clock or time.time
+        self._cond = threading.Condition()
+        # Per priority: room code -> deque of waiting requests; the room at the front is served next
+        self._queues = [OrderedDict() for _ in PRIORITY_NAMES]
+        self.admitted = [0] * len(PRIORITY_NAMES)
+        self.waited = [0.0] * len(PRIORITY_NAMES)
+        self.timeouts = [0] * len(PRIORITY_NAMES)
+        self.rate_limited = 0
+
+    def acquire(self, costs, priority, room_code=None, deadline=None):
+        """
+        Wait until every bucket named in costs ({bucket: amount}) can pay, and
+        take the amounts. Returns the seconds waited; raises QueueTimeout if
+        deadline passes first. Buckets that are not configured cost nothing.
+        """
+        costs = {name: amount for name, amount in costs.items() if name in self.buckets}
+        request = _Request(costs, priority, room_code)
+        started = self._clock()
+        with self._cond:
+            if costs:
+                self._queues[priority].setdefault(room_code, deque()).append(request)
+            while costs:
+                wake = self._dispatch(self._clock())
+                if request.granted:
+                    break
+                now = self._clock()
+                if deadline is not None and now >= deadline:
+                    self._withdraw(request)
+                    self.timeouts[priority] += 1
+                    break
+                timeout = wake
+                if deadline is not None:
+                    timeout = deadline - now if timeout is None else min(timeout, deadline - now)
+                self._cond.wait(timeout)
+            waited = self._clock() - started
+            admitted = request.granted or not costs
+            if admitted:
+                self.admitted[priority] += 1
+                self.waited[priority] += waited
+        # Waits that ran out count too, or the worst ones would never show
+        if self.observe is not None:
+            self.observe(PRIORITY_NAMES[priority], waited)
+        if not admitted:
+            raise QueueTimeout(f"{PRIORITY_NAMES[priority]} request waited past its deadline")
+        return waited
+
+    def _dispatch(self, now):
+        """Grant what can be paid for now, in order; returns seconds until the first blocked request could go"""
+        blocked = set()  # buckets a request ahead is waiting on; nobody behind it may drain them
+        wake = None
+        granted = False
+        for priority, queue in enumerate(self._queues):
+            for room_code in list(queue):
+                requests = queue[room_code]
+                request = requests[0]
+                if blocked.intersection(request.costs):
+                    continue
+                wait = max(self.buckets[name].wait_time(amount, now, RESERVE[priority])
+                           for name, amount in request.costs.items())
+                if wait > 0:
+                    blocked.update(request.costs)
+                    wake = wait if wake is None else min(wake, wait)
+                    continue
+                for name, amount in request.costs.items():
+                    self.buckets[name].take(amount)
+                request.granted = True
+                granted = True
+                requests.popleft()
+                # The room goes to the back of the line if it has more waiting
+                del queue[room_code]
+                if requests:
+                    queue[room_code] = requests
+        if granted:
+            self._cond.notify_all()
+        return wake
+
+    def _withdraw(self, request):
+        queue = self._queues[request.priority]
+        requests = queue.get(request.room_code)
+        if requests is not None:
+            requests.remove(request)
+            if not requests:
+                del queue[request.room_code]
+        # Whoever it was holding up may be able to go now
+        self._cond.notify_all()
+
+    def throttle(self, costs, seconds):
+        """Back off the buckets a rate-limited request used"""
+        with self._cond:
+            self.rate_limited += 1
+            now = self._clock()
+            for name in costs:
+                if name in self.buckets:
+                    self.buckets[name].throttle(seconds, now)
+
+    def succeeded(self, costs):
+        with self._cond:
+            for name in costs:
+                if name in self.buckets:
+                    self.buckets[name].recover()
+
+    def busy(self):
+        """Whether requests are waiting or a bucket is backing off (no time for duplicate requests)"""
+        with self._cond:
+            now = self._clock()
+            return any(self._queues) or any(bucket.paused_until > now for bucket in self.buckets.values())
+
+    @contextlib.contextmanager
+    def admit(self, costs, priority, room_code, deadline):
+        """
+        Wait for the limits, then run the body as one request; a rate-limited
+        error coming out of it backs the buckets off. With the first three
+        arguments bound this is a Provider.call admit hook.
+        """
+        self.acquire(costs, priority, room_code, deadline)
+        try:
+            yield
+        except Exception as e:
+            seconds = self.retry_after(e)
+            if seconds is not None:
+                self.throttle(costs, seconds)
+            raise
+        self.succeeded(costs)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'buckets': {name: bucket.stats() for name, bucket in self.buckets.items()},
+                'waiting': {PRIORITY_NAMES[p]: sum(len(requests) for requests in queue.values())
+                            for p, queue in enumerate(self._queues)},
+                'admitted': dict(zip(PRIORITY_NAMES, self.admitted)),
+                'mean_wait_ms': {PRIORITY_NAMES[p]: round(self.waited[p] / self.admitted[p] * 1000, 1)
+                                 for p in range(len(PRIORITY_NAMES)) if self.admitted[p]},
+                'timeouts': dict(zip(PRIORITY_NAMES, self.timeouts)),
+                'rate_limited': self.rate_limited,
+            }
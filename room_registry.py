@@ -0,0 +1,102 @@
+"""
+Lobby membership with O(1) joins, rejoins and disconnects.
+
+Each room is stored as a dict of player name -> socket id (insertion
+ordered, so join order is kept) and the registry keeps a reverse index from
+socket id to the rooms that socket joined. Disconnect only touches the
+rooms of the departing socket instead of scanning every room.
+
+The sid index is local to this process, which is fine because a socket
+always disconnects from the process that accepted it.
+"""
+import threading
+
+
+class RoomRegistry:
+    """Players per room plus a socket id -> (room, player) index"""
+
+    def __init__(self, state, rooms):
+        self.state = state
+        self.rooms = rooms
+        self._lock = threading.Lock()
+        self._by_sid = {}  # sid -> {room_code: player_name}
+
+    def create_room(self, room_code):
+        self.rooms[room_code] = {}
+
+    def players(self, room_code):
+        """(name, socket id) of each player in join order"""
+        return list(self.rooms.get(room_code, {}).items())
+
+    def player_names(self, room_code):
+        return list(self.rooms.get(room_code, {}))
+
+    def join(self, room_code, player_name, sid, max_players):
+        """
+        Add a player, or point an existing player at their new socket.
+        Returns the room's player names, 'full', or None if the room is gone.
+        """
+        def add_player(players):
+            if players is None:
+                return None
+            previous_sid = players.get(player_name)
+            if previous_sid is None and len(players) >= max_players:
+                return 'full'
+            # New player, or a rejoin that moves the player to their new socket
+            players[player_name] = sid
+            return previous_sid, list(players)
+
+        result = self.state.update(self.rooms, room_code, add_player)
+        if result is None or result == 'full':
+            return result
+
+        previous_sid, player_names = result
+        with self._lock:
+            if previous_sid and previous_sid != sid:
+                self._forget(previous_sid, room_code)
+            self._by_sid.setdefault(sid, {})[room_code] = player_name
+        return player_names
+
+    def leave(self, sid):
+        """
+        Remove the socket's player from every room it joined.
+        Returns a list of (room_code, remaining player names).
+        """
+        with self._lock:
+            memberships = self._by_sid.pop(sid, {})
+
+        changed = []
+        for room_code, player_name in memberships.items():
+            def remove_player(players):
+                if players is None:
+                    return None
+                # Only remove the player if they have not rejoined on another socket
+                if players.get(player_name) != sid:
+                    return None
+                del players[player_name]
+                return list(players)
+
+            player_names = self.state.update(self.rooms, room_code, remove_player)
+            if player_names is not None:
+                changed.append((room_code, player_names))
+        return changed
+
+    def remove_room(self, room_code):
+        players = self.rooms.pop(room_code, None) or {}
+        with self._lock:
+            for sid in players.values():
+                self._forget(sid, room_code)
+
+    def _forget(self, sid, room_code):
+        memberships = self._by_sid.get(sid)
+        if memberships is not None:
+            memberships.pop(room_code, None)
+            if not memberships:
+                del self._by_sid[sid]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rooms': len(self.rooms),
+                'indexed_sockets': len(self._by_sid),
+            }
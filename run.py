@@ -1,27 +1,41 @@
 #!/usr/bin/env python3
 """
 Simple startup script for Teleprompt game
+
+    python run.py                                  # development server with the reloader
+    python run.py --production                     # eventlet, no debugger, graceful shutdown
+    python run.py --production --workers 4         # four processes on ports 8000-8003 (needs Redis)
 """
+import argparse
 import os
+import signal
+import subprocess
 import sys
 
-def main():
-    # Check if OpenAI API key is set
-    if not os.getenv('OPENAI_API_KEY'):
-        print("⚠️  Warning: OPENAI_API_KEY not set!")
-        print("   Set it with: export OPENAI_API_KEY='your-api-key-here'")
-        print("   Or create a .env file with: OPENAI_API_KEY=your-api-key-here")
-        print("   Get your API key at: https://platform.openai.com/api-keys")
-        print()
-    
+ASYNC_MODES = ('eventlet', 'gevent', 'threading')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run the Teleprompt game server')
+    parser.add_argument('--production', action='store_true',
+                        help='async server without debugger or reloader, draining games on SIGTERM')
+    parser.add_argument('--async-mode', choices=ASYNC_MODES, default=os.getenv('TELEPROMPT_ASYNC_MODE', 'eventlet'),
+                        help='server for --production (threading is the Werkzeug server, for trying things out)')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_WORKERS', 1)),
+                        help='server processes, one port each from --port up (needs TELEPROMPT_REDIS_URL)')
+    parser.add_argument('--host', default=os.getenv('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', 8000)))
+    parser.add_argument('--max-upload-mb', type=int, help='largest drawing accepted (sets MAX_UPLOAD_MB)')
+    return parser.parse_args()
+
+def run_development(args):
     # Import and run the app
     try:
         from app import app, socketio
         print("🚀 Starting Teleprompt game server...")
-        print("   Open your browser to: http://localhost:8000")
+        print(f"   Open your browser to: http://localhost:{args.port}")
         print("   Press Ctrl+C to stop the server")
         print()
-        socketio.run(app, debug=True, host='0.0.0.0', port=8000)
+        socketio.run(app, debug=True, host=args.host, port=args.port)
     except ImportError as e:
         print(f"❌ Error importing app: {e}")
         print("   Make sure you've installed requirements: pip install -r requirements.txt")
@@ -30,5 +44,77 @@ def main():
         print("\n👋 Server stopped. Thanks for playing!")
         sys.exit(0)
 
+def run_workers(args):
+    """Start one single-process server per port and pass shutdown signals on to them"""
+    if not os.getenv('TELEPROMPT_REDIS_URL'):
+        sys.exit("❌ --workers > 1 needs TELEPROMPT_REDIS_URL, so the processes share rooms and events")
+    children = []
+    for i in range(args.workers):
+        command = [sys.executable, os.path.abspath(__file__), '--production', '--workers', '1',
+                   '--async-mode', args.async_mode, '--host', args.host, '--port', str(args.port + i)]
+        if args.max_upload_mb:
+            command += ['--max-upload-mb', str(args.max_upload_mb)]
+        children.append(subprocess.Popen(command))
+    last_port = args.port + args.workers - 1
+    print(f"🚀 {args.workers} workers on ports {args.port}-{last_port}")
+    # Socket.IO polling needs every request of a client to reach the same process
+    print("   Put a sticky load balancer in front (e.g. nginx upstream with ip_hash), health check /health")
+
+    def forward(signum, frame):
+        for child in children:
+            if child.poll() is None:
+                child.send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    sys.exit(max(child.wait() for child in children))
+
+def run_production(args):
+    if args.workers > 1:
+        return run_workers(args)
+    # Patch blocking I/O (OpenAI calls, downloads, Redis) before anything imports it
+    try:
+        if args.async_mode == 'eventlet':
+            import eventlet
+            eventlet.monkey_patch()
+        elif args.async_mode == 'gevent':
+            from gevent import monkey
+            monkey.patch_all()
+    except ImportError:
+        sys.exit(f"❌ {args.async_mode} is not installed: pip install {args.async_mode}")
+    os.environ['TELEPROMPT_ASYNC_MODE'] = args.async_mode
+    if args.max_upload_mb:
+        os.environ['MAX_UPLOAD_MB'] = str(args.max_upload_mb)
+
+    import app as teleprompt
+    draining = []
+
+    def drain(signum, frame):
+        # Both the terminal and a parent process may send one; drain once
+        if not draining:
+            draining.append(signum)
+            teleprompt.socketio.start_background_task(teleprompt.drain_and_exit)
+
+    signal.signal(signal.SIGTERM, drain)
+    signal.signal(signal.SIGINT, drain)
+    print(f"🚀 Teleprompt ({args.async_mode}) on {args.host}:{args.port}, pid {os.getpid()}", flush=True)
+    teleprompt.socketio.run(teleprompt.app, host=args.host, port=args.port, debug=False, use_reloader=False,
+                            log_output=False, allow_unsafe_werkzeug=args.async_mode == 'threading')
+
+def main():
+    args = parse_args()
+    # Check if OpenAI API key is set
+    if not os.getenv('OPENAI_API_KEY'):
+        print("⚠️  Warning: OPENAI_API_KEY not set!")
+        print("   Set it with: export OPENAI_API_KEY='your-api-key-here'")
+        print("   Or create a .env file with: OPENAI_API_KEY=your-api-key-here")
+        print("   Get your API key at: https://platform.openai.com/api-keys")
+        print()
+
+    if args.production:
+        run_production(args)
+    else:
+        run_development(args)
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,191 @@
+"""
+Game state storage.
+
+app.py keeps its state in four mappings: games, rooms, room_creators and
+room_settings. A state store provides those mappings plus update(), an
+atomic read-modify-write of one entry, and remove_if(), an atomic
+check-and-delete, so the same handlers can run either
+in a single process (InMemoryStateStore) or in several worker processes
+sharing a Redis server (RedisStateStore).
+
+Values fetched from a Redis-backed mapping are copies: code that changes a
+game or room must go through update() or assign the value back. Games are
+game_model.Game objects in both backends; Redis stores their compact list
+form.
+"""
+import json
+import threading
+import weakref
+from collections.abc import MutableMapping
+
+from game_model import Game
+
+
+class InMemoryStateStore:
+    """Plain dicts in this process (the default, single-process mode)"""
+
+    message_queue = None
+
+    def __init__(self):
+        self.games = {}
+        self.rooms = {}
+        self.room_creators = {}  # Track who created each room
+        self.room_settings = {}  # Store settings per room
+        self._locks_guard = threading.Lock()
+        self._locks = weakref.WeakValueDictionary()
+
+    def lock(self, key):
+        """Per-key lock (one per room code)"""
+        with self._locks_guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = threading.RLock()
+                self._locks[key] = lock
+            return lock
+
+    def update(self, mapping, key, fn):
+        """
+        Atomically apply fn(value) to mapping[key] and return its result.
+        fn receives None if the key does not exist and must change value in place.
+        """
+        with self.lock(key):
+            return fn(mapping.get(key))
+
+    def remove_if(self, mapping, key, fn):
+        """Atomically delete mapping[key] if fn(value) is true; returns the value removed, or None"""
+        with self.lock(key):
+            value = mapping.get(key)
+            if value is None or not fn(value):
+                return None
+            del mapping[key]
+            return value
+
+
+class RedisMapping(MutableMapping):
+    """JSON values stored one Redis key per entry, with a set of live keys"""
+
+    def __init__(self, client, prefix, dump=json.dumps, load=json.loads):
+        self.client = client
+        self.prefix = prefix
+        self.index_key = f"{prefix}:keys"
+        self.dump = dump
+        self.load = load
+
+    def key(self, name):
+        return f"{self.prefix}:{name}"
+
+    def __getitem__(self, name):
+        raw = self.client.get(self.key(name))
+        if raw is None:
+            raise KeyError(name)
+        return self.load(raw)
+
+    def __setitem__(self, name, value):
+        pipe = self.client.pipeline()
+        pipe.set(self.key(name), self.dump(value))
+        pipe.sadd(self.index_key, name)
+        pipe.execute()
+
+    def __delitem__(self, name):
+        pipe = self.client.pipeline()
+        pipe.delete(self.key(name))
+        pipe.srem(self.index_key, name)
+        deleted, _ = pipe.execute()
+        if not deleted:
+            raise KeyError(name)
+
+    def __contains__(self, name):
+        return bool(self.client.exists(self.key(name)))
+
+    def __iter__(self):
+        for name in self.client.smembers(self.index_key):
+            yield name.decode() if isinstance(name, bytes) else name
+
+    def __len__(self):
+        return self.client.scard(self.index_key)
+
+
+class RedisStateStore:
+    """State shared by several server processes through Redis"""
+
+    def __init__(self, url=None, client=None, prefix='teleprompt'):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("TELEPROMPT_REDIS_URL is set but the 'redis' package is not installed")
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        # Flask-SocketIO fans emits out to every process through the same server
+        self.message_queue = url
+        self.games = RedisMapping(
+            client, f"{prefix}:game",
+            dump=lambda game: json.dumps(game.to_state()),
+            load=lambda raw: Game.from_state(json.loads(raw))
+        )
+        self.rooms = RedisMapping(client, f"{prefix}:room")
+        self.room_creators = RedisMapping(client, f"{prefix}:creator")
+        self.room_settings = RedisMapping(client, f"{prefix}:settings")
+
+    def lock(self, key, timeout=30):
+        """Lock shared by all processes (one per room code)"""
+        return self.client.lock(f"{self.prefix}:lock:{key}", timeout=timeout)
+
+    def update(self, mapping, key, fn, max_retries=50):
+        """
+        Atomically apply fn(value) to mapping[key] and return its result.
+        Uses WATCH/MULTI, so fn may run more than once and must only touch value.
+        """
+        from redis.exceptions import WatchError
+
+        redis_key = mapping.key(key)
+        with self.client.pipeline() as pipe:
+            for _ in range(max_retries):
+                try:
+                    pipe.watch(redis_key)
+                    raw = pipe.get(redis_key)
+                    value = mapping.load(raw) if raw is not None else None
+                    result = fn(value)
+                    pipe.multi()
+                    if value is not None:
+                        pipe.set(redis_key, mapping.dump(value))
+                    pipe.execute()
+                    return result
+                except WatchError:
+                    continue
+        raise RuntimeError(f"Too much contention updating {redis_key}")
+
+    def remove_if(self, mapping, key, fn, max_retries=50):
+        """
+        Atomically delete mapping[key] if fn(value) is true; returns the value
+        removed, or None. Uses WATCH/MULTI like update(), so fn may run more
+        than once and must not have side effects.
+        """
+        from redis.exceptions import WatchError
+
+        redis_key = mapping.key(key)
+        with self.client.pipeline() as pipe:
+            for _ in range(max_retries):
+                try:
+                    pipe.watch(redis_key)
+                    raw = pipe.get(redis_key)
+                    value = mapping.load(raw) if raw is not None else None
+                    if value is None or not fn(value):
+                        pipe.unwatch()
+                        return None
+                    pipe.multi()
+                    pipe.delete(redis_key)
+                    pipe.srem(mapping.index_key, key)
+                    pipe.execute()
+                    return value
+                except WatchError:
+                    continue
+        raise RuntimeError(f"Too much contention removing {redis_key}")
+
+
+def create_state_store(redis_url=None):
+    """Pick the backend from configuration"""
+    if redis_url:
+        return RedisStateStore(redis_url)
+    return InMemoryStateStore()
@@ -0,0 +1,206 @@
+"""
+Storage manager for generated images and canvas drawings.
+
+Files written to the managed directories are reference-counted by the game
+that shows them. When a game's results expire its files are released, and
+a background sweep deletes released and orphaned files and keeps the total
+size under a byte budget, evicting the oldest files first.
+"""
+import os
+import threading
+import time
+
+MANAGED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp', '.json')  # .json: vector drawings
+
+
+class StorageManager:
+    """Tracks which game owns which file and deletes files nobody needs"""
+
+    def __init__(self, directories, max_bytes, orphan_ttl=3600, sweep_interval=60,
+                 rescan_every=60, spawn=None, sleep=None, on_delete=None):
+        self.directories = [os.path.normpath(d) for d in directories]
+        self.max_bytes = max_bytes
+        self.orphan_ttl = orphan_ttl  # unowned files older than this are deleted
+        self.sweep_interval = sweep_interval
+        self.rescan_every = rescan_every  # full directory rescan every N sweeps
+        self._spawn = spawn
+        self._sleep = sleep or time.sleep
+        self.on_delete = on_delete  # called with each path the sweep deletes
+        self._lock = threading.Lock()
+        self._files = {}  # path -> [bytes, mtime]
+        self._refs = {}  # path -> number of owners
+        self._owners = {}  # owner -> {'paths': set, 'expires_at': time or None}
+        self.total_bytes = 0
+        self.deleted_files = 0
+        self.deleted_bytes = 0
+        self._started = False
+        self.scan()
+
+    def _is_managed(self, path):
+        return os.path.dirname(os.path.normpath(path)) in self.directories
+
+    def _add_file(self, path):
+        if path in self._files:
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        self._files[path] = [st.st_size, st.st_mtime]
+        self.total_bytes += st.st_size
+
+    def scan(self):
+        """Rebuild the file index from disk"""
+        files = {}
+        for directory in self.directories:
+            os.makedirs(directory, exist_ok=True)
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.lower().endswith(MANAGED_EXTENSIONS):
+                        st = entry.stat()
+                        files[os.path.join(directory, entry.name)] = [st.st_size, st.st_mtime]
+        with self._lock:
+            self._files = files
+            self.total_bytes = sum(size for size, _ in files.values())
+
+    def note_file(self, path):
+        """Index a file written outside of a game (e.g. the canvas page)"""
+        path = os.path.normpath(path)
+        if self._is_managed(path):
+            with self._lock:
+                self._add_file(path)
+
+    def track(self, owner, path):
+        """Record that owner (a game id) shows the file at path"""
+        path = os.path.normpath(path)
+        if not self._is_managed(path):
+            return
+        with self._lock:
+            self._add_file(path)
+            record = self._owners.setdefault(owner, {'paths': set(), 'expires_at': None})
+            if path not in record['paths']:
+                record['paths'].add(path)
+                self._refs[path] = self._refs.get(path, 0) + 1
+
+    def expire_owner(self, owner, expires_at):
+        """Release owner's files once expires_at has passed"""
+        with self._lock:
+            if owner in self._owners:
+                self._owners[owner]['expires_at'] = expires_at
+
+    def release(self, owner):
+        """Drop owner's references; its files become eligible for deletion"""
+        with self._lock:
+            self._release_locked(owner)
+
+    def _release_locked(self, owner):
+        record = self._owners.pop(owner, None)
+        if record is None:
+            return
+        for path in record['paths']:
+            self._refs[path] -= 1
+            if self._refs[path] == 0:
+                del self._refs[path]
+                # Released files go first on the next sweep
+                if path in self._files:
+                    self._files[path][1] = 0
+
+    def _pick_victims(self, now):
+        """Choose files to delete; called with the lock held"""
+        victims = []
+        # Games whose results have expired
+        for owner in [o for o, r in self._owners.items() if r['expires_at'] and r['expires_at'] <= now]:
+            self._release_locked(owner)
+
+        # Unreferenced files, oldest first
+        unowned = sorted((mtime, path) for path, (_, mtime) in self._files.items() if path not in self._refs)
+        remaining = self.total_bytes
+        for mtime, path in unowned:
+            if now - mtime > self.orphan_ttl or remaining > self.max_bytes:
+                victims.append(path)
+                remaining -= self._files[path][0]
+
+        # Still over budget: take files from finished games, oldest first
+        if remaining > self.max_bytes:
+            finished = sorted(
+                (self._files[path][1], path)
+                for record in self._owners.values() if record['expires_at']
+                for path in record['paths'] if path in self._files
+            )
+            for mtime, path in finished:
+                if remaining <= self.max_bytes:
+                    break
+                victims.append(path)
+                remaining -= self._files[path][0]
+        return victims
+
+    def sweep(self, now=None, batch_size=50):
+        """Delete expired, orphaned and over-budget files; returns bytes freed"""
+        now = now or time.time()
+        with self._lock:
+            victims = self._pick_victims(now)
+
+        freed = 0
+        deleted = 0
+        for i, path in enumerate(victims):
+            with self._lock:
+                entry = self._files.pop(path, None)
+                if entry is None:
+                    continue
+                self.total_bytes -= entry[0]
+                if self._refs.pop(path, None):
+                    for record in self._owners.values():
+                        record['paths'].discard(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Error deleting {path}: {e}")
+                continue
+            if self.on_delete is not None:
+                self.on_delete(path)
+            freed += entry[0]
+            deleted += 1
+            # Yield between batches so handlers keep running
+            if (i + 1) % batch_size == 0:
+                self._sleep(0)
+
+        with self._lock:
+            self.deleted_files += deleted
+            self.deleted_bytes += freed
+        if deleted:
+            print(f"Storage sweep removed {deleted} files ({freed // 1024} KB)")
+        return freed
+
+    def start(self):
+        """Start the background sweeper (once)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._spawn(self._sweep_loop)
+
+    def _sweep_loop(self):
+        sweeps = 0
+        while True:
+            self._sleep(self.sweep_interval)
+            sweeps += 1
+            try:
+                if sweeps % self.rescan_every == 0:
+                    self.scan()
+                self.sweep()
+            except Exception as e:
+                print(f"Error in storage sweep: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': len(self._files),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'referenced_files': len(self._refs),
+                'owners': len(self._owners),
+                'deleted_files': self.deleted_files,
+                'deleted_bytes': self.deleted_bytes,
+            }
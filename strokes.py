@@ -0,0 +1,163 @@
+"""
+Vector drawings for inverted mode.
+
+The drawing canvas sends the strokes it recorded instead of a PNG:
+
+    {"v": 1, "width": 400, "height": 300,
+     "strokes": [{"c": "#000000", "w": 5, "p": [x0, y0, dx1, dy1, ...]}, ...]}
+
+Points are integer canvas pixels, every point after the first stored as
+the offset from the one before, and "c" is null for eraser strokes. A
+rough line drawing is a few kilobytes in this form, and that is what gets
+stored and replayed on the results page. It is only rasterized, with
+Pillow, when the vision model needs pixels; vision_prep picks the crop and
+the size.
+"""
+import io
+import json
+import os
+import re
+import uuid
+
+from PIL import Image, ImageDraw
+
+from uploads import UploadError
+
+FORMAT_VERSION = 1
+STROKES_SUFFIX = '.strokes.json'
+MAX_CANVAS_SIDE = 4096
+MAX_STROKES = 2000
+MAX_POINTS = 50000  # over all strokes
+MAX_STROKE_WIDTH = 200
+# Vision models scale detailed images so the short side is 768 px
+VISION_SHORT_SIDE = 768
+BACKGROUND = (255, 255, 255)
+
+COLOR_RE = re.compile(r'^#[0-9a-fA-F]{6}$')
+
+
+class StrokeError(UploadError):
+    """Raised when a stroke drawing is malformed or over the limits"""
+
+
+def _int(value, what):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise StrokeError(f"{what} must be a number")
+    return int(round(value))
+
+
+def parse_strokes(payload, max_strokes=MAX_STROKES, max_points=MAX_POINTS):
+    """Validate a drawing from the client; returns it in canonical form"""
+    if not isinstance(payload, dict) or payload.get('v', FORMAT_VERSION) != FORMAT_VERSION:
+        raise StrokeError("Unsupported drawing format")
+    width = _int(payload.get('width'), 'width')
+    height = _int(payload.get('height'), 'height')
+    if not (0 < width <= MAX_CANVAS_SIDE and 0 < height <= MAX_CANVAS_SIDE):
+        raise StrokeError(f"Canvas must be at most {MAX_CANVAS_SIDE} px a side")
+    strokes = payload.get('strokes')
+    if not isinstance(strokes, list) or len(strokes) > max_strokes:
+        raise StrokeError(f"A drawing has at most {max_strokes} strokes")
+
+    points = 0
+    canonical = []
+    for stroke in strokes:
+        if not isinstance(stroke, dict):
+            raise StrokeError("Stroke must be an object")
+        color = stroke.get('c')
+        if color is not None and not (isinstance(color, str) and COLOR_RE.match(color)):
+            raise StrokeError("Stroke colour must be #rrggbb or null")
+        stroke_width = _int(stroke.get('w'), 'stroke width')
+        if not 0 < stroke_width <= MAX_STROKE_WIDTH:
+            raise StrokeError(f"Stroke width must be 1-{MAX_STROKE_WIDTH}")
+        deltas = stroke.get('p')
+        if not isinstance(deltas, list) or not deltas or len(deltas) % 2:
+            raise StrokeError("Stroke points must be x, y pairs")
+        points += len(deltas) // 2
+        if points > max_points:
+            raise StrokeError(f"A drawing has at most {max_points} points")
+        canonical.append({'c': color, 'w': stroke_width, 'p': [_int(v, 'point') for v in deltas]})
+
+    return {'v': FORMAT_VERSION, 'width': width, 'height': height, 'strokes': canonical}
+
+
+def stroke_points(deltas):
+    """Absolute (x, y) points from a delta-encoded list"""
+    x = y = 0
+    points = []
+    for i in range(0, len(deltas), 2):
+        x += deltas[i]
+        y += deltas[i + 1]
+        points.append((x, y))
+    return points
+
+
+def save_strokes(drawing, save_dir, stem):
+    """Write a parsed drawing to save_dir/<stem>.strokes.json; returns the path"""
+    os.makedirs(save_dir, exist_ok=True)
+    temp_path = os.path.join(save_dir, f".{uuid.uuid4()}.part")
+    path = os.path.join(save_dir, stem + STROKES_SUFFIX)
+    try:
+        with open(temp_path, 'w') as f:
+            json.dump(drawing, f, separators=(',', ':'))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return path
+
+
+def load_strokes(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def is_strokes_path(path):
+    return bool(path) and path.endswith(STROKES_SUFFIX)
+
+
+def bounds(drawing):
+    """(left, top, right, bottom) of the ink, strokes' widths included; None for an empty drawing"""
+    box = None
+    for stroke in drawing['strokes']:
+        if stroke['c'] is None:
+            continue  # eraser strokes add no ink
+        half = stroke['w'] / 2
+        for x, y in stroke_points(stroke['p']):
+            if box is None:
+                box = [x - half, y - half, x + half, y + half]
+            else:
+                box[0], box[1] = min(box[0], x - half), min(box[1], y - half)
+                box[2], box[3] = max(box[2], x + half), max(box[3], y + half)
+    if box is None:
+        return None
+    # Ink beyond the canvas edge was never visible
+    return (max(box[0], 0), max(box[1], 0), min(box[2], drawing['width']), min(box[3], drawing['height']))
+
+
+def render(drawing, scale, box=None):
+    """Draw the part of the drawing inside box (canvas pixels, default all of it) at scale"""
+    left, top, right, bottom = box or (0, 0, drawing['width'], drawing['height'])
+    size = (max(1, round((right - left) * scale)), max(1, round((bottom - top) * scale)))
+    image = Image.new('RGB', size, BACKGROUND)
+    draw = ImageDraw.Draw(image)
+
+    for stroke in drawing['strokes']:
+        color = stroke['c'] or BACKGROUND  # the eraser paints the background back
+        width = max(1, round(stroke['w'] * scale))
+        points = [((x - left) * scale, (y - top) * scale) for x, y in stroke_points(stroke['p'])]
+        if len(points) > 1:
+            draw.line(points, fill=color, width=width, joint='curve')
+        # Round caps, like lineCap = 'round' on the canvas (and a dot for single taps)
+        radius = width / 2
+        for x, y in {points[0], points[-1]}:
+            draw.ellipse((x - radius, y - radius, x + radius, y + radius), fill=color)
+    return image
+
+
+def rasterize(drawing, short_side=VISION_SHORT_SIDE, image_format='PNG'):
+    """Render the whole canvas so its short side is short_side px; returns the encoded bytes"""
+    image = render(drawing, short_side / min(drawing['width'], drawing['height']))
+    out = io.BytesIO()
+    image.save(out, format=image_format)
+    return out.getvalue()
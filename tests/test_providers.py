@@ -0,0 +1,103 @@
+"""
+CircuitBreaker with a fake clock: it opens on a burst of errors, lets one
+probe through after the cooldown, and closes again once a probe succeeds.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from providers import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, Provider, ProviderUnavailable  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker(error_threshold=0.5, min_calls=4, window=30.0, cooldown=10.0, clock=clock)
+
+
+def trip(breaker):
+    for ok in (True, True, False, False):
+        breaker.record(ok)
+
+
+def test_open_half_open_closed(clock, breaker):
+    breaker.record(False)
+    breaker.record(False)
+    # Too few outcomes to judge yet
+    assert breaker.state == CLOSED
+    breaker.record(True)
+    breaker.record(True)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+    # Still cooling down
+    clock.now += 9.9
+    assert not breaker.allow()
+
+    # One probe goes out; everyone else waits on it
+    clock.now += 0.1
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+    # The probe fails: open again for another cooldown
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert breaker.opened == 2
+    clock.now += 5.0
+    assert not breaker.allow()
+
+    # The next probe succeeds and the breaker closes with a clean slate
+    clock.now += 5.0
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == CLOSED
+
+
+def test_old_errors_leave_the_window(clock, breaker):
+    breaker.record(False)
+    breaker.record(False)
+    clock.now += 31.0
+    breaker.record(True)
+    breaker.record(True)
+    assert breaker.state == CLOSED
+
+
+def test_released_probe_lets_another_through(clock, breaker):
+    trip(breaker)
+    clock.now += 10.0
+    assert breaker.allow()
+    # That probe was held back before reaching the provider
+    breaker.release()
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_open_breaker_short_circuits_calls(clock, breaker):
+    provider = Provider('openai', breaker=breaker, spawn=lambda fn: fn())
+    trip(breaker)
+    calls = []
+
+    with pytest.raises(ProviderUnavailable):
+        provider.call(lambda timeout: calls.append(timeout), clock.now + 5)
+    assert calls == []
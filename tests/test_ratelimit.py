@@ -0,0 +1,134 @@
+"""
+RateLimitScheduler with a fake clock: under contention requests go out by
+priority and rooms take turns within one, and a 429's retry-after pauses
+the buckets the request drew on.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from ratelimit import (  # noqa: E402
+    ACTIVE_TURN, BACKGROUND, VISION, QueueTimeout, RateLimitScheduler, TokenBucket, retry_after,
+)
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+    def __init__(self, headers):
+        super().__init__('rate limited')
+        self.response = type('Response', (), {'headers': headers})()
+
+
+def wait_for(condition, timeout=5.0):
+    give_up = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < give_up, 'timed out'
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_priority_order_under_contention(clock):
+    # Ten a second, one at a time: a blocked waiter looks again every 0.1 s of real time
+    bucket = TokenBucket('images', per_minute=600, burst=1, clock=clock)
+    scheduler = RateLimitScheduler([bucket], clock=clock)
+    scheduler.acquire({'images': 1}, ACTIVE_TURN)  # empty the bucket
+    granted = []
+
+    def request(label, priority, room_code):
+        scheduler.acquire({'images': 1}, priority, room_code)
+        granted.append(label)
+
+    # Queued lowest priority first, one at a time so the order is known
+    arrivals = [
+        ('refill', BACKGROUND, None),
+        ('describe', VISION, 'ROOM2'),
+        ('turn-a1', ACTIVE_TURN, 'ROOMA'),
+        ('turn-a2', ACTIVE_TURN, 'ROOMA'),
+        ('turn-b', ACTIVE_TURN, 'ROOMB'),
+    ]
+    threads = []
+    for i, arrival in enumerate(arrivals, 1):
+        thread = threading.Thread(target=request, args=arrival, daemon=True)
+        thread.start()
+        threads.append(thread)
+        wait_for(lambda: sum(scheduler.stats()['waiting'].values()) == i)
+
+    # Let one token in at a time
+    for i in range(1, len(arrivals) + 1):
+        clock.now += 0.1
+        wait_for(lambda: len(granted) == i)
+    for thread in threads:
+        thread.join(timeout=5)
+
+    # Active turns first, ROOMB going before ROOMA's second; background last
+    assert granted == ['turn-a1', 'turn-b', 'turn-a2', 'describe', 'refill']
+    assert scheduler.stats()['admitted'] == {'active_turn': 4, 'vision': 1, 'background': 1}
+
+
+def test_background_leaves_a_reserve_for_turns(clock):
+    bucket = TokenBucket('images', per_minute=60, burst=10, clock=clock)
+    scheduler = RateLimitScheduler([bucket], clock=clock)
+    scheduler.acquire({'images': 6}, ACTIVE_TURN)
+
+    # Four left: background may not take any of the reserved half, a turn may
+    with pytest.raises(QueueTimeout):
+        scheduler.acquire({'images': 1}, BACKGROUND, deadline=clock.now)
+    assert scheduler.acquire({'images': 4}, ACTIVE_TURN, deadline=clock.now) == 0.0
+    assert scheduler.stats()['timeouts']['background'] == 1
+
+
+def test_retry_after_pauses_the_bucket(clock):
+    images = TokenBucket('images', per_minute=60, burst=10, clock=clock)
+    vision = TokenBucket('vision_requests', per_minute=60, burst=10, clock=clock)
+    scheduler = RateLimitScheduler([images, vision], clock=clock)
+
+    with pytest.raises(RateLimited):
+        with scheduler.admit({'images': 1}, ACTIVE_TURN, 'ROOM1', None):
+            raise RateLimited({'retry-after': '2'})
+
+    assert scheduler.busy()
+    assert scheduler.stats()['rate_limited'] == 1
+    # Only the bucket the request drew on backs off, to half its rate
+    assert images.wait_time(1, clock.now) == pytest.approx(2.0)
+    assert images.rate == pytest.approx(0.5)
+    assert vision.wait_time(1, clock.now) == 0.0
+    with pytest.raises(QueueTimeout):
+        scheduler.acquire({'images': 1}, ACTIVE_TURN, deadline=clock.now)
+
+    # Once the pause is over, what refilled at the lower rate goes out
+    clock.now += 2.0
+    assert not scheduler.busy()
+    assert scheduler.acquire({'images': 1}, ACTIVE_TURN, deadline=clock.now) == 0.0
+
+    # Each success wins back a little of the configured rate
+    with scheduler.admit({'images': 0}, ACTIVE_TURN, 'ROOM1', None):
+        pass
+    assert images.rate == pytest.approx(0.55)
+
+
+def test_retry_after_reads_the_headers():
+    assert retry_after(RateLimited({'retry-after-ms': '1500'})) == 1.5
+    assert retry_after(RateLimited({'retry-after': '3'})) == 3.0
+    assert retry_after(RateLimited({'retry-after': 'Wed, 21 Oct 2026 07:28:00 GMT'})) == 1.0
+    assert retry_after(RateLimited({})) == 1.0
+    assert retry_after(ValueError('not a rate limit')) is None
@@ -0,0 +1,158 @@
+"""
+RedisStateStore against fakeredis: games survive the round trip, update()
+and remove_if() retry when another process writes first, and lock() is
+shared.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('redis')
+
+from game_model import Game  # noqa: E402
+from state import RedisStateStore  # noqa: E402
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def store(server):
+    return RedisStateStore(client=fakeredis.FakeRedis(server=server))
+
+
+def make_game():
+    game = Game('g1', 'classic', [('alice', 'sid-a'), ('bob', 'sid-b')], now=100.0,
+                starting_image='static/img/starting-img.png')
+    game.add_prompt('alice', 'a cat on the moon')
+    game.add_image('alice', 'static/generated/cat.png')
+    return game
+
+
+def test_game_round_trip(store):
+    game = make_game()
+    store.games['ROOM1'] = game
+
+    loaded = store.games['ROOM1']
+    assert loaded.to_state() == game.to_state()
+    assert loaded.to_dict() == game.to_dict()
+    assert loaded.players[0] == ('alice', 'sid-a')
+    assert 'ROOM1' in store.games
+    assert list(store.games) == ['ROOM1']
+
+    del store.games['ROOM1']
+    assert 'ROOM1' not in store.games
+    assert len(store.games) == 0
+
+
+def test_update_changes_the_stored_game(store):
+    store.games['ROOM1'] = make_game()
+
+    def add_prompt(game):
+        game.add_prompt('bob', 'a dog')
+        return game.current_round
+
+    assert store.update(store.games, 'ROOM1', add_prompt) == 0
+    assert store.games['ROOM1'].prompts[-1] == ('bob', 'a dog', 0)
+
+
+def test_update_of_missing_key_writes_nothing(store):
+    assert store.update(store.games, 'NOPE', lambda game: game) is None
+    assert 'NOPE' not in store.games
+
+
+def test_update_retries_after_a_conflicting_write(server, store):
+    store.games['ROOM1'] = make_game()
+    # A second process sharing the server
+    other = RedisStateStore(client=fakeredis.FakeRedis(server=server))
+    calls = []
+
+    def add_prompt(game):
+        calls.append(len(game.prompts))
+        if len(calls) == 1:
+            # The other process writes between our read and our write
+            other.update(other.games, 'ROOM1', lambda g: g.add_prompt('carol', 'a hat'))
+        game.add_prompt('bob', 'a dog')
+
+    store.update(store.games, 'ROOM1', add_prompt)
+
+    # The first attempt was thrown away and the second saw carol's prompt
+    assert calls == [1, 2]
+    texts = [text for _, text, _ in store.games['ROOM1'].prompts]
+    assert texts == ['a cat on the moon', 'a hat', 'a dog']
+
+
+def test_update_gives_up_under_constant_contention(server, store):
+    store.games['ROOM1'] = make_game()
+    other = RedisStateStore(client=fakeredis.FakeRedis(server=server))
+
+    def always_conflict(game):
+        other.update(other.games, 'ROOM1', lambda g: g.add_prompt('carol', 'again'))
+
+    with pytest.raises(RuntimeError, match='contention'):
+        store.update(store.games, 'ROOM1', always_conflict, max_retries=3)
+
+
+def test_remove_if_deletes_only_what_matches(store):
+    store.games['ROOM1'] = make_game()
+
+    assert store.remove_if(store.games, 'ROOM1', lambda game: game.id == 'other') is None
+    assert 'ROOM1' in store.games
+    removed = store.remove_if(store.games, 'ROOM1', lambda game: game.id == 'g1')
+    assert removed.id == 'g1'
+    assert 'ROOM1' not in store.games
+    assert list(store.games) == []
+    assert store.remove_if(store.games, 'ROOM1', lambda game: True) is None
+
+
+def test_remove_if_rechecks_after_a_conflicting_write(server, store):
+    store.games['ROOM1'] = make_game()
+    other = RedisStateStore(client=fakeredis.FakeRedis(server=server))
+    seen = store.games['ROOM1'].to_state()
+    calls = []
+
+    def unchanged(game):
+        calls.append(len(game.prompts))
+        if len(calls) == 1:
+            # A turn moves on in another process after the check
+            other.update(other.games, 'ROOM1', lambda g: g.add_prompt('bob', 'a dog'))
+        return game.to_state() == seen
+
+    assert store.remove_if(store.games, 'ROOM1', unchanged) is None
+    # The second look saw bob's prompt and left the game alone
+    assert calls == [1, 2]
+    assert store.games['ROOM1'].prompts[-1] == ('bob', 'a dog', 0)
+
+
+def lua_available(client):
+    try:
+        client.eval('return 1', 0)
+    except Exception:
+        return False
+    return True
+
+
+def test_lock_is_shared_between_processes(server, store):
+    if not lua_available(store.client):
+        pytest.skip('this fakeredis has no Lua support (pip install lupa); redis-py locks need it')
+    other = RedisStateStore(client=fakeredis.FakeRedis(server=server))
+
+    lock = store.lock('ROOM1')
+    assert lock.acquire(blocking=False)
+    try:
+        assert not other.lock('ROOM1').acquire(blocking=False)
+        # Other rooms are not held up
+        room2 = other.lock('ROOM2')
+        assert room2.acquire(blocking=False)
+        room2.release()
+    finally:
+        lock.release()
+    assert other.lock('ROOM1').acquire(blocking=False)
@@ -0,0 +1,216 @@
+"""
+Per-turn tracing.
+
+Every turn (a game id and round) gets a trace, and the stages of the turn
+record spans in it: start, duration, payload size and outcome. Finished
+spans go into an in-process ring buffer, so the slow stage of a room's turn
+can be found from /traces without a profiler attached.
+
+    trace = tracer.trace_for(room_code, game.id, turn_round)
+    with trace.span('generate_image') as span:
+        ...
+        span.size = os.path.getsize(image_path)
+
+Inside a span, tracing.span(name) records a child in the same trace without
+the trace being passed around. The current span is a context variable, so
+it does not follow work handed to another thread: enter trace.span there.
+Turns that are not sampled get NO_TRACE, whose spans record nothing.
+"""
+import contextvars
+import itertools
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+OK = 'ok'
+ERROR = 'error'
+
+_current = contextvars.ContextVar('current_span', default=None)
+_span_ids = itertools.count(1)
+
+
+class Span:
+    __slots__ = ('trace', 'id', 'parent_id', 'name', 'started', 'duration', 'size', 'outcome', 'attrs')
+
+    def __init__(self, trace, name, parent_id=None, size=None, attrs=None):
+        self.trace = trace
+        self.id = next(_span_ids) if trace is not None else 0
+        self.parent_id = parent_id
+        self.name = name
+        self.started = time.time()
+        self.duration = None
+        self.size = size  # bytes of the payload handled, where that means something
+        self.outcome = OK  # or ERROR, or what the stage settled for ('cache_hit', 'fallback', ...)
+        self.attrs = attrs or {}
+
+    @property
+    def recording(self):
+        return self.trace is not None
+
+    def to_dict(self):
+        span = {
+            'id': self.id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'started': self.started,
+            'duration_ms': round(self.duration * 1000, 3),
+            'size': self.size,
+            'outcome': self.outcome,
+        }
+        span.update(self.attrs)
+        return span
+
+
+# Handed out by spans that are not recorded; setting its fields does nothing useful
+NO_SPAN = Span(None, None)
+
+
+class Trace:
+    __slots__ = ('tracer', 'trace_id', 'room_code', 'game_id', 'turn_round')
+
+    def __init__(self, tracer, room_code, game_id, turn_round):
+        self.tracer = tracer
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.room_code = room_code
+        self.game_id = game_id
+        self.turn_round = turn_round
+
+    @contextmanager
+    def span(self, name, size=None, **attrs):
+        """Record the with block as a span of this trace, under the current span if it is one of ours"""
+        parent = _current.get()
+        span = Span(self, name, parent.id if parent is not None and parent.trace is self else None, size, attrs)
+        token = _current.set(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span.outcome = ERROR
+            span.attrs['error'] = type(e).__name__
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            _current.reset(token)
+            self.tracer.record(span)
+
+
+class _NoTrace:
+    """Stands in for the trace of a turn that was not sampled"""
+    trace_id = None
+
+    @contextmanager
+    def span(self, name, size=None, **attrs):
+        yield NO_SPAN
+
+
+NO_TRACE = _NoTrace()
+
+
+@contextmanager
+def span(name, size=None, **attrs):
+    """A child span of the current span, or nothing when no trace is being recorded here"""
+    parent = _current.get()
+    if parent is None:
+        yield NO_SPAN
+        return
+    with parent.trace.span(name, size, **attrs) as child:
+        yield child
+
+
+def payload_size(value):
+    """Rough size in bytes of an event payload: its strings and bytes, numbers at 8 bytes"""
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(payload_size(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(payload_size(item) for item in value)
+    return 8 if isinstance(value, (int, float)) else 0
+
+
+class Tracer:
+    """Samples turns and keeps their most recent spans in a ring buffer"""
+
+    def __init__(self, capacity=5000, sample_rate=1.0, max_traces=1000):
+        self.capacity = capacity
+        self.sample_rate = sample_rate
+        self.max_traces = max_traces
+        self._spans = deque(maxlen=capacity)  # appends are atomic, oldest spans fall off
+        self._lock = threading.Lock()
+        self._traces = OrderedDict()  # (game_id, turn_round) -> Trace or NO_TRACE, newest last
+        self._turns = {}  # room_code -> (game_id, turn_round) of the turn being played in this process
+        self.recorded = 0
+
+    def trace_for(self, room_code, game_id, turn_round):
+        """The trace of a turn; the same one every time it is asked for, sampled or not"""
+        key = (game_id, turn_round)
+        with self._lock:
+            trace = self._traces.get(key)
+            if trace is None:
+                sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+                trace = Trace(self, room_code, game_id, turn_round) if sampled else NO_TRACE
+                self._traces[key] = trace
+                if len(self._traces) > self.max_traces:
+                    self._traces.popitem(last=False)
+            return trace
+
+    def turn_started(self, room_code, game_id, turn_round):
+        """Note the room's current turn, so events for the room land in its trace"""
+        self._turns[room_code] = (game_id, turn_round)
+
+    def room_ended(self, room_code):
+        self._turns.pop(room_code, None)
+
+    def room_trace(self, room_code):
+        """The trace of the turn the room is playing, or NO_TRACE between games"""
+        turn = self._turns.get(room_code)
+        return self.trace_for(room_code, *turn) if turn is not None else NO_TRACE
+
+    def record(self, span):
+        self._spans.append(span)
+        self.recorded += 1
+
+    def export(self, room_code=None, limit=50):
+        """The most recent traces (optionally of one room), newest first, with their spans"""
+        by_trace = OrderedDict()
+        for span in reversed(list(self._spans)):
+            trace = span.trace
+            if room_code is not None and trace.room_code != room_code:
+                continue
+            if trace.trace_id not in by_trace:
+                if len(by_trace) >= limit:
+                    continue
+                by_trace[trace.trace_id] = (trace, [])
+            by_trace[trace.trace_id][1].append(span)
+
+        traces = []
+        for trace, spans in by_trace.values():
+            spans.sort(key=lambda span: span.started)
+            started = spans[0].started
+            ended = max(span.started + span.duration for span in spans)
+            # The slow stage is the longest span that did its own work rather than wait on children
+            parents = {span.parent_id for span in spans}
+            slowest = max((span for span in spans if span.id not in parents), key=lambda span: span.duration)
+            traces.append({
+                'trace_id': trace.trace_id,
+                'room': trace.room_code,
+                'game_id': trace.game_id,
+                'round': trace.turn_round,
+                'started': started,
+                'duration_ms': round((ended - started) * 1000, 3),
+                'slowest': slowest.name,
+                'spans': [span.to_dict() for span in spans],
+            })
+        return traces
+
+    def stats(self):
+        return {
+            'sample_rate': self.sample_rate,
+            'spans': len(self._spans),
+            'capacity': self.capacity,
+            'recorded': self.recorded,
+            'rooms': len(self._turns),
+        }
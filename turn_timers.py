@@ -0,0 +1,92 @@
+"""
+Server-side turn deadlines.
+
+Every running turn has one deadline in a single heap shared by all rooms,
+and one background task pops whatever has expired. Rescheduling or
+cancelling a room only replaces its entry in a dict; the old heap entry is
+skipped when it surfaces (lazy deletion), so every operation is O(log n)
+and the heap is compacted when stale entries pile up.
+"""
+import heapq
+import itertools
+import threading
+import time
+
+
+class TurnTimers:
+    """One heap of (deadline, room, round) for every room on this server"""
+
+    def __init__(self, on_expire, resolution=0.25, spawn=None, sleep=None, clock=None):
+        self.on_expire = on_expire  # called as on_expire(room_code, turn_round)
+        self.resolution = resolution  # seconds between checks
+        self._spawn = spawn
+        self._sleep = sleep or time.sleep
+        self._clock = clock or time.time
+        self._lock = threading.Lock()
+        self._heap = []  # (deadline, seq, room_code, turn_round)
+        self._deadlines = {}  # room_code -> (turn_round, deadline) of the live entry
+        self._seq = itertools.count()
+        self.expired = 0
+        self._started = False
+
+    def schedule(self, room_code, turn_round, deadline):
+        """Set the room's deadline for turn_round, replacing any earlier one"""
+        with self._lock:
+            if self._deadlines.get(room_code) == (turn_round, deadline):
+                return
+            self._deadlines[room_code] = (turn_round, deadline)
+            heapq.heappush(self._heap, (deadline, next(self._seq), room_code, turn_round))
+            if len(self._heap) > 2 * len(self._deadlines) + 64:
+                self._compact()
+
+    def cancel(self, room_code, turn_round=None):
+        """Drop the room's deadline (only if it is for turn_round, when given)"""
+        with self._lock:
+            current = self._deadlines.get(room_code)
+            if current is not None and (turn_round is None or current[0] == turn_round):
+                del self._deadlines[room_code]
+
+    def _compact(self):
+        self._heap = [
+            (deadline, next(self._seq), room_code, turn_round)
+            for room_code, (turn_round, deadline) in self._deadlines.items()
+        ]
+        heapq.heapify(self._heap)
+
+    def pop_expired(self, now=None):
+        """Remove and return (room_code, turn_round) for every deadline that has passed"""
+        now = self._clock() if now is None else now
+        expired = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, _, room_code, turn_round = heapq.heappop(self._heap)
+                if self._deadlines.get(room_code) == (turn_round, deadline):
+                    del self._deadlines[room_code]
+                    expired.append((room_code, turn_round))
+            self.expired += len(expired)
+        return expired
+
+    def start(self):
+        """Start the scheduler task (once)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._spawn(self._run)
+
+    def _run(self):
+        while True:
+            self._sleep(self.resolution)
+            for room_code, turn_round in self.pop_expired():
+                try:
+                    self.on_expire(room_code, turn_round)
+                except Exception as e:
+                    print(f"Error expiring turn {turn_round} in room {room_code}: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'scheduled': len(self._deadlines),
+                'heap_size': len(self._heap),
+                'expired': self.expired,
+            }
@@ -0,0 +1,95 @@
+"""
+Saving player drawings.
+
+Drawings arrive as raw bytes: a Socket.IO binary attachment, a raw image
+POST body or a multipart file. Every form goes to disk in chunks through a
+temporary file, with the size capped and the type checked from the magic
+bytes instead of trusting the client. The bytes are handed back to the
+caller so the description step does not read the file again.
+
+Old clients still send base64 data URLs; read_data_url() decodes those.
+"""
+import base64
+import binascii
+import os
+import uuid
+
+from ingest import CHUNK_SIZE, sniff_image_type
+
+MAX_UPLOAD_BYTES = 5 * 1024 * 1024
+
+BYTES_LIKE = (bytes, bytearray, memoryview)
+
+
+class UploadError(Exception):
+    """Raised when an upload is not an image we can save"""
+
+
+class UploadTooLarge(UploadError):
+    """Raised when an upload is over the size limit"""
+
+
+def read_data_url(value, max_bytes=MAX_UPLOAD_BYTES):
+    """Decode a legacy "data:image/png;base64,..." string to bytes"""
+    start = value.find(',') + 1
+    # base64 is 4 characters per 3 bytes; refuse before decoding anything
+    if (len(value) - start) * 3 // 4 > max_bytes:
+        raise UploadTooLarge(f"Upload larger than {max_bytes} bytes")
+    try:
+        return base64.b64decode(memoryview(value.encode('ascii'))[start:], validate=True)
+    except (binascii.Error, UnicodeEncodeError) as e:
+        raise UploadError(f"Bad data URL: {e}") from e
+
+
+def _chunks(source, max_bytes):
+    if isinstance(source, BYTES_LIKE):
+        view = memoryview(source)
+        if view.nbytes > max_bytes:
+            raise UploadTooLarge(f"Upload larger than {max_bytes} bytes")
+        for start in range(0, view.nbytes, CHUNK_SIZE):
+            yield view[start:start + CHUNK_SIZE]
+        return
+    total = 0
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        total += len(chunk)
+        if total > max_bytes:
+            raise UploadTooLarge(f"Upload larger than {max_bytes} bytes")
+        yield chunk
+
+
+def save_upload(source, save_dir, stem, max_bytes=MAX_UPLOAD_BYTES):
+    """
+    Write an uploaded image to save_dir as <stem>.<detected extension>.
+    source is a bytes-like object or a binary stream with read().
+    Returns (path, data) where data holds the image bytes; raises UploadError.
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    temp_path = os.path.join(save_dir, f".{uuid.uuid4()}.part")
+    # Bytes we were given are returned as they are; streams are collected as they go by
+    data = source if isinstance(source, BYTES_LIKE) else bytearray()
+    extension = None
+
+    try:
+        with open(temp_path, 'wb') as f:
+            for chunk in _chunks(source, max_bytes):
+                if extension is None:
+                    extension = sniff_image_type(bytes(chunk[:16]))
+                    if extension is None:
+                        raise UploadError(f"Not an image (starts with {bytes(chunk[:8])!r})")
+                f.write(chunk)
+                if data is not source:
+                    data += chunk
+
+        if extension is None:
+            raise UploadError("Empty upload")
+
+        path = os.path.join(save_dir, f"{stem}.{extension}")
+        os.replace(temp_path, path)
+        return path, data
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
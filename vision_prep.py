@@ -0,0 +1,114 @@
+"""
+Preparing drawings for the vision model.
+
+A rough line drawing needs far fewer pixels than the canvas it was drawn
+on. Before a drawing is described it is cropped to the ink (plus a small
+margin), scaled down as far as its thinnest line allows, reduced to a few
+colours and encoded as PNG. If it still reads at one 512 px tile the
+request asks for detail "low", a flat 85 tokens; otherwise "high", never
+larger than the model would scale it to anyway.
+
+Stroke drawings are rendered straight at the chosen size and crop. For
+uploaded images the line width is estimated from the ink itself.
+"""
+import io
+
+import numpy as np
+from PIL import Image
+
+import strokes
+
+LOW_DETAIL_SIDE = 512  # detail "low": the model sees the image as one 512 px square
+HIGH_DETAIL_SHORT_SIDE = 768  # detail "high" scales the short side down to this
+HIGH_DETAIL_LONG_SIDE = 2048  # and the long side down to this first
+MIN_LINE_PX = 2  # thinnest a line may get after scaling
+MARGIN = 0.04  # blank border kept around the ink, as a fraction of its long side
+PALETTE_COLORS = 8
+INK_THRESHOLD = 32  # channel difference from white that counts as ink
+BLANK_SIZE = (64, 64)
+
+
+def plan(width, height, min_line):
+    """(scale, detail) for width x height px of ink whose thinnest line is min_line px"""
+    low_scale = LOW_DETAIL_SIDE / max(width, height)
+    if min_line * low_scale >= MIN_LINE_PX:
+        # Fits one tile without losing lines; never blow a small drawing up
+        return min(1.0, low_scale), 'low'
+    scale = min(1.0, MIN_LINE_PX / min_line,
+                HIGH_DETAIL_SHORT_SIDE / min(width, height), HIGH_DETAIL_LONG_SIDE / max(width, height))
+    return scale, 'high'
+
+
+def encode(image):
+    """Palette PNG with at most PALETTE_COLORS colours, without dithering so lines stay solid"""
+    # Octree keeps small but saturated colours (a few black lines) that median cut averages away
+    quantized = image.quantize(colors=PALETTE_COLORS, method=Image.Quantize.FASTOCTREE, dither=Image.Dither.NONE)
+    out = io.BytesIO()
+    quantized.save(out, format='PNG', optimize=True)
+    return out.getvalue()
+
+
+def _blank():
+    return encode(Image.new('RGB', BLANK_SIZE, strokes.BACKGROUND)), 'low'
+
+
+def _with_margin(box, limit=None):
+    left, top, right, bottom = box
+    pad = max(2, round(MARGIN * max(right - left, bottom - top)))
+    box = (left - pad, top - pad, right + pad, bottom + pad)
+    if limit is not None:
+        box = (max(box[0], 0), max(box[1], 0), min(box[2], limit[0]), min(box[3], limit[1]))
+    return box
+
+
+def prepare_strokes(drawing):
+    """Render a parsed stroke drawing for the vision model; returns (png_bytes, detail)"""
+    box = strokes.bounds(drawing)
+    if box is None:
+        return _blank()
+    min_line = min(stroke['w'] for stroke in drawing['strokes'] if stroke['c'] is not None)
+    box = _with_margin(box, limit=(drawing['width'], drawing['height']))
+    scale, detail = plan(box[2] - box[0], box[3] - box[1], min_line)
+    return encode(strokes.render(drawing, scale, box)), detail
+
+
+def estimate_line_width(ink):
+    """Typical line thickness in a boolean ink mask: a low percentile of ink runs along rows and columns"""
+    runs = []
+    for mask in (ink, ink.T):
+        edges = np.diff(np.pad(mask, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+        # Starts and ends come out in the same row-major order, so they pair up
+        runs.append(np.nonzero(edges == -1)[1] - np.nonzero(edges == 1)[1])
+    runs = np.concatenate(runs)
+    return float(np.percentile(runs, 25)) if runs.size else 1.0
+
+
+def prepare_image(data):
+    """Crop, scale and quantize an uploaded drawing; returns (png_bytes, detail)"""
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except (OSError, ValueError):
+        # Not something Pillow can read: send it as it came
+        return bytes(data), 'high'
+
+    if image.mode in ('RGBA', 'LA', 'P'):
+        # Transparent pixels (the old eraser) are background
+        background = Image.new('RGBA', image.size, strokes.BACKGROUND + (255,))
+        image = Image.alpha_composite(background, image.convert('RGBA'))
+    image = image.convert('RGB')
+
+    pixels = np.asarray(image)
+    ink = (255 - pixels).max(axis=2) > INK_THRESHOLD
+    rows = np.nonzero(ink.any(axis=1))[0]
+    cols = np.nonzero(ink.any(axis=0))[0]
+    if not rows.size:
+        return _blank()
+
+    box = _with_margin((int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1), limit=image.size)
+    scale, detail = plan(box[2] - box[0], box[3] - box[1],
+                         estimate_line_width(ink[box[1]:box[3], box[0]:box[2]]))
+    image = image.crop(box)
+    if scale < 1.0:
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.LANCZOS)
+    return encode(image), detail